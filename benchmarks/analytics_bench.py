@@ -0,0 +1,187 @@
+"""Analytics engine benchmark.
+
+Seeds a throwaway SQLite database with synthetic sales spread over a year
+and times ``compute_analytics`` with the SQL engine and the NumPy engine at
+each requested size, next to the old per-object loops for reference.
+
+    python benchmarks/analytics_bench.py --sizes 100000,1000000,5000000
+    python benchmarks/analytics_bench.py --sizes 100000 --days 365 --repeat 5
+
+Both engines must produce the same output; the script checks that before
+reporting timings. Seeding is not timed.
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+ENGINES = ("sql", "numpy")
+# The legacy loops only compute the sales aggregates, so they are timed but not compared.
+REFERENCE = "loops"
+_SEED_CHUNK = 50_000
+
+
+def _seed(app, sales: int, items: int, rng: random.Random) -> None:
+    from sqlalchemy import insert
+
+    from shopapp.extensions import db
+    from shopapp.models import Item, Sale, SaleItem
+    from shopapp.utils.localtime import backfill_local_dates
+    from shopapp.utils.rollups import rebuild_rollups
+
+    names = [f"Bench item {i:05d}" for i in range(items)]
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.execute(insert(Item), [
+            {"name": name, "price": 10.0, "current_stock": rng.randint(0, 50), "reorder_level": 5}
+            for name in names
+        ])
+        for start in range(0, sales, _SEED_CHUNK):
+            rows = [
+                {
+                    "id": n + 1,
+                    "date": now - timedelta(seconds=rng.randint(0, 365 * 86400)),
+                    "item": rng.choice(names),
+                    "quantity": rng.randint(1, 5),
+                    "total": 0.0,
+                    "net_total": round(rng.uniform(10, 2000), 2),
+                    "discount": 0.0,
+                    "tax": 0.0,
+                    "payment_method": "cash",
+                    "invoice_number": f"BENCH-{n:09d}",
+                }
+                for n in range(start, min(sales, start + _SEED_CHUNK))
+            ]
+            db.session.execute(insert(Sale), rows)
+            # Item metrics read the sale lines, so give every sale its one line.
+            db.session.execute(insert(SaleItem), [
+                {"sale_id": row["id"], "description": row["item"], "qty": row["quantity"], "line_total": row["net_total"]}
+                for row in rows
+            ])
+            db.session.commit()
+        backfill_local_dates()
+        rebuild_rollups()
+        db.session.commit()
+
+
+def _comparable(result: Dict[str, object]) -> Dict[str, object]:
+    # The NumPy engine truncates last-sale times to the second and sums in a
+    # different order, so compare rounded figures only.
+    heatmap = result["heatmap"]
+    return {
+        **result,
+        "heatmap": [[round(value, 2) for value in row] for row in heatmap["matrix"]],
+    }
+
+
+def _legacy_loops(days: int) -> None:
+    """The per-object loops ``load_analytics`` used before the SQL engine, for reference."""
+    from shopapp.models import Item, Sale
+
+    start = datetime.utcnow() - timedelta(days=days)
+    sales = Sale.query.filter(Sale.date >= start).order_by(Sale.date.asc()).all()
+    daily: Dict[object, List[float]] = {}
+    for sale in sales:
+        row = daily.setdefault(sale.date.date(), [0.0, 0.0, 0.0])
+        row[0] += float(sale.net_total or 0)
+        row[1] += float(sale.discount or 0)
+        row[2] += float(sale.tax or 0)
+    matrix = [[0.0] * 24 for _ in range(7)]
+    recent = datetime.utcnow() - timedelta(days=30)
+    for sale in sales:
+        if sale.date >= recent:
+            matrix[sale.date.weekday()][sale.date.hour] += float(sale.net_total or 0)
+    metrics = {item.name.lower(): [0, 0.0, 0, None] for item in Item.query.all()}
+    for sale in sales:
+        entry = metrics.get((sale.item or "").lower())
+        if entry is not None:
+            entry[0] += int(sale.quantity or 0)
+            entry[1] += float(sale.net_total or 0)
+            entry[2] += 1
+            entry[3] = sale.date if entry[3] is None or sale.date > entry[3] else entry[3]
+
+
+def _time(app, engine: str, days: int, repeat: int) -> Dict[str, object]:
+    from shopapp.extensions import db
+    from shopapp.utils.analytics import compute_analytics
+
+    app.config["ANALYTICS_ENGINE"] = engine
+    timings: List[float] = []
+    result = None
+    with app.app_context():
+        for _ in range(repeat):
+            started = time.perf_counter()
+            if engine == "loops":
+                _legacy_loops(days)
+            else:
+                result = compute_analytics(days=days)
+            timings.append(time.perf_counter() - started)
+            db.session.remove()
+    return {"median_s": statistics.median(timings), "best_s": min(timings), "result": result}
+
+
+def run_size(size: int, args: argparse.Namespace) -> Dict[str, Dict[str, object]]:
+    workdir = Path(tempfile.mkdtemp(prefix="analytics-bench-"))
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'bench.db'}"
+    os.chdir(workdir)
+    sys.path.insert(0, str(ROOT))
+
+    from shopapp import create_app
+    from shopapp.extensions import scheduler
+
+    try:
+        app = create_app()
+        seed_started = time.perf_counter()
+        _seed(app, size, args.items, random.Random(args.seed))
+        print(f"seeded {size:,} sales in {time.perf_counter() - seed_started:.1f}s", file=sys.stderr)
+        engines = ENGINES + ((REFERENCE,) if size <= args.loops_max else ())
+        timings = {engine: _time(app, engine, args.days, args.repeat) for engine in engines}
+    finally:
+        if scheduler.running:
+            scheduler.shutdown(wait=True)
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sql_result, numpy_result = (_comparable(timings[engine].pop("result")) for engine in ENGINES)
+    mismatched = sorted(key for key in sql_result if key != "recommendations" and sql_result[key] != numpy_result[key])
+    if mismatched:
+        raise SystemExit(f"Engines disagree at {size:,} sales on: {', '.join(mismatched)}")
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="100000,1000000,5000000", help="comma-separated sale counts")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365, help="analytics window in days")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--loops-max", type=int, default=1_000_000,
+                        help="largest size to also time the legacy per-object loops at")
+    args = parser.parse_args(argv)
+
+    # DATABASE_URL is read when shopapp is imported, so every size gets a
+    # fresh interpreter and database.
+    context = multiprocessing.get_context("spawn")
+    print(f"{'sales':>10} {'loops':>9} {'sql':>9} {'numpy':>9}")
+    for size in (int(value) for value in args.sizes.split(",") if value.strip()):
+        with context.Pool(1) as pool:
+            timings = pool.apply(run_size, (size, args))
+        loops = f"{timings[REFERENCE]['median_s']:>8.3f}s" if REFERENCE in timings else f"{'-':>9}"
+        print(f"{size:>10,} {loops} {timings['sql']['median_s']:>8.3f}s {timings['numpy']['median_s']:>8.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
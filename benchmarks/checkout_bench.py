@@ -0,0 +1,344 @@
+"""Checkout latency and concurrency benchmark.
+
+Seeds a throwaway SQLite database, then drives ``/app/sell`` and
+``POST /api/sales`` through the Flask test client, first with a single
+cashier and then with N concurrent cashiers. For every scenario it reports
+p50/p95/p99 latency, SQL statements per checkout, time spent in write
+statements and an estimate of lock wait.
+
+    python benchmarks/checkout_bench.py --cashiers 4 --checkouts 200
+    python benchmarks/checkout_bench.py --save benchmarks/baseline.json
+    python benchmarks/checkout_bench.py --compare benchmarks/baseline.json
+
+Lock wait is estimated as the write-statement time of a checkout minus the
+median write time of the single-cashier run for the same endpoint: SQLite
+blocks inside the statement that needs the lock, so contention shows up
+there. Compare runs from the same machine only.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("web_single", "web_concurrent", "api_single", "api_concurrent")
+COMPARED_METRICS = ("latency_ms.p50", "latency_ms.p95", "latency_ms.p99", "sql_per_checkout.mean")
+# Only these fail a comparison; p50/p99 are printed for context but are too
+# noisy at the default sample size to gate on.
+GATED_METRICS = ("latency_ms.p95", "sql_per_checkout.mean")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "mean": round(statistics.fmean(values), 3) if values else 0.0,
+        "p50": round(_percentile(values, 50), 3),
+        "p95": round(_percentile(values, 95), 3),
+        "p99": round(_percentile(values, 99), 3),
+        "max": round(max(values), 3) if values else 0.0,
+    }
+
+
+class SqlProbe:
+    """Counts statements and write time for the checkout running on this thread."""
+
+    WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+    def __init__(self, engine) -> None:
+        from sqlalchemy import event
+
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def start(self) -> None:
+        self._local.active = True
+        self._local.statements = 0
+        self._local.write_seconds = 0.0
+
+    def stop(self) -> Dict[str, float]:
+        self._local.active = False
+        return {"statements": self._local.statements, "write_ms": self._local.write_seconds * 1000.0}
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if getattr(self._local, "active", False):
+            self._local.statements += 1
+            self._local.started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if getattr(self._local, "active", False) and statement.lstrip().upper().startswith(self.WRITE_PREFIXES):
+            self._local.write_seconds += time.perf_counter() - self._local.started
+
+
+def _seed(app, items: int, customers: int, history: int, rng: random.Random) -> List[int]:
+    from sqlalchemy import insert
+
+    from shopapp.extensions import db
+    from shopapp.models import Customer, Item, Sale
+
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.execute(insert(Item), [
+            {
+                "name": f"Bench item {i:05d}",
+                "price": round(rng.uniform(5, 500), 2),
+                "current_stock": 10_000_000,
+                "gst_rate": rng.choice([0, 5, 12, 18]),
+                "barcode": f"BENCH{i:07d}",
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(items)
+        ])
+        db.session.execute(insert(Customer), [
+            {"name": f"Bench customer {i:05d}", "phone": f"9{i:09d}", "state": "DL", "created_at": now, "updated_at": now}
+            for i in range(customers)
+        ])
+        for start in range(0, history, 5000):
+            db.session.execute(insert(Sale), [
+                {
+                    "date": now - timedelta(minutes=rng.randint(60, 60 * 24 * 365)),
+                    "item": f"Bench item {rng.randrange(items):05d}",
+                    "quantity": 1,
+                    "total": 100.0,
+                    "net_total": 100.0,
+                    "tax": 0.0,
+                    "payment_method": rng.choice(["cash", "upi", "card"]),
+                    "invoice_number": f"HIST-{n:08d}",
+                }
+                for n in range(start, min(history, start + 5000))
+            ])
+        db.session.commit()
+        return [item_id for (item_id,) in db.session.query(Item.id).all()]
+
+
+def _cart(rng: random.Random, item_ids: List[int], max_lines: int) -> List[Dict[str, int]]:
+    picks = rng.sample(item_ids, k=rng.randint(1, min(max_lines, len(item_ids))))
+    return [{"item_id": item_id, "quantity": rng.randint(1, 3)} for item_id in picks]
+
+
+def _web_client(app):
+    client = app.test_client()
+    client.post("/login", data={
+        "username": app.config["DEFAULT_ADMIN_USERNAME"],
+        "password": app.config["DEFAULT_ADMIN_PASSWORD"],
+    })
+    return client, {}
+
+
+def _api_client(app):
+    client = app.test_client()
+    response = client.post("/api/auth/login", json={
+        "username": app.config["DEFAULT_ADMIN_USERNAME"],
+        "password": app.config["DEFAULT_ADMIN_PASSWORD"],
+    })
+    token = response.get_json()["token"]
+    return client, {"Authorization": f"Bearer {token}"}
+
+
+def _checkout(kind: str, client, headers, cart) -> int:
+    if kind == "web":
+        data = {
+            "item_id": [str(line["item_id"]) for line in cart],
+            "quantity": [str(line["quantity"]) for line in cart],
+            "payment_method": "cash",
+        }
+        return client.post("/app/sell", data=data, headers=headers).status_code
+    return client.post("/api/sales", json={"lines": cart, "payment_method": "cash"}, headers=headers).status_code
+
+
+def _run(app, probe: SqlProbe, kind: str, cashiers: int, checkouts: int, item_ids: List[int],
+         max_lines: int, seed: int) -> Dict[str, Any]:
+    samples: List[Dict[str, float]] = []
+    errors: List[int] = []
+    lock = threading.Lock()
+    per_cashier = [checkouts // cashiers + (1 if i < checkouts % cashiers else 0) for i in range(cashiers)]
+    barrier = threading.Barrier(cashiers)
+
+    def cashier(index: int) -> None:
+        rng = random.Random(seed + index)
+        client, headers = (_web_client if kind == "web" else _api_client)(app)
+        barrier.wait()
+        for _ in range(per_cashier[index]):
+            cart = _cart(rng, item_ids, max_lines)
+            probe.start()
+            started = time.perf_counter()
+            status = _checkout(kind, client, headers, cart)
+            elapsed = (time.perf_counter() - started) * 1000.0
+            stats = probe.stop()
+            with lock:
+                if status >= 400:
+                    errors.append(status)
+                else:
+                    samples.append({"latency_ms": elapsed, **stats})
+
+    wall_started = time.perf_counter()
+    threads = [threading.Thread(target=cashier, args=(i,)) for i in range(cashiers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_started
+
+    return {
+        "cashiers": cashiers,
+        "checkouts": len(samples),
+        "errors": len(errors),
+        "throughput_per_s": round(len(samples) / wall, 2) if wall else 0.0,
+        "latency_ms": _summary([s["latency_ms"] for s in samples]),
+        "sql_per_checkout": _summary([s["statements"] for s in samples]),
+        "write_ms": _summary([s["write_ms"] for s in samples]),
+        "_write_samples": [s["write_ms"] for s in samples],
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = Path(tempfile.mkdtemp(prefix="checkout-bench-"))
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'bench.db'}"
+    # Invoice PDFs and reports are written relative to the working directory.
+    os.chdir(workdir)
+    sys.path.insert(0, str(ROOT))
+
+    from shopapp import create_app
+    from shopapp.extensions import db, scheduler
+
+    try:
+        app = create_app()
+        app.config["TESTING"] = True
+        rng = random.Random(args.seed)
+        item_ids = _seed(app, args.items, args.customers, args.history, rng)
+        with app.app_context():
+            probe = SqlProbe(db.engine)
+
+        results: Dict[str, Any] = {}
+        for kind in ("web", "api"):
+            if args.endpoint not in ("both", kind):
+                continue
+            single = _run(app, probe, kind, 1, args.checkouts, item_ids, args.max_lines, args.seed)
+            concurrent = _run(app, probe, kind, args.cashiers, args.checkouts, item_ids, args.max_lines, args.seed + 1000)
+            baseline_write = single["write_ms"]["p50"]
+            for scenario in (single, concurrent):
+                waits = [max(0.0, value - baseline_write) for value in scenario.pop("_write_samples")]
+                scenario["lock_wait_ms"] = _summary(waits)
+            results[f"{kind}_single"] = single
+            results[f"{kind}_concurrent"] = concurrent
+    finally:
+        if scheduler.running:
+            # Let queued invoice renders finish before the database goes away.
+            scheduler.shutdown(wait=True)
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "generated_at": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "items": args.items,
+            "customers": args.customers,
+            "history": args.history,
+            "checkouts": args.checkouts,
+            "cashiers": args.cashiers,
+            "max_lines": args.max_lines,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def _metric(scenario: Dict[str, Any], dotted: str) -> Optional[float]:
+    value: Any = scenario
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return float(value)
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """Print metric deltas against a baseline; return False on a regression."""
+    ok = True
+    print(f"{'scenario':<16} {'metric':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for scenario in SCENARIOS:
+        current = report["results"].get(scenario)
+        previous = baseline.get("results", {}).get(scenario)
+        if not current or not previous:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = _metric(previous, metric), _metric(current, metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if metric in GATED_METRICS and change > tolerance:
+                flag = "  REGRESSION"
+                ok = False
+            print(f"{scenario:<16} {metric:<24} {before:>10.2f} {after:>10.2f} {change:>+7.0%}{flag}")
+    return ok
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"{'scenario':<16} {'n':>5} {'err':>4} {'tx/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>6} {'lock p95':>9}")
+    for scenario in SCENARIOS:
+        data = report["results"].get(scenario)
+        if not data:
+            continue
+        latency = data["latency_ms"]
+        print(
+            f"{scenario:<16} {data['checkouts']:>5} {data['errors']:>4} {data['throughput_per_s']:>7.1f} "
+            f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f} "
+            f"{data['sql_per_checkout']['mean']:>6.1f} {data['lock_wait_ms']['p95']:>9.2f}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--history", type=int, default=20000, help="historical sales to seed")
+    parser.add_argument("--checkouts", type=int, default=200, help="checkouts per scenario")
+    parser.add_argument("--cashiers", type=int, default=4, help="concurrent cashiers in the concurrent scenarios")
+    parser.add_argument("--max-lines", type=int, default=4, help="maximum cart lines per checkout")
+    parser.add_argument("--endpoint", choices=("both", "web", "api"), default="both")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--save", type=Path, help="write the report as a JSON baseline")
+    parser.add_argument("--compare", type=Path, help="compare against a saved JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression when comparing")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    _print_report(report)
+    if args.save:
+        args.save.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        print()
+        if not compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
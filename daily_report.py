@@ -1,13 +1,15 @@
 ﻿from __future__ import annotations
 
-from datetime import datetime, timedelta
 from typing import Any, Dict, List
 
 from flask import current_app
 from sqlalchemy import func
 
 from shopapp.extensions import db
-from shopapp.models import Credit, Item, Sale, Setting
+from shopapp.models import Credit, Item, Sale, SaleItem, Setting
+from shopapp.reports.zreport import snapshot_zreport
+from shopapp.utils.localtime import local_today
+from shopapp.utils.prefix_sums import extend_prefix_sums
 from shopapp.utils.audit import log_event
 from shopapp.utils.mail import send_mail
 
@@ -17,9 +19,7 @@ def _format_currency(value: float) -> str:
 
 
 def generate_summary() -> Dict[str, Any]:
-    today = datetime.utcnow().date()
-    start = datetime(today.year, today.month, today.day)
-    end = start + timedelta(days=1)
+    today = local_today()
 
     revenue, discount, tax, count = (
         db.session.query(
@@ -28,15 +28,16 @@ def generate_summary() -> Dict[str, Any]:
             func.coalesce(func.sum(Sale.tax), 0),
             func.count(Sale.id),
         )
-        .filter(Sale.date >= start, Sale.date < end)
+        .filter(Sale.local_date == today)
         .one()
     )
 
     best_item = (
-        db.session.query(Sale.item, func.sum(Sale.quantity).label("qty"))
-        .filter(Sale.date >= start, Sale.date < end)
-        .group_by(Sale.item)
-        .order_by(func.sum(Sale.quantity).desc())
+        db.session.query(SaleItem.description, func.sum(SaleItem.qty).label("qty"))
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .filter(Sale.local_date == today)
+        .group_by(SaleItem.description)
+        .order_by(func.sum(SaleItem.qty).desc())
         .first()
     )
 
@@ -109,8 +110,8 @@ def build_email(summary: Dict[str, Any]) -> str:
 
 
 def lock_sales_for_today() -> None:
-    now = datetime.utcnow()
-    today = now.strftime("%Y-%m-%d")
+    local_day = local_today()
+    today = local_day.isoformat()
     record = Setting.query.filter_by(key="sales_lock_date").first()
     previous_lock = record.value if record and record.value else None
     if not record:
@@ -127,14 +128,16 @@ def lock_sales_for_today() -> None:
     else:
         reason.value = auto_message
 
-    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    end = start + timedelta(days=1)
     locked_count = (
-        Sale.query.filter(Sale.date >= start, Sale.date < end)
+        Sale.query.filter(Sale.local_date == local_day)
         .update({"locked": True}, synchronize_session=False)
         or 0
     )
 
+    # The day is closed: freeze its Z-report so later views read the snapshot.
+    snapshot_zreport(local_day)
+    extend_prefix_sums()
+
     log_event(
         "sales_lock_auto",
         resource_type="sales",
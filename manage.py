@@ -1,6 +1,9 @@
 from app import create_app
 
-app = create_app()
+# Bulk invoice render workers re-import this script as __mp_main__; they need
+# no app of their own, and must not start a second scheduler.
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -1,3 +1,4 @@
+import atexit
 from datetime import datetime, timedelta
 from decimal import Decimal
 from pathlib import Path
@@ -12,6 +13,7 @@ from .settings import settings_bp
 from .assistant import assistant_bp
 from .auth.routes import auth_bp
 from .sales.routes import sales_bp
+from .sales.services import backfill_sale_lines_if_needed
 from .reports.routes import reports_bp
 from .inventory.routes import inventory_bp
 from .expenses.routes import expenses_bp
@@ -20,10 +22,20 @@ from .customers.routes import customers_bp
 from .engagement import bp as engagement_bp
 from .webhooks import webhooks_bp
 from .cli import register_cli
+from .utils.export_jobs import fail_stale_exports, purge_expired_exports
+from .utils.idempotency import idempotency_field, purge_expired_keys
+from .utils.invoices import release_invoice_blocks
+from .utils.localtime import shop_zone
 from .utils.mail import init_mail_settings
 from .utils.feature_flags import feature_enabled, get_active_plan, reset_cache as reset_plan_cache
 from .utils.flags import flags
 from .utils.nudges import send_streak_reminder
+from .utils.pdfs import evict_invoice_store
+from .utils.customer_metrics import backfill_customer_metrics_if_empty
+from .utils.forecasting import backfill_forecasts_if_empty, refresh_item_forecasts
+from .utils.localtime import backfill_local_dates_if_needed
+from .utils.prefix_sums import extend_prefix_sums
+from .utils.rollups import backfill_rollups_if_empty, rebuild_rollups
 from .utils.subscription import get_subscription_context
 from .onboarding import onboarding_bp
 from .compliance import compliance_bp
@@ -37,7 +49,7 @@ from sqlalchemy import func, inspect, text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import joinedload
 
-from .utils.schema import ensure_columns
+from .utils.schema import ensure_columns, ensure_indexes
 from .models import FeatureFlag, Plan, PlanFeature, Quest, Setting, ShopLocation, ShopProfile, User, UserRole
 from .plans import BASE_FEATURES
 
@@ -81,6 +93,9 @@ SCHEMA_PATCHES = {
         "signed_invoice_path": "signed_invoice_path VARCHAR(255)",
         "eway_bill_no": "eway_bill_no VARCHAR(64)",
         "eway_valid_upto": "eway_valid_upto DATETIME",
+        "invoice_render_status": "invoice_render_status VARCHAR(20) DEFAULT 'pending'",
+        "local_date": "local_date DATE",
+        "local_hour": "local_hour SMALLINT",
     },
     "audit_log": {
         "resource_type": "resource_type VARCHAR(64)",
@@ -105,7 +120,11 @@ SCHEMA_PATCHES = {
         "last_sent_at": "last_sent_at DATETIME"
     },
     "expenses": {
-        "category_id": "category_id INTEGER"
+        "category_id": "category_id INTEGER",
+        "updated_at": "updated_at DATETIME"
+    },
+    "expense_categories": {
+        "updated_at": "updated_at DATETIME"
     },
     "credits": {
         "customer_id": "customer_id INTEGER",
@@ -134,6 +153,24 @@ SCHEMA_PATCHES = {
     },
 }
 
+SCHEMA_INDEXES = {
+    "items": {
+        "ix_items_updated_at": "updated_at",
+        "ix_items_barcode": "barcode",
+    },
+    "customers": {
+        "ix_customers_updated_at": "updated_at",
+        "ix_customers_phone": "phone",
+    },
+    "sales": {
+        "ix_sales_date": "date",
+        "ix_sales_local_date": "local_date, local_hour",
+    },
+    "expenses": {
+        "ix_expenses_date": "date",
+    },
+}
+
 PLAN_PRESETS: dict[str, dict[str, object]] = {
     "free": {
         "name": "Free",
@@ -223,12 +260,26 @@ def _bootstrap_app(app: Flask) -> None:
 
     db.create_all()
 
+    for table, indexes in SCHEMA_INDEXES.items():
+        ensure_indexes(engine, table, indexes)
+
     with engine.begin() as conn:
         conn.execute(text("UPDATE items SET updated_at = COALESCE(updated_at, CURRENT_TIMESTAMP)"))
         conn.execute(text("UPDATE customers SET updated_at = COALESCE(updated_at, CURRENT_TIMESTAMP)"))
 
     _seed_plans()
     _seed_engagement_objects()
+    if backfill_local_dates_if_needed():
+        # Rollups written before sales carried a local day are keyed by UTC day.
+        rebuild_rollups()
+        db.session.commit()
+    backfill_sale_lines_if_needed()
+    backfill_rollups_if_empty()
+    backfill_customer_metrics_if_empty()
+    backfill_forecasts_if_empty()
+    fail_stale_exports()
+    if extend_prefix_sums():
+        db.session.commit()
 
     profile = ShopProfile.query.get(1)
     if profile is None:
@@ -414,6 +465,7 @@ def create_app(config_object: type[Config] | None = None) -> Flask:
     app.jinja_env.globals["can_access"] = can_access
     app.jinja_env.globals["current_role"] = get_current_role
     app.jinja_env.globals["flags"] = flags
+    app.jinja_env.globals["idempotency_field"] = idempotency_field
 
     db.init_app(app)
     migrate.init_app(app, db)
@@ -485,11 +537,26 @@ def create_app(config_object: type[Config] | None = None) -> Flask:
                         continue
 
             _schedule_job(_run_streak_nudges, trigger='cron', hour=17, minute=0)
-            _schedule_job(daily_report.send_daily_report, trigger='cron', hour=22, minute=0)
+            # The report locks and snapshots the shop-local day, so it must
+            # fire at 22:00 shop time, not server time.
+            _schedule_job(daily_report.send_daily_report, trigger='cron', hour=22, minute=0, timezone=shop_zone())
             _schedule_job(send_credit_reminders, trigger='cron', hour=18, minute=0)
             _schedule_job(drive_backup.backup_to_drive, trigger='cron', hour=23, minute=59)
+            _schedule_job(purge_expired_keys, trigger='interval', hours=1)
+            _schedule_job(purge_expired_exports, trigger='interval', hours=1)
+            _schedule_job(evict_invoice_store, trigger='interval', hours=1)
+            _schedule_job(refresh_item_forecasts, trigger='cron', hour=0, minute=30)
             scheduler.start()
             app.apscheduler = scheduler
 
+    def _release_invoice_blocks() -> None:
+        with app.app_context():
+            try:
+                release_invoice_blocks()
+            except SQLAlchemyError:
+                db.session.rollback()
+
+    atexit.register(_release_invoice_blocks)
+
     return app
 
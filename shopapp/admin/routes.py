@@ -1,11 +1,11 @@
 import json
-from datetime import datetime
+import os
 
-from flask import Blueprint, make_response, render_template, request
+from flask import Blueprint, abort, jsonify, redirect, render_template, request, send_file, session, url_for
 from sqlalchemy import or_
 
-from ..models import AuditLog, User
-from ..utils.exports import build_audit_log_csv, generate_ca_bundle
+from ..models import AuditLog, ExportJob, User
+from ..utils.export_jobs import export_job_payload, export_mimetype, request_export
 from ..utils.decorators import admin_required, login_required
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
@@ -103,30 +103,68 @@ def audit_log():
     )
 
 
-@admin_bp.route("/audit-log/export.csv")
+def _wants_json() -> bool:
+    return request.is_json or request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json"
+
+
+def _enqueue_export(kind: str, params):
+    try:
+        job = request_export(kind, params, requested_by=session.get("user"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    location = url_for("admin.export_job", job_id=job.id)
+    if _wants_json():
+        return jsonify(export_job_payload(job)), 202, {"Location": location}
+    return redirect(location)
+
+
+@admin_bp.route("/audit-log/export.csv", methods=["GET", "POST"])
 @login_required
 @admin_required
 def audit_log_export():
-    entries = AuditLog.query.order_by(AuditLog.ts.asc()).all()
-    csv_data = build_audit_log_csv(entries)
-    response = make_response(csv_data)
-    response.headers["Content-Type"] = "text/csv"
-    stamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    response.headers["Content-Disposition"] = f"attachment; filename=audit_log_{stamp}.csv"
-    return response
+    return _enqueue_export("audit_log", {})
 
 
-@admin_bp.route("/exports/ca-bundle")
+@admin_bp.route("/exports/ca-bundle", methods=["GET", "POST"])
 @login_required
 @admin_required
 def export_ca_bundle():
-    try:
-        days = int(request.args.get("days", 30))
-    except (TypeError, ValueError):
-        days = 30
-
-    bundle_bytes, filename = generate_ca_bundle(days=days)
-    response = make_response(bundle_bytes)
-    response.headers["Content-Type"] = "application/zip"
-    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-    return response
+    return _enqueue_export("ca_bundle", request.values)
+
+
+@admin_bp.route("/exports", methods=["POST"])
+@login_required
+@admin_required
+def create_export():
+    data = request.get_json(silent=True) or request.form
+    return _enqueue_export(str(data.get("kind") or ""), data)
+
+
+@admin_bp.route("/exports/<int:job_id>")
+@login_required
+@admin_required
+def export_job(job_id: int):
+    job = ExportJob.query.get_or_404(job_id)
+    payload = export_job_payload(job)
+    if _wants_json():
+        return jsonify(payload)
+    return render_template("admin/export_job.html", job=job, payload=payload)
+
+
+@admin_bp.route("/exports/<int:job_id>/download")
+@login_required
+@admin_required
+def export_download(job_id: int):
+    job = ExportJob.query.get_or_404(job_id)
+    if job.status != "ready" or not job.path or not os.path.exists(job.path):
+        abort(404)
+    # conditional=True answers Range and If-Range requests, so downloads resume.
+    return send_file(
+        job.path,
+        mimetype=export_mimetype(job),
+        as_attachment=True,
+        download_name=job.filename,
+        conditional=True,
+        etag=job.fingerprint,
+        max_age=0,
+    )
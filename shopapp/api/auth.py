@@ -3,7 +3,7 @@ from __future__ import annotations
 from functools import wraps
 from typing import Callable, Optional, Tuple
 
-from flask import Request, abort, g, request
+from flask import Request, abort, g, request, session
 
 from ..models import UserSession
 
@@ -39,3 +39,14 @@ def token_required(fn: Callable) -> Callable:
         return fn(*args, **kwargs)
 
     return wrapper
+
+
+def token_or_login_required(fn: Callable) -> Callable:
+    """Accept either a bearer token or the signed-in web session (for the POS screen)."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if "user" in session:
+            return fn(*args, **kwargs)
+        return token_required(fn)(*args, **kwargs)
+
+    return wrapper
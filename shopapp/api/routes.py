@@ -1,19 +1,25 @@
 from __future__ import annotations
 
+import json
 import secrets
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional, Tuple
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from sqlalchemy import func
 
 from ..extensions import db
-from ..models import (Credit, Customer, Item, PaymentIntent, PaymentTransaction, Sale,
+from ..models import (Customer, Item, PaymentIntent, PaymentTransaction, Sale,
                       ShopProfile, User, UserSession)
-from ..utils.invoices import next_invoice_number
-from ..utils.pdfs import create_invoice_pdf
+from ..utils.barcodes import lookup_barcode
+from ..utils.idempotency import idempotent
+from ..utils.pdfs import queue_invoice_render
+from ..utils.search import SEARCH_KINDS, search_catalogue
+from ..utils.shop_config import get_shop_config
 from ..payments import get_payments_service
-from .auth import token_required
+from ..sales.ingest import INGEST_MODES, ingest_sales
+from ..sales.services import CheckoutError, build_cart, checkout, resolve_customer
+from .auth import token_or_login_required, token_required
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 
@@ -184,6 +190,33 @@ def customers():
     return jsonify({"customers": payload, "count": len(payload), "next_cursor": next_cursor})
 
 
+@api_bp.get("/pos/search")
+@token_or_login_required
+def pos_search():
+    query = (request.args.get("q") or "").strip()
+    kind = (request.args.get("type") or "").lower()
+    if kind and kind not in SEARCH_KINDS:
+        return jsonify({"error": f"type must be one of {', '.join(SEARCH_KINDS)}."}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), 50))
+    except (TypeError, ValueError):
+        limit = 20
+    results = search_catalogue(query, kinds=(kind,) if kind else SEARCH_KINDS, limit=limit)
+    return jsonify({"query": query, "results": results, "count": len(results)})
+
+
+@api_bp.get("/pos/scan")
+@token_or_login_required
+def pos_scan():
+    code = (request.args.get("code") or "").strip()
+    if not code:
+        return jsonify({"error": "code is required."}), 400
+    item = lookup_barcode(code)
+    if not item:
+        return jsonify({"error": "Unknown barcode."}), 404
+    return jsonify(item)
+
+
 @api_bp.get("/sales")
 @token_required
 def sales():
@@ -215,95 +248,83 @@ def sales():
 
 @api_bp.post("/sales")
 @token_required
+@idempotent
 def record_sale():
     if not request.is_json:
         return jsonify({"error": "Expected JSON payload."}), 400
 
     payload = request.get_json() or {}
-    item_id = payload.get("item_id")
-    quantity = payload.get("quantity")
     customer_id = payload.get("customer_id")
     customer_name = (payload.get("customer_name") or "").strip()
     payment_method = (payload.get("payment_method") or "cash").lower()
     discount = float(payload.get("discount") or 0)
 
-    if not item_id or not quantity:
-        return jsonify({"error": "item_id and quantity are required."}), 400
+    raw_lines = payload.get("lines")
+    if raw_lines is None:
+        raw_lines = [payload] if payload.get("item_id") or payload.get("quantity") else []
+    if not isinstance(raw_lines, list) or not all(isinstance(line, dict) for line in raw_lines):
+        return jsonify({"error": "lines must be a list of {item_id, quantity} objects."}), 400
 
     try:
-        quantity = int(quantity)
-    except (TypeError, ValueError):
-        return jsonify({"error": "quantity must be an integer."}), 400
-    if quantity <= 0:
-        return jsonify({"error": "quantity must be positive."}), 400
-
-    item = Item.query.get(item_id)
-    if not item:
-        return jsonify({"error": "Item not found."}), 404
-
-    if item.current_stock is not None and quantity > item.current_stock:
-        return jsonify({"error": "Insufficient stock."}), 400
-
-    customer = None
-    if customer_id:
-        customer = Customer.query.get(customer_id)
-    elif customer_name:
-        customer = Customer.query.filter_by(name=customer_name).first()
-        if not customer:
-            customer = Customer(name=customer_name)
-            db.session.add(customer)
-            db.session.flush()
-
-    subtotal = item.price * quantity
-    gst_rate = item.gst_rate or 0
-    taxable = max(subtotal - discount, 0)
-    tax = round(taxable * (gst_rate / 100), 2)
-    net_total = round(taxable + tax, 2)
-
-    if item.current_stock is not None:
-        item.current_stock -= quantity
-
-    profile = ShopProfile.query.get(1)
-    location_id = profile.default_location.id if profile and profile.default_location else None
-
-    sale = Sale(
-        item=item.name,
-        quantity=quantity,
-        total=net_total,
-        customer_id=customer.id if customer else None,
-        payment_method=payment_method,
-        discount=discount,
-        tax=tax,
-        net_total=net_total,
-        invoice_number=next_invoice_number(),
-        location_id=location_id,
-    )
-    db.session.add(sale)
-    db.session.flush()
-
-    if payload.get("sale_type") == "udhar":
-        if not customer and not customer_name:
-            return jsonify({"error": "Customer required for credit sale."}), 400
-        db.session.add(Credit(
-            customer_id=customer.id if customer else None,
-            customer_name=customer.name if customer else customer_name,
-            item=item.name,
-            quantity=quantity,
-            total=net_total,
-            status='unpaid',
-            reminder_phone=(customer.phone if customer and customer.phone else None)
-        ))
+        lines = build_cart((line.get("item_id"), line.get("quantity")) for line in raw_lines)
+        customer = resolve_customer(customer_id, customer_name)
+
+        shop_config = get_shop_config()
+        seller_state = (payload.get("seller_state") or "").strip().upper() or "DL"
+        buyer_state = (payload.get("buyer_state") or "").strip().upper() or (
+            customer.state.upper() if customer and customer.state else seller_state
+        )
+
+        sale = checkout(
+            lines,
+            customer=customer,
+            customer_name=customer_name,
+            payment_method=payment_method,
+            sale_type=(payload.get("sale_type") or "paid").lower(),
+            discount=discount,
+            discount_before_tax=True,
+            seller_state=seller_state,
+            buyer_state=buyer_state,
+            seller_gstin=shop_config.gst or None,
+            buyer_gstin=(customer.gstin if customer and customer.gstin else payload.get("buyer_gstin")),
+            location_id=shop_config.default_location_id,
+            notes=payload.get("notes"),
+        )
+    except CheckoutError as exc:
+        db.session.rollback()
+        return jsonify({"error": exc.message}), exc.status
 
     db.session.commit()
-    create_invoice_pdf(sale.id)
+    queue_invoice_render(sale.id)
     return jsonify({
         "id": sale.id,
         "invoice_number": sale.invoice_number,
-        "total": float(net_total),
+        "total": float(sale.net_total),
+        "lines": len(lines),
         "gst_status": sale.gst_status,
     }), 201
 
 
+@api_bp.post("/sales/bulk")
+@token_required
+def bulk_sales():
+    """Ingest newline-delimited JSON sales and stream back an NDJSON report.
+
+    ``?mode=replay`` (default) takes stock like a live checkout, for sales
+    rung up offline; ``?mode=import`` loads history without touching stock.
+    """
+    mode = (request.args.get("mode") or "replay").lower()
+    if mode not in INGEST_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(INGEST_MODES)}."}), 400
+    chunk_size = current_app.config.get("BULK_INGEST_CHUNK_SIZE", 500)
+
+    def generate():
+        for result in ingest_sales(request.stream, mode=mode, chunk_size=chunk_size):
+            yield json.dumps(result, default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @api_bp.get("/payments/providers")
 @token_required
 def payment_providers():
@@ -313,6 +334,7 @@ def payment_providers():
 
 @api_bp.post("/payments/intents")
 @token_required
+@idempotent
 def create_payment_intent():
     if not request.is_json:
         return jsonify({"error": "Expected JSON payload."}), 400
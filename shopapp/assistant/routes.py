@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
 import json
 
 from flask import Blueprint, jsonify, make_response, render_template, request, session as flask_session
@@ -11,31 +10,26 @@ from ..models import (AssistantMessage, AssistantSession, Credit, Expense,
                       Item, Sale)
 from ..utils.analytics import load_analytics
 from ..utils.decorators import login_required
+from ..utils.localtime import local_today
 
 assistant_bp = Blueprint("assistant", __name__, url_prefix="/assistant")
 
 OUTSTANDING_STATUSES = ("unpaid", "adjusted")
 
 
-def _today_bounds() -> tuple[datetime, datetime]:
-    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    end = start + timedelta(days=1)
-    return start, end
-
-
 def _today_summary() -> dict[str, float]:
-    start, end = _today_bounds()
+    today = local_today()
     revenue, count = (
         db.session.query(
             func.coalesce(func.sum(Sale.net_total), 0),
             func.count(Sale.id),
         )
-        .filter(Sale.date.between(start, end))
+        .filter(Sale.local_date == today)
         .first()
     )
     expenses = (
         db.session.query(func.coalesce(func.sum(Expense.amount), 0))
-        .filter(Expense.date.between(start.date(), end.date()))
+        .filter(Expense.date == today)
         .scalar()
         or 0
     )
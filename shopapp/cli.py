@@ -4,7 +4,12 @@ import click
 
 from .credits.tasks import send_credit_reminders
 from .extensions import db
-from .models import Otp, ShopProfile, User, UserRole
+from .models import InvoiceNumberGap, Otp, ShopProfile, User, UserRole
+from .utils.customer_metrics import rebuild_customer_metrics
+from .utils.forecasting import compute_item_forecasts
+from .utils.localtime import backfill_local_dates
+from .utils.prefix_sums import extend_prefix_sums
+from .utils.rollups import rebuild_rollups
 
 
 def register_cli(app):
@@ -61,3 +66,61 @@ def register_cli(app):
     def credits_send_reminders():
         sent, failed = send_credit_reminders()
         click.echo(f'Reminders sent: {sent}, failed: {failed}')
+
+    @app.cli.command('invoice-gaps')
+    @click.option('--series', default=None, help='Limit to one series, e.g. INV-20250101.')
+    def invoice_gaps(series):
+        """List invoice numbers that were reserved but never issued."""
+        query = InvoiceNumberGap.query
+        if series:
+            query = query.filter_by(series=series)
+        gaps = query.order_by(InvoiceNumberGap.series.asc(), InvoiceNumberGap.start_number.asc()).all()
+        if not gaps:
+            click.echo('No invoice number gaps recorded.')
+            return
+        for gap in gaps:
+            click.echo(
+                f'{gap.series}: {gap.start_number:05d}-{gap.end_number:05d} '
+                f'({gap.reason or "unknown"}, {gap.recorded_at:%Y-%m-%d %H:%M})'
+            )
+
+    @app.cli.command('rollups-rebuild')
+    @click.option('--since', default=None, help='Only rebuild days from this date on (YYYY-MM-DD).')
+    def rollups_rebuild(since):
+        """Recompute the daily sales rollup from the sales table."""
+        since_day = None
+        if since:
+            try:
+                since_day = datetime.strptime(since, '%Y-%m-%d').date()
+            except ValueError:
+                raise click.BadParameter('Use YYYY-MM-DD.', param_hint='--since')
+        written = rebuild_rollups(since_day)
+        extend_prefix_sums()
+        db.session.commit()
+        scope = f'from {since_day.isoformat()}' if since_day else 'for all days'
+        click.echo(f'Rebuilt {written} rollup row(s) {scope}.')
+
+    @app.cli.command('customer-metrics-rebuild')
+    def customer_metrics_rebuild():
+        """Recompute per-customer order count, lifetime value and purchase dates."""
+        written = rebuild_customer_metrics()
+        db.session.commit()
+        click.echo(f'Rebuilt metrics for {written} customer(s).')
+
+    @app.cli.command('forecasts-refresh')
+    def forecasts_refresh():
+        """Recompute per-item demand forecasts now instead of waiting for the nightly run."""
+        written = compute_item_forecasts()
+        db.session.commit()
+        click.echo(f'Refreshed forecasts for {written} item(s).')
+
+    @app.cli.command('local-dates-backfill')
+    @click.option('--restamp', is_flag=True, help='Recompute every sale, e.g. after changing the shop timezone.')
+    def local_dates_backfill(restamp):
+        """Stamp shop-local day and hour on sales, then rebuild the daily rollup."""
+        updated = backfill_local_dates(restamp=restamp)
+        if updated:
+            rebuild_rollups()
+            extend_prefix_sums()
+            db.session.commit()
+        click.echo(f'Stamped local day and hour on {updated} sale(s).')
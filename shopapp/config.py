@@ -59,6 +59,35 @@ class BaseConfig:
     MAIL_SENDER = os.getenv('MAIL_SENDER', 'no-reply@example.local')
     PERMANENT_SESSION_LIFETIME = timedelta(days=30)
 
+    INVOICE_BLOCK_SIZE = int(os.getenv('INVOICE_BLOCK_SIZE', '20'))
+    STOCK_UPDATE_RETRIES = int(os.getenv('STOCK_UPDATE_RETRIES', '3'))
+    BULK_INGEST_CHUNK_SIZE = int(os.getenv('BULK_INGEST_CHUNK_SIZE', '500'))
+    IDEMPOTENCY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', '24'))
+    POS_SEARCH_REFRESH_SECONDS = int(os.getenv('POS_SEARCH_REFRESH_SECONDS', '5'))
+    BARCODE_SNAPSHOT_TTL = int(os.getenv('BARCODE_SNAPSHOT_TTL', '60'))
+    # "sql" (grouped queries, the default and faster on SQLite per benchmarks/analytics_bench.py)
+    # or "numpy" (column arrays for the heatmap and item metrics; falls back to sql without numpy).
+    ANALYTICS_ENGINE = os.getenv('ANALYTICS_ENGINE', 'sql').lower()
+    # Upper bound on how long a cached analytics payload is served; 0 disables the cache.
+    ANALYTICS_CACHE_TTL = int(os.getenv('ANALYTICS_CACHE_TTL', '300'))
+    # Nightly demand forecast: history window, smoothing factor, supplier lead
+    # time and the stock cover a suggested reorder should restore.
+    FORECAST_WINDOW_DAYS = int(os.getenv('FORECAST_WINDOW_DAYS', '56'))
+    FORECAST_SMOOTHING = float(os.getenv('FORECAST_SMOOTHING', '0.3'))
+    FORECAST_LEAD_DAYS = int(os.getenv('FORECAST_LEAD_DAYS', '7'))
+    FORECAST_COVER_DAYS = int(os.getenv('FORECAST_COVER_DAYS', '21'))
+    # Finished background exports are kept on disk and reused for this long.
+    EXPORT_RETENTION_HOURS = int(os.getenv('EXPORT_RETENTION_HOURS', '24'))
+    # Rendered invoice PDFs are kept under invoices/ up to this size, least recently used evicted first.
+    INVOICE_STORE_MAX_MB = int(os.getenv('INVOICE_STORE_MAX_MB', '512'))
+    # Web worker processes serving the app; gunicorn reads the same variable for its -w default.
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+    # Processes drawing invoices for bulk ZIP downloads, per web worker; 0 splits the cores
+    # between the WEB_CONCURRENCY workers. The pool spawns workers that re-import the entry
+    # script as __mp_main__, so any script that builds the app must skip create_app() there
+    # (see app.py and manage.py).
+    INVOICE_RENDER_WORKERS = int(os.getenv('INVOICE_RENDER_WORKERS', '0'))
+
     GST_PROVIDER = os.getenv('GST_PROVIDER', 'nic')
     GST_USERNAME = os.getenv('GST_USERNAME')
     GST_PASSWORD = os.getenv('GST_PASSWORD')
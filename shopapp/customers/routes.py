@@ -1,33 +1,106 @@
+import math
+from dataclasses import dataclass
+from typing import List
+
 from flask import Blueprint, flash, redirect, render_template, request, url_for
-from sqlalchemy import func
+from sqlalchemy import func, null, select
 
 from ..extensions import db
-from ..models import Customer, Sale
+from ..models import Customer, CustomerMetrics
 from ..utils.decorators import login_required
 
 customers_bp = Blueprint('customers', __name__)
 
+CUSTOMER_SORTS = {
+    'ltv': CustomerMetrics.lifetime_value,
+    'recent': CustomerMetrics.last_purchase_at,
+}
+PER_PAGE = 25
+
+
+@dataclass
+class CustomerPage:
+    """The slice of the customer list the template pages through."""
+
+    page: int
+    per_page: int
+    total: int
+    items: List[tuple]
+
+    @property
+    def pages(self) -> int:
+        return max(math.ceil(self.total / self.per_page), 1)
+
+    @property
+    def has_prev(self) -> bool:
+        return self.page > 1
+
+    @property
+    def has_next(self) -> bool:
+        return self.page < self.pages
+
+    @property
+    def prev_num(self) -> int:
+        return self.page - 1
+
+    @property
+    def next_num(self) -> int:
+        return self.page + 1
+
+
+def _customer_page(sort: str, page: int, per_page: int = PER_PAGE) -> CustomerPage:
+    """Customers with purchases by the sort column, then customers without any.
+
+    The first part walks the ``customer_metrics`` index on the sort column
+    and joins each customer by primary key, so a page costs its own rows
+    rather than a scan and sort of every customer.
+    """
+    offset = (page - 1) * per_page
+    ranked = db.session.query(func.count(CustomerMetrics.customer_id)).scalar() or 0
+    total = db.session.query(func.count(Customer.id)).scalar() or 0
+
+    items = []
+    if offset < ranked:
+        items = db.session.execute(
+            select(
+                Customer.id,
+                Customer.name,
+                Customer.phone,
+                CustomerMetrics.order_count,
+                CustomerMetrics.lifetime_value,
+                CustomerMetrics.last_purchase_at,
+                CustomerMetrics.average_basket,
+            )
+            .select_from(CustomerMetrics)
+            .join(Customer, Customer.id == CustomerMetrics.customer_id)
+            .order_by(CUSTOMER_SORTS[sort].desc(), CustomerMetrics.customer_id.desc())
+            .offset(offset)
+            .limit(per_page)
+        ).all()
+    if len(items) < per_page:
+        no_purchases = ~select(CustomerMetrics.customer_id).where(CustomerMetrics.customer_id == Customer.id).exists()
+        items += db.session.execute(
+            select(Customer.id, Customer.name, Customer.phone, null(), null(), null(), null())
+            .where(no_purchases)
+            .order_by(Customer.id)
+            .offset(max(offset - ranked, 0))
+            .limit(per_page - len(items))
+        ).all()
+    return CustomerPage(page=page, per_page=per_page, total=total, items=items)
+
 
 @customers_bp.route('/customers')
 @login_required
 def customers():
-    rows = (
-        db.session.query(
-            Customer.id,
-            Customer.name,
-            Customer.phone,
-            func.coalesce(func.count(Sale.id), 0),
-            func.coalesce(func.sum(Sale.net_total), 0),
-            func.max(Sale.date),
-        )
-        .outerjoin(Sale, Sale.customer_id == Customer.id)
-        .group_by(Customer.id)
-        .order_by(func.coalesce(func.sum(Sale.net_total), 0).desc())
-        .all()
-    )
+    page = max(request.args.get('page', 1, type=int), 1)
+    sort = request.args.get('sort', 'ltv')
+    if sort not in CUSTOMER_SORTS:
+        sort = 'ltv'
+
+    pagination = _customer_page(sort, page)
 
     customers_data = []
-    for cid, name, phone, orders, total, last_date in rows:
+    for cid, name, phone, orders, total, last_date, basket in pagination.items:
         last_purchase = last_date.strftime('%Y-%m-%d') if last_date else None
         customers_data.append(
             (
@@ -37,10 +110,11 @@ def customers():
                 int(orders or 0),
                 float(total or 0),
                 last_purchase,
+                float(basket or 0),
             )
         )
 
-    return render_template('customers/list.html', customers=customers_data)
+    return render_template('customers/list.html', customers=customers_data, page=pagination, sort=sort)
 
 
 @customers_bp.route('/customers/new', methods=['GET', 'POST'])
@@ -7,6 +7,7 @@ from ..extensions import db
 from ..models import Expense, ExpenseCategory
 from ..utils.audit import log_event
 from ..utils.decorators import login_required
+from ..utils.localtime import local_today
 
 expenses_bp = Blueprint('expenses', __name__)
 
@@ -35,7 +36,10 @@ def _suggest_category(text: str, categories) -> ExpenseCategory | None:
 def expenses():
     categories = _load_categories()
     if request.method == 'POST':
-        entry_date = request.form.get('date') or date.today().isoformat()
+        try:
+            entry_date = date.fromisoformat(request.form.get('date') or '')
+        except ValueError:
+            entry_date = local_today()
         category_id_raw = request.form.get('category_id') or ''
         free_category = (request.form.get('category') or '').strip()
         amount = float(request.form['amount'])
@@ -3,11 +3,14 @@ from __future__ import annotations
 from datetime import datetime
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
+from sqlalchemy import update
 from sqlalchemy.exc import IntegrityError
 
 from ..extensions import db
 from ..models import Item, PurchaseItem, PurchaseOrder, Supplier
 from ..utils.decorators import login_required
+from ..utils.forecasting import load_forecasts, reorder_plan
+from ..utils.stock import increment_stock
 
 inventory_bp = Blueprint('inventory', __name__)
 
@@ -62,9 +65,7 @@ def add_stock():
         flash('Item not found.', 'warning')
         return redirect(url_for('inventory.items'))
 
-    item.current_stock = (item.current_stock or 0) + quantity
-    item.updated_at = datetime.utcnow()
-    db.session.add(item)
+    increment_stock(item.id, quantity)
     db.session.commit()
     flash(f'Added {quantity} units to {item.name}.', 'success')
     return redirect(url_for('inventory.items'))
@@ -74,19 +75,25 @@ def add_stock():
 @login_required
 def reorder():
     items = Item.query.order_by(Item.reorder_level.asc(), Item.name.asc()).all()
-    low_stock: list[dict[str, float | int | str]] = []
+    forecasts = load_forecasts()
+    low_stock: list[dict[str, float | int | str | None]] = []
     for item in items:
         reorder_level = item.reorder_level or 5
         current_stock = item.current_stock or 0
-        if current_stock <= reorder_level:
-            recommended = max(reorder_level * 2 - current_stock, reorder_level)
+        forecast = forecasts.get(item.id)
+        daily_demand = forecast.daily_demand if forecast else 0.0
+        # Stock moves during the day, so apply the nightly demand to live stock.
+        plan = reorder_plan(current_stock, reorder_level, daily_demand)
+        if plan["due"]:
             low_stock.append(
                 {
                     "id": item.id,
                     "name": item.name,
                     "current_stock": current_stock,
                     "reorder_level": reorder_level,
-                    "recommended": recommended,
+                    "recommended": plan["recommended"],
+                    "daily_demand": round(daily_demand, 1),
+                    "days_of_cover": plan["days_of_cover"],
                     "price": float(item.price or 0),
                 }
             )
@@ -226,16 +233,22 @@ def orders():
             db.session.commit()
             flash(f'Purchase order #{order.id} marked as issued.', 'success')
         elif action == 'receive':
-            if order.status == 'received':
+            # Flip the status conditionally so a double-submitted form cannot
+            # add the same stock twice.
+            received_at = datetime.utcnow()
+            claimed = db.session.execute(
+                update(PurchaseOrder)
+                .where(PurchaseOrder.id == order.id, PurchaseOrder.status != 'received')
+                .values(status='received', received_at=received_at)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not claimed:
+                db.session.rollback()
                 flash('Purchase order already received.', 'info')
                 return redirect(url_for('inventory.orders'))
             for line in order.lines:
-                if line.item and line.quantity:
-                    line.item.current_stock = (line.item.current_stock or 0) + line.quantity
-                    db.session.add(line.item)
-            order.status = 'received'
-            order.received_at = datetime.utcnow()
-            db.session.add(order)
+                if line.item_id and line.quantity:
+                    increment_stock(line.item_id, line.quantity)
             db.session.commit()
             flash(f'Purchase order #{order.id} marked as received.', 'success')
         else:
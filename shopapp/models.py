@@ -264,6 +264,9 @@ class Sale(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Calendar day and hour of ``date`` in the shop's timezone, stamped on write.
+    local_date = db.Column(db.Date)
+    local_hour = db.Column(db.SmallInteger)
     item = db.Column(db.String(255), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     total = db.Column(db.Float, default=0)
@@ -294,6 +297,7 @@ class Sale(db.Model):
     signed_invoice_path = db.Column(db.String(255))
     eway_bill_no = db.Column(db.String(64))
     eway_valid_upto = db.Column(db.DateTime)
+    invoice_render_status = db.Column(db.String(20), default='pending', nullable=False)
 
     customer = db.relationship('Customer', back_populates='sales', lazy=True)
     location = db.relationship('ShopLocation', backref=db.backref('sales', lazy=True))
@@ -315,6 +319,113 @@ class SaleItem(db.Model):
     line_total = db.Column(db.Numeric(12, 2), default=0)
 
 
+class SalesDailyRollup(db.Model):
+    __tablename__ = 'sales_daily_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'location_id', 'payment_method', name='uq_sales_daily_rollup_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    # 0 stands for sales without a location so the unique key still applies.
+    location_id = db.Column(db.Integer, default=0, nullable=False)
+    payment_method = db.Column(db.String(50), default='cash', nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    discount = db.Column(db.Float, default=0, nullable=False)
+    tax = db.Column(db.Float, default=0, nullable=False)
+    sale_count = db.Column(db.Integer, default=0, nullable=False)
+    quantity = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ItemForecast(db.Model):
+    __tablename__ = 'item_forecasts'
+
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id'), primary_key=True)
+    units_sold = db.Column(db.Integer, default=0, nullable=False)
+    velocity = db.Column(db.Float, default=0, nullable=False)
+    daily_demand = db.Column(db.Float, default=0, nullable=False)
+    days_of_cover = db.Column(db.Float)
+    recommended_qty = db.Column(db.Integer, default=0, nullable=False)
+    last_sale_at = db.Column(db.DateTime)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    item = db.relationship('Item', backref=db.backref('forecast', uselist=False, lazy=True))
+
+
+class DailyTotalsPrefix(db.Model):
+    __tablename__ = 'daily_totals_prefix'
+
+    # Running totals from the first trading day through ``day``; one row per
+    # calendar day so any range is the difference of two rows.
+    day = db.Column(db.Date, primary_key=True)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    discount = db.Column(db.Float, default=0, nullable=False)
+    tax = db.Column(db.Float, default=0, nullable=False)
+    expenses = db.Column(db.Float, default=0, nullable=False)
+    transactions = db.Column(db.Integer, default=0, nullable=False)
+
+
+class CustomerMetrics(db.Model):
+    __tablename__ = 'customer_metrics'
+
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), primary_key=True)
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    lifetime_value = db.Column(db.Float, default=0, nullable=False, index=True)
+    average_basket = db.Column(db.Float, default=0, nullable=False)
+    first_purchase_at = db.Column(db.DateTime)
+    last_purchase_at = db.Column(db.DateTime, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    customer = db.relationship('Customer', backref=db.backref('metrics', uselist=False, lazy=True))
+
+
+class ZReportSnapshot(db.Model):
+    __tablename__ = 'zreport_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, unique=True, nullable=False)
+    summary = db.Column(db.Text, nullable=False)
+    pdf = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class InvoiceSequence(db.Model):
+    __tablename__ = 'invoice_sequences'
+
+    id = db.Column(db.Integer, primary_key=True)
+    series = db.Column(db.String(64), unique=True, nullable=False)
+    high_water = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class InvoiceNumberGap(db.Model):
+    __tablename__ = 'invoice_number_gaps'
+
+    id = db.Column(db.Integer, primary_key=True)
+    series = db.Column(db.String(64), nullable=False, index=True)
+    start_number = db.Column(db.Integer, nullable=False)
+    end_number = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(64))
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (db.UniqueConstraint('scope', 'key', name='uq_idempotency_scope_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(255), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), default='in_progress', nullable=False)
+    response_status = db.Column(db.Integer)
+    response_headers = db.Column(db.Text)
+    response_body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
 class EInvoiceSubmission(db.Model):
     __tablename__ = 'einvoice_submissions'
 
@@ -430,6 +541,7 @@ class ExpenseCategory(db.Model):
     color = db.Column(db.String(20), default='#62b5ff')
     keywords = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 class Expense(db.Model):
@@ -441,6 +553,7 @@ class Expense(db.Model):
     category_id = db.Column(db.Integer, db.ForeignKey('expense_categories.id'))
     amount = db.Column(db.Float)
     notes = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     category_rel = db.relationship('ExpenseCategory', backref='expenses', lazy=True)
 
@@ -461,6 +574,27 @@ class AuditLog(db.Model):
     user_agent = db.Column(db.String(255))
 
 
+class ExportJob(db.Model):
+    __tablename__ = 'export_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    params = db.Column(db.Text)
+    # Hash of kind, params and the data version; an equal one is served again.
+    fingerprint = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    filename = db.Column(db.String(255))
+    path = db.Column(db.String(512))
+    size = db.Column(db.Integer)
+    rows = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    requested_by = db.Column(db.String(80))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
 class Return(db.Model):
     __tablename__ = 'returns'
 
@@ -1,15 +1,16 @@
-from datetime import datetime, timedelta
-import csv
+from datetime import date, datetime, timedelta
 import io
 
-from flask import Blueprint, make_response, render_template, request, send_file, jsonify
-from sqlalchemy import func
+from flask import Blueprint, render_template, request, send_file, jsonify
+from sqlalchemy import select
 
-from ..extensions import db
-from ..models import Credit, Expense, Sale
+from ..models import Customer, Sale
 from ..utils.analytics import build_daily_csv, load_analytics
 from ..utils.decorators import login_required
-from ..utils.pdfs import create_zreport_pdf
+from ..utils.exports import csv_response, stream_rows
+from ..utils.localtime import local_today
+from ..utils.prefix_sums import COMPARISONS, compare_periods
+from .zreport import get_zreport, zreport_pdf_bytes
 
 reports_bp = Blueprint('reports', __name__)
 
@@ -20,109 +21,17 @@ def day_bounds(target: datetime) -> tuple[datetime, datetime]:
     return start, end
 
 
-def build_summary(date_str: str | None):
+def _target_day(date_str: str | None) -> date:
     if date_str:
         try:
-            target_day = datetime.strptime(date_str, '%Y-%m-%d')
+            return datetime.strptime(date_str, '%Y-%m-%d').date()
         except ValueError:
-            target_day = datetime.utcnow()
-    else:
-        target_day = datetime.utcnow()
-    start, end = day_bounds(target_day)
-
-    totals = (db.session.query(
-        func.coalesce(func.sum(Sale.net_total), 0),
-        func.coalesce(func.sum(Sale.discount), 0),
-        func.coalesce(func.sum(Sale.tax), 0),
-        func.count(Sale.id),
-        func.coalesce(func.min(Sale.date), None),
-        func.coalesce(func.max(Sale.date), None)
-    ).filter(Sale.date.between(start, end)).first())
-
-    payment_rows = (
-        db.session.query(Sale.payment_method,
-                         func.count(Sale.id),
-                         func.coalesce(func.sum(Sale.net_total), 0))
-        .filter(Sale.date.between(start, end))
-        .group_by(Sale.payment_method)
-        .all()
-    )
-    payment_breakdown = [
-        {
-            'method': method or 'cash',
-            'transactions': int(tx or 0),
-            'amount': float(amount or 0)
-        }
-        for method, tx, amount in payment_rows
-    ]
-    payment_total = sum(row['amount'] for row in payment_breakdown)
-
-    top_items = (
-        db.session.query(
-            Sale.item,
-            func.coalesce(func.sum(Sale.quantity), 0),
-            func.coalesce(func.sum(Sale.net_total), 0)
-        )
-        .filter(Sale.date.between(start, end))
-        .group_by(Sale.item)
-        .order_by(func.sum(Sale.net_total).desc())
-        .limit(5)
-        .all()
-    )
-    top_items = [
-        {'item': row[0], 'quantity': int(row[1] or 0), 'amount': float(row[2] or 0)}
-        for row in top_items
-    ]
-
-    udhar_row = (db.session.query(func.count(Sale.id), func.coalesce(func.sum(Sale.net_total), 0))
-                 .filter(Sale.date.between(start, end))
-                 .filter(func.coalesce(Sale.payment_method, 'cash') == 'udhar')
-                 .first() or (0, 0))
-
-    outstanding_row = (
-        db.session.query(func.coalesce(func.sum(Credit.total), 0), func.count(Credit.id))
-        .filter(Credit.status.in_(['unpaid', 'adjusted']))
-        .first() or (0, 0)
-    )
+            pass
+    return local_today()
 
-    returns_total = 0.0
 
-    expenses_total = (
-        db.session.query(func.coalesce(func.sum(Expense.amount), 0))
-        .filter(Expense.date == target_day.date())
-        .scalar() or 0
-    )
-
-    summary = {
-        'date': target_day.date().isoformat(),
-        'display_date': target_day.strftime('%d %b %Y'),
-        'totals': {
-            'revenue': float(totals[0] or 0),
-            'discount': float(totals[1] or 0),
-            'tax': float(totals[2] or 0),
-            'transactions': int(totals[3] or 0),
-            'average_bill': round((totals[0] / totals[3]), 2) if totals[3] else 0,
-            'unique_customers': 0,
-            'first_sale': totals[4],
-            'last_sale': totals[5]
-        },
-        'payment_breakdown': payment_breakdown,
-        'payment_total': payment_total,
-        'dominant_method': payment_breakdown[0]['method'] if payment_breakdown else None,
-        'top_items': top_items,
-        'udhar': {
-            'count': int(udhar_row[0] or 0),
-            'amount': float(udhar_row[1] or 0),
-            'outstanding_total': float(outstanding_row[0] or 0),
-            'outstanding_accounts': int(outstanding_row[1] or 0)
-        },
-        'returns_total': returns_total,
-        'expenses_total': float(expenses_total or 0),
-        'net_after_expenses': float((totals[0] or 0) - (expenses_total or 0)),
-        'peak_hour': None,
-        'peak_hour_amount': 0
-    }
-    return summary
+def build_summary(date_str: str | None):
+    return get_zreport(_target_day(date_str))
 
 
 @reports_bp.route('/zreport')
@@ -135,10 +44,9 @@ def zreport_view():
 @reports_bp.route('/zreport/pdf')
 @login_required
 def zreport_pdf():
-    summary = build_summary(request.args.get('date'))
-    path = create_zreport_pdf(summary)
+    summary, pdf_bytes = zreport_pdf_bytes(_target_day(request.args.get('date')))
     return send_file(
-        path,
+        io.BytesIO(pdf_bytes),
         as_attachment=True,
         download_name=f"zreport_{summary['date']}.pdf",
         mimetype='application/pdf'
@@ -166,16 +74,8 @@ def analytics_view():
 def analytics_export():
     days = _resolve_days()
     analytics = load_analytics(days=days)
-    csv_rows = build_daily_csv(analytics['daily'])
-
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerows(csv_rows)
-
-    response = make_response(buffer.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = f'attachment; filename=analytics_{days}d.csv'
-    return response
+    header, *rows = build_daily_csv(analytics['daily'])
+    return csv_response(header, rows, f'analytics_{days}d.csv')
 
 
 @reports_bp.route('/analytics/data')
@@ -189,6 +89,24 @@ def analytics_data():
     })
 
 
+@reports_bp.route('/analytics/compare')
+@login_required
+def analytics_compare():
+    """Totals for a date range next to the previous period, a month back or a year back."""
+    today = local_today()
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else today.replace(day=1)
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else today
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD.'}), 400
+    if start > end:
+        return jsonify({'error': 'start must not be after end.'}), 400
+    against = request.args.get('against', 'mom')
+    if against not in COMPARISONS:
+        return jsonify({'error': f"against must be one of {', '.join(COMPARISONS)}."}), 400
+    return jsonify(compare_periods(start, end, against))
+
+
 @reports_bp.route('/sales/export.csv')
 @login_required
 def sales_export():
@@ -196,44 +114,41 @@ def sales_export():
     to_str = request.args.get('to') or request.args.get('end')
     customer_filter = request.args.get('customer')
 
-    query = Sale.query.order_by(Sale.date.asc())
+    stmt = (
+        select(Sale.id, Sale.date, Sale.item, Sale.quantity, Sale.net_total, Sale.total, Customer.name)
+        .outerjoin(Customer, Customer.id == Sale.customer_id)
+        .order_by(Sale.date.asc())
+    )
 
     if from_str:
         try:
-            from_dt = datetime.strptime(from_str, '%Y-%m-%d')
-            query = query.filter(Sale.date >= from_dt)
+            from_day = datetime.strptime(from_str, '%Y-%m-%d').date()
+            stmt = stmt.where(Sale.local_date >= from_day)
         except ValueError:
             from_str = None
 
     if to_str:
         try:
-            to_dt = datetime.strptime(to_str, '%Y-%m-%d') + timedelta(days=1)
-            query = query.filter(Sale.date < to_dt)
+            to_day = datetime.strptime(to_str, '%Y-%m-%d').date()
+            stmt = stmt.where(Sale.local_date <= to_day)
         except ValueError:
             to_str = None
 
     if customer_filter:
         try:
-            query = query.filter(Sale.customer_id == int(customer_filter))
+            stmt = stmt.where(Sale.customer_id == int(customer_filter))
         except (TypeError, ValueError):
             customer_filter = None
 
-    rows = query.all()
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(['ID', 'Date', 'Item', 'Quantity', 'Total', 'Customer'])
-
-    for sale in rows:
-        writer.writerow([
-            sale.id,
-            sale.date.strftime('%Y-%m-%d %H:%M') if sale.date else '',
-            sale.item,
-            int(sale.quantity or 0),
-            f"{float(sale.net_total or sale.total or 0):.2f}",
-            sale.customer.name if sale.customer else 'Walk-in',
-        ])
-
-    response = make_response(buffer.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = 'attachment; filename=sales_export.csv'
-    return response
+    def rows():
+        for sale_id, sale_date, item, quantity, net_total, total, customer_name in stream_rows(stmt):
+            yield [
+                sale_id,
+                sale_date.strftime('%Y-%m-%d %H:%M') if sale_date else '',
+                item,
+                int(quantity or 0),
+                f"{float(net_total or total or 0):.2f}",
+                customer_name or 'Walk-in',
+            ]
+
+    return csv_response(['ID', 'Date', 'Item', 'Quantity', 'Total', 'Customer'], rows(), 'sales_export.csv')
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import distinct, func, select
+
+from ..extensions import db
+from ..models import Credit, Expense, Sale, SaleItem, ZReportSnapshot
+from ..utils.pdfs import render_zreport_pdf
+from ..utils.schema import dialect_insert
+
+TOP_ITEMS = 5
+_DATETIME_FIELDS = ('first_sale', 'last_sale')
+
+
+def compute_day_summary(day: date) -> Dict[str, Any]:
+    """Compute the Z-report for the shop-local ``day`` from live data.
+
+    Sales figures come from one grouped pass over the day's rows (payment
+    method x local hour), found through the local-day index, and top items
+    from one pass over the day's sale lines; credits and expenses live in
+    other tables and take one query each.
+    """
+
+    start = datetime(day.year, day.month, day.day)
+    in_day = (Sale.local_date == day,)
+
+    method = func.coalesce(Sale.payment_method, 'cash')
+    hour = Sale.local_hour
+    unique_customers = select(func.count(distinct(Sale.customer_id))).where(*in_day).scalar_subquery()
+    rows = db.session.execute(
+        select(
+            method,
+            hour,
+            func.coalesce(func.sum(Sale.net_total), 0),
+            func.coalesce(func.sum(Sale.discount), 0),
+            func.coalesce(func.sum(Sale.tax), 0),
+            func.count(Sale.id),
+            func.min(Sale.date),
+            func.max(Sale.date),
+            unique_customers,
+        )
+        .where(*in_day)
+        .group_by(method, hour)
+    ).all()
+    item_rows = db.session.execute(
+        select(
+            func.coalesce(SaleItem.description, ''),
+            func.coalesce(func.sum(SaleItem.qty), 0),
+            func.coalesce(func.sum(SaleItem.line_total), 0),
+        )
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .where(*in_day)
+        .group_by(func.coalesce(SaleItem.description, ''))
+    ).all()
+
+    revenue = discount = tax = 0.0
+    transactions = 0
+    customers = 0
+    first_sale: Optional[datetime] = None
+    last_sale: Optional[datetime] = None
+    by_method: Dict[str, list] = {}
+    by_hour: Dict[int, float] = {}
+    for pay_method, hour_of_day, amount, row_discount, row_tax, count, first, last, distinct_customers in rows:
+        amount = float(amount or 0)
+        revenue += amount
+        discount += float(row_discount or 0)
+        tax += float(row_tax or 0)
+        transactions += int(count or 0)
+        customers = int(distinct_customers or 0)
+        if first is not None and (first_sale is None or first < first_sale):
+            first_sale = first
+        if last is not None and (last_sale is None or last > last_sale):
+            last_sale = last
+        method_entry = by_method.setdefault(pay_method or 'cash', [0, 0.0])
+        method_entry[0] += int(count or 0)
+        method_entry[1] += amount
+        if hour_of_day is not None:
+            by_hour[int(hour_of_day)] = by_hour.get(int(hour_of_day), 0.0) + amount
+
+    payment_breakdown = [
+        {'method': name, 'transactions': tx, 'amount': amount}
+        for name, (tx, amount) in sorted(by_method.items(), key=lambda entry: (-entry[1][1], entry[0]))
+    ]
+    payment_total = sum(row['amount'] for row in payment_breakdown)
+    top_items = [
+        {'item': name, 'quantity': int(quantity or 0), 'amount': float(amount or 0)}
+        for name, quantity, amount in sorted(item_rows, key=lambda row: float(row[2] or 0), reverse=True)[:TOP_ITEMS]
+    ]
+    udhar_count, udhar_amount = by_method.get('udhar', (0, 0.0))
+    peak_hour = max(by_hour, key=lambda key: (by_hour[key], -key)) if by_hour else None
+
+    outstanding_total, outstanding_accounts = (
+        db.session.query(func.coalesce(func.sum(Credit.total), 0), func.count(Credit.id))
+        .filter(Credit.status.in_(['unpaid', 'adjusted']))
+        .first() or (0, 0)
+    )
+    expenses_total = float(
+        db.session.query(func.coalesce(func.sum(Expense.amount), 0))
+        .filter(Expense.date == day)
+        .scalar() or 0
+    )
+
+    return {
+        'date': day.isoformat(),
+        'display_date': start.strftime('%d %b %Y'),
+        'totals': {
+            'revenue': revenue,
+            'discount': discount,
+            'tax': tax,
+            'transactions': transactions,
+            'average_bill': round(revenue / transactions, 2) if transactions else 0,
+            'unique_customers': customers,
+            'first_sale': first_sale,
+            'last_sale': last_sale,
+        },
+        'payment_breakdown': payment_breakdown,
+        'payment_total': payment_total,
+        'dominant_method': payment_breakdown[0]['method'] if payment_breakdown else None,
+        'top_items': top_items,
+        'udhar': {
+            'count': int(udhar_count),
+            'amount': float(udhar_amount),
+            'outstanding_total': float(outstanding_total or 0),
+            'outstanding_accounts': int(outstanding_accounts or 0),
+        },
+        'returns_total': 0.0,
+        'expenses_total': expenses_total,
+        'net_after_expenses': revenue - expenses_total,
+        'peak_hour': peak_hour,
+        'peak_hour_amount': by_hour.get(peak_hour, 0) if peak_hour is not None else 0,
+    }
+
+
+def _dump(summary: Dict[str, Any]) -> str:
+    totals = dict(summary['totals'])
+    for field in _DATETIME_FIELDS:
+        if totals.get(field) is not None:
+            totals[field] = totals[field].isoformat()
+    return json.dumps({**summary, 'totals': totals})
+
+
+def _load(raw: str) -> Dict[str, Any]:
+    summary = json.loads(raw)
+    totals = summary['totals']
+    for field in _DATETIME_FIELDS:
+        if totals.get(field):
+            totals[field] = datetime.fromisoformat(totals[field])
+    return summary
+
+
+def _snapshot(day: date) -> Optional[ZReportSnapshot]:
+    return ZReportSnapshot.query.filter_by(day=day).first()
+
+
+def get_zreport(day: date) -> Dict[str, Any]:
+    """The stored snapshot for a closed day, else a live computation."""
+    snapshot = _snapshot(day)
+    if snapshot is not None:
+        return _load(snapshot.summary)
+    return compute_day_summary(day)
+
+
+def zreport_pdf_bytes(day: date) -> Tuple[Dict[str, Any], bytes]:
+    snapshot = _snapshot(day)
+    if snapshot is not None and snapshot.pdf:
+        return _load(snapshot.summary), snapshot.pdf
+    summary = _load(snapshot.summary) if snapshot is not None else compute_day_summary(day)
+    return summary, render_zreport_pdf(summary)
+
+
+def snapshot_zreport(day: date) -> None:
+    """Freeze ``day``'s Z-report and its PDF inside the caller's transaction.
+
+    Called when the day is locked, which every worker's scheduler does at
+    the same time, so the row is upserted on ``day``: a repeat lock on the
+    same day replaces the snapshot instead of colliding with it.
+    """
+
+    summary = compute_day_summary(day)
+    stmt = dialect_insert(db.engine, ZReportSnapshot.__table__).values(
+        day=day,
+        summary=_dump(summary),
+        pdf=render_zreport_pdf(summary),
+        created_at=datetime.utcnow(),
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["day"],
+        set_={"summary": stmt.excluded.summary, "pdf": stmt.excluded.pdf, "created_at": stmt.excluded.created_at},
+    ))
+
+
+def discard_zreport_snapshot(day: date) -> None:
+    """Drop a snapshot when its day is unlocked and may change again."""
+    ZReportSnapshot.query.filter_by(day=day).delete(synchronize_session=False)
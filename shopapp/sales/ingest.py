@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..extensions import db
+from ..models import Credit, Customer, Item, Sale, SaleItem
+from ..utils.audit import audit_values, log_events
+from ..utils.invoices import next_invoice_number
+from ..utils.customer_metrics import record_customer_sales
+from ..utils.rollups import record_sales
+from ..utils.schema import begin_savepoint
+from ..utils.localtime import local_stamp, stamp_local
+from ..utils.shop_config import get_shop_config
+from ..utils.stock import InsufficientStockError, decrement_stock
+from .services import CheckoutError, credit_values, item_entry, price_sale
+
+INGEST_MODES = ("replay", "import")
+
+
+def _parse_date(raw: Any) -> Optional[datetime]:
+    if raw in (None, ""):
+        return None
+    value = str(raw).strip()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CheckoutError("date must be an ISO 8601 timestamp.")
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _record_lines(record: Dict[str, Any]) -> List[Tuple[int, int, Any, Any]]:
+    raw_lines = record.get("lines")
+    if raw_lines is None:
+        raw_lines = [record] if record.get("item_id") or record.get("quantity") else []
+    if not isinstance(raw_lines, list) or not all(isinstance(line, dict) for line in raw_lines):
+        raise CheckoutError("lines must be a list of {item_id, quantity} objects.")
+    if not raw_lines:
+        raise CheckoutError("item_id and quantity are required.")
+
+    parsed = []
+    for line in raw_lines:
+        try:
+            item_id = int(line.get("item_id"))
+        except (TypeError, ValueError):
+            raise CheckoutError("item_id must be an integer.")
+        try:
+            quantity = int(line.get("quantity"))
+        except (TypeError, ValueError):
+            raise CheckoutError("quantity must be an integer.")
+        if quantity <= 0:
+            raise CheckoutError("quantity must be positive.")
+        parsed.append((item_id, quantity, line.get("rate"), line.get("gst_rate")))
+    return parsed
+
+
+def _read_records(stream: IO[bytes]) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    for number, raw in enumerate(stream, start=1):
+        text = raw.strip()
+        if not text:
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            yield number, None, "Invalid JSON."
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "Each line must be a JSON object."
+            continue
+        yield number, record, None
+
+
+def _chunks(records: Iterable, size: int) -> Iterator[List]:
+    chunk: List = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _ChunkContext:
+    """Lookups shared by every record in a chunk, loaded with one query each."""
+
+    def __init__(self, records: List[Dict[str, Any]]) -> None:
+        item_ids = set()
+        customer_ids = set()
+        customer_names = set()
+        invoice_numbers = set()
+        for record in records:
+            lines = record.get("lines")
+            for line in lines if isinstance(lines, list) else [record]:
+                if isinstance(line, dict):
+                    try:
+                        item_ids.add(int(line.get("item_id")))
+                    except (TypeError, ValueError):
+                        pass
+            if record.get("customer_id"):
+                try:
+                    customer_ids.add(int(record["customer_id"]))
+                except (TypeError, ValueError):
+                    pass
+            name = record.get("customer_name")
+            if isinstance(name, str) and name.strip():
+                customer_names.add(name.strip())
+            if record.get("invoice_number"):
+                invoice_numbers.add(str(record["invoice_number"]))
+
+        self.items = {item.id: item for item in Item.query.filter(Item.id.in_(item_ids)).all()} if item_ids else {}
+        self.customers_by_id = (
+            {customer.id: customer for customer in Customer.query.filter(Customer.id.in_(customer_ids)).all()}
+            if customer_ids else {}
+        )
+        self.customers_by_name = (
+            {customer.name: customer for customer in Customer.query.filter(Customer.name.in_(customer_names)).all()}
+            if customer_names else {}
+        )
+        self.taken_invoice_numbers = (
+            {number for (number,) in db.session.query(Sale.invoice_number).filter(Sale.invoice_number.in_(invoice_numbers))}
+            if invoice_numbers else set()
+        )
+
+    def customer(self, record: Dict[str, Any]) -> Tuple[Optional[Customer], str]:
+        """The record's existing customer (if any) and the name it gives.
+
+        A name with no matching customer comes back as ``(None, name)``;
+        the row is only created by :meth:`create_customer` once the record
+        has passed validation.
+        """
+        customer_name = record.get("customer_name")
+        customer_name = customer_name.strip() if isinstance(customer_name, str) else ""
+        if record.get("customer_id"):
+            try:
+                customer = self.customers_by_id.get(int(record["customer_id"]))
+            except (TypeError, ValueError):
+                raise CheckoutError("customer_id must be an integer.")
+            if not customer:
+                raise CheckoutError("Customer not found.", status=404)
+            return customer, customer_name
+        if customer_name:
+            return self.customers_by_name.get(customer_name), customer_name
+        return None, ""
+
+    def create_customer(self, customer_name: str) -> Customer:
+        customer = Customer(name=customer_name)
+        db.session.add(customer)
+        db.session.flush()
+        self.customers_by_name[customer_name] = customer
+        return customer
+
+
+def ingest_sales(stream: IO[bytes], *, mode: str = "replay", chunk_size: int = 500) -> Iterator[Dict[str, Any]]:
+    """Load newline-delimited JSON sales, yielding one result per record.
+
+    ``replay`` takes stock with the same conditional decrement as checkout
+    (for sales rung up offline); ``import`` records history without touching
+    stock. Records are validated individually, then each chunk is written
+    with bulk inserts and committed on its own, so a bad record never blocks
+    its neighbours and a failed chunk never leaves half its rows behind.
+    The final item yielded is a ``summary`` entry.
+    """
+
+    shop_config = get_shop_config()
+    location_id = shop_config.default_location_id
+    seller_gstin = shop_config.gst or None
+
+    received = created = failed = 0
+    for chunk in _chunks(_read_records(stream), chunk_size):
+        results: List[Dict[str, Any]] = []
+        pending: List[Tuple] = []
+        context = _ChunkContext([record for _, record, error in chunk if record is not None])
+
+        for number, record, error in chunk:
+            received += 1
+            result: Dict[str, Any] = {"line": number}
+            if record is not None and record.get("ref") is not None:
+                result["ref"] = record["ref"]
+            results.append(result)
+            if error:
+                result.update(status="error", error=error)
+                continue
+            try:
+                pending.append((result, *_prepare(record, context, mode, location_id, seller_gstin)))
+            except CheckoutError as exc:
+                result.update(status="error", error=exc.message)
+
+        if pending:
+            try:
+                _write_chunk(pending)
+                db.session.commit()
+            except SQLAlchemyError:
+                db.session.rollback()
+                for result, *_ in pending:
+                    result.pop("id", None)
+                    result.pop("invoice_number", None)
+                    result.update(status="error", error="Chunk could not be saved.")
+        else:
+            db.session.commit()
+
+        for result in results:
+            if result.get("status") == "created":
+                created += 1
+            else:
+                failed += 1
+            yield result
+
+    yield {"summary": {"mode": mode, "received": received, "created": created, "failed": failed}}
+
+
+def _prepare(record: Dict[str, Any], context: _ChunkContext, mode: str, location_id: Optional[int],
+             seller_gstin: Optional[str]):
+    lines = _record_lines(record)
+    for item_id, *_ in lines:
+        if item_id not in context.items:
+            raise CheckoutError("Item not found.", status=404)
+
+    customer, customer_name = context.customer(record)
+    sale_type = str(record.get("sale_type") or "paid").lower()
+    payment_method = str(record.get("payment_method") or "cash").lower()
+    if sale_type == "udhar":
+        payment_method = "udhar"
+        if not (customer or customer_name):
+            raise CheckoutError("Customer required for udhar.")
+    try:
+        discount = float(record.get("discount") or 0)
+    except (TypeError, ValueError):
+        raise CheckoutError("discount must be a number.")
+
+    invoice_number = record.get("invoice_number")
+    if invoice_number:
+        invoice_number = str(invoice_number)
+        if invoice_number in context.taken_invoice_numbers:
+            raise CheckoutError("invoice_number already exists.", status=409)
+
+    seller_state = str(record.get("seller_state") or "").strip().upper() or "DL"
+    buyer_state = str(record.get("buyer_state") or "").strip().upper() or (
+        customer.state.upper() if customer and customer.state else seller_state
+    )
+    sale_values, line_values = price_sale(
+        [item_entry(context.items[item_id], quantity, rate, gst_rate) for item_id, quantity, rate, gst_rate in lines],
+        seller_state,
+        buyer_state,
+        taxable_discount=discount,
+    )
+    sale_date = _parse_date(record.get("date")) or datetime.utcnow()
+
+    if mode == "replay":
+        # The record's decrements share a savepoint, so one that runs short
+        # puts back what it already took; the rest of the chunk stays in the
+        # same transaction.
+        try:
+            with begin_savepoint(db.session):
+                for item_id, quantity, *_ in lines:
+                    decrement_stock(item_id, quantity)
+        except InsufficientStockError as exc:
+            raise CheckoutError(f"Insufficient stock for {context.items[exc.item_id].name}.")
+        except LookupError:
+            raise CheckoutError("Item not found.", status=404)
+
+    # Only a record that made it this far gets a new customer row, so a
+    # rejected record leaves nothing behind when the chunk commits.
+    if customer is None and customer_name:
+        customer = context.create_customer(customer_name)
+
+    if not invoice_number:
+        # Historical records are numbered in the series of the day they were sold.
+        invoice_number = next_invoice_number(location_id, day=local_stamp(sale_date)[0])
+    context.taken_invoice_numbers.add(invoice_number)
+
+    sale_values.update(
+        date=sale_date,
+        customer_id=customer.id if customer else None,
+        payment_method=payment_method,
+        discount=discount,
+        invoice_number=invoice_number,
+        location_id=location_id,
+        seller_gstin=seller_gstin,
+        buyer_gstin=(customer.gstin if customer and customer.gstin else record.get("buyer_gstin")),
+        notes=record.get("notes"),
+    )
+    stamp_local(sale_values)
+    credit = None
+    if sale_type == "udhar":
+        credit = credit_values(customer, customer_name, sale_values)
+        credit["date"] = sale_date
+    audit_after = {
+        'item': sale_values["item"],
+        'quantity': sale_values["quantity"],
+        'lines': [{'item_id': item_id, 'quantity': quantity} for item_id, quantity, *_ in lines],
+        'invoice_number': invoice_number,
+        'source': f'bulk_{mode}',
+    }
+    return sale_values, line_values, credit, audit_after
+
+
+def _write_chunk(pending: List[Tuple]) -> None:
+    sale_ids = db.session.execute(
+        insert(Sale).returning(Sale.id, sort_by_parameter_order=True),
+        [sale_values for _, sale_values, *_ in pending],
+    ).scalars().all()
+
+    sale_items = []
+    credits = []
+    audit_rows = []
+    for sale_id, (result, sale_values, line_values, credit, audit_after) in zip(sale_ids, pending):
+        sale_items.extend({**values, "sale_id": sale_id} for values in line_values)
+        if credit:
+            credits.append(credit)
+        audit_rows.append(audit_values('sell', 'sale', sale_id, None, audit_after))
+        result.update(status="created", id=sale_id, invoice_number=sale_values["invoice_number"])
+
+    db.session.execute(insert(SaleItem), sale_items)
+    if credits:
+        db.session.execute(insert(Credit), credits)
+    written = [sale_values for _, sale_values, *_ in pending]
+    record_sales(written)
+    record_customer_sales(written)
+    log_events(audit_rows)
@@ -1,56 +1,57 @@
-﻿import csv
-import io
-import json
-from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_HALF_UP
-
-from flask import (Blueprint, current_app, flash, make_response, redirect, render_template,
-                   request, send_file, session, url_for)
-from sqlalchemy import func
+﻿import json
+from datetime import date, datetime, timedelta
+
+from flask import (Blueprint, Response, current_app, flash, redirect, render_template,
+                   request, send_file, session, stream_with_context, url_for)
+from sqlalchemy import func, select
 from sqlalchemy.orm import joinedload
 
 from ..extensions import db
 from ..models import (AuditLog, Credit, Customer, EInvoiceSubmission, Expense, Item, PaymentIntent,
-                      PaymentTransaction, Sale, SaleItem, Setting, ShopProfile)
+                      PaymentTransaction, Sale, SalesDailyRollup, ShopProfile)
 from ..utils.decorators import login_required
+from ..utils.exports import csv_response, stream_rows
+from ..utils.idempotency import idempotent
+from ..utils.invoice_zip import stream_invoice_zip
 from ..utils.audit import log_event
-from ..utils.invoices import next_invoice_number
 from ..utils.mail import send_mail
-from ..utils.pdfs import create_invoice_pdf
-from ..utils_gst import calc_gst
+from ..utils.pdfs import ensure_invoice_pdf, ensure_tax_invoice_pdf, queue_invoice_render
+from ..utils.localtime import local_day_bounds, local_today
+from ..utils.shop_config import get_shop_config
+from ..utils.stock import increment_stock
 from ..compliance.services import GSTIntegrationError, get_gst_service
 from ..payments import get_payments_service
-from ..pdf_service import render_sale_pdf
+from .services import CheckoutError, build_cart, checkout, resolve_customer
 
 sales_bp = Blueprint('sales', __name__)
 
 
 def today_bounds() -> tuple[datetime, datetime]:
-    now = datetime.utcnow()
-    start = datetime(now.year, now.month, now.day)
-    end = start + timedelta(days=1) - timedelta(seconds=1)
-    return start, end
+    """UTC bounds of the shop-local today."""
+    start, end = local_day_bounds(local_today())
+    return start, end - timedelta(seconds=1)
 
 
-def _parse_range(start_str: str | None, end_str: str | None) -> tuple[str | None, str | None, datetime | None, datetime | None]:
-    start_dt = None
-    end_dt = None
+def _parse_range(start_str: str | None, end_str: str | None) -> tuple[str | None, str | None, date | None, date | None]:
+    """Shop-local days ``[start, end + 1)`` from ``YYYY-MM-DD`` strings."""
+    start_day = None
+    end_day = None
 
     if start_str:
         try:
-            start_dt = datetime.strptime(start_str, '%Y-%m-%d')
+            start_day = datetime.strptime(start_str, '%Y-%m-%d').date()
         except ValueError:
             start_str = None
-            start_dt = None
+            start_day = None
 
     if end_str:
         try:
-            end_dt = datetime.strptime(end_str, '%Y-%m-%d') + timedelta(days=1)
+            end_day = datetime.strptime(end_str, '%Y-%m-%d').date() + timedelta(days=1)
         except ValueError:
             end_str = None
-            end_dt = None
+            end_day = None
 
-    return start_str, end_str, start_dt, end_dt
+    return start_str, end_str, start_day, end_day
 
 
 @sales_bp.route('/')
@@ -58,17 +59,6 @@ def _parse_range(start_str: str | None, end_str: str | None) -> tuple[str | None
 def index():
     start, end = today_bounds()
 
-    item_rows = Item.query.order_by(Item.name.asc()).all()
-    items = [
-        (item.id, item.name, float(item.price or 0), int(item.current_stock or 0))
-        for item in item_rows
-    ]
-    customer_rows = Customer.query.order_by(Customer.name.asc()).all()
-    customers = [
-        (customer.id, customer.name, customer.phone or 'N/A')
-        for customer in customer_rows
-    ]
-
     today_row = (
         db.session.query(
             func.count(Sale.id),
@@ -104,14 +94,13 @@ def index():
         for item in low_stock_items
     ]
 
-    window_end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    window_start = window_end - timedelta(days=6)
-    window_days = [window_start.date() + timedelta(days=i) for i in range(7)]
+    today = local_today()
+    window_days = [today - timedelta(days=offset) for offset in range(6, -1, -1)]
 
     sales_rows = (
-        db.session.query(func.date(Sale.date), func.coalesce(func.sum(Sale.net_total), 0))
-        .filter(Sale.date >= window_start)
-        .group_by(func.date(Sale.date))
+        db.session.query(SalesDailyRollup.day, func.coalesce(func.sum(SalesDailyRollup.revenue), 0))
+        .filter(SalesDailyRollup.day >= window_days[0])
+        .group_by(SalesDailyRollup.day)
         .all()
     )
     expenses_rows = (
@@ -131,7 +120,6 @@ def index():
     sales_map = {_key(day): float(total or 0) for day, total in sales_rows}
     expenses_map = {_key(day): float(total or 0) for day, total in expenses_rows}
 
-    today = datetime.utcnow().date()
     mini = []
     for offset in range(6, -1, -1):
         day = today - timedelta(days=offset)
@@ -169,8 +157,6 @@ def index():
 
     return render_template(
         'index.html',
-        items=items,
-        customers=customers,
         sales=recent_sales_rows,
         today_count=today_count,
         today_rev=today_rev,
@@ -421,39 +407,40 @@ def create_payment_intent_for_sale(sale_id: int):
 @sales_bp.route('/sales/export.csv')
 @login_required
 def export_csv():
-    start_str, end_str, start_dt, end_dt = _parse_range(request.args.get('start'), request.args.get('end'))
-
-    query = Sale.query.options(joinedload(Sale.customer)).order_by(Sale.date.asc())
-    if start_dt:
-        query = query.filter(Sale.date >= start_dt)
-    if end_dt:
-        query = query.filter(Sale.date < end_dt)
-
-    rows = query.all()
+    start_str, end_str, start_day, end_day = _parse_range(request.args.get('start'), request.args.get('end'))
 
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(['Sale ID', 'Date', 'Item', 'Quantity', 'Customer', 'Payment', 'Net Total'])
-    for sale in rows:
-        writer.writerow([
-            sale.id,
-            sale.date.strftime('%Y-%m-%d %H:%M') if sale.date else '',
-            sale.item,
-            sale.quantity,
-            sale.customer.name if sale.customer else '',
-            (sale.payment_method or 'cash').title(),
-            f"{float(sale.net_total or 0):.2f}",
-        ])
+    stmt = (
+        select(Sale.id, Sale.date, Sale.item, Sale.quantity, Customer.name, Sale.payment_method, Sale.net_total)
+        .outerjoin(Customer, Customer.id == Sale.customer_id)
+        .order_by(Sale.date.asc())
+    )
+    if start_day:
+        stmt = stmt.where(Sale.local_date >= start_day)
+    if end_day:
+        stmt = stmt.where(Sale.local_date < end_day)
+
+    def rows():
+        for sale_id, sale_date, item, quantity, customer_name, payment_method, net_total in stream_rows(stmt):
+            yield [
+                sale_id,
+                sale_date.strftime('%Y-%m-%d %H:%M') if sale_date else '',
+                item,
+                quantity,
+                customer_name or '',
+                (payment_method or 'cash').title(),
+                f"{float(net_total or 0):.2f}",
+            ]
 
-    response = make_response(buffer.getvalue())
     filename_parts = ['sales']
     if start_str:
         filename_parts.append(start_str)
     if end_str:
         filename_parts.append(end_str)
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = f"attachment; filename={'_'.join(filename_parts)}.csv"
-    return response
+    return csv_response(
+        ['Sale ID', 'Date', 'Item', 'Quantity', 'Customer', 'Payment', 'Net Total'],
+        rows(),
+        f"{'_'.join(filename_parts)}.csv",
+    )
 
 
 @sales_bp.route('/restock', methods=['POST'])
@@ -483,16 +470,18 @@ def restock():
         flash('Item not found.', 'error')
         return redirect(url_for('sales.index'))
 
-    before_stock = item.current_stock or 0
-    item.current_stock = before_stock + quantity
-    item.updated_at = datetime.utcnow()
+    after_stock = increment_stock(item.id, quantity)
+    if after_stock is None:
+        db.session.rollback()
+        flash('Item not found.', 'error')
+        return redirect(url_for('sales.index'))
 
     log_event(
         action='restock',
         resource_type='item',
         resource_id=item.id,
-        before={'current_stock': before_stock},
-        after={'current_stock': item.current_stock},
+        before={'current_stock': after_stock - quantity},
+        after={'current_stock': after_stock},
     )
 
     db.session.commit()
@@ -502,163 +491,64 @@ def restock():
 
 @sales_bp.route('/sell', methods=['POST'])
 @login_required
+@idempotent
 def sell():
-    lock = Setting.query.filter_by(key='sales_lock_date').first()
-    today_str = datetime.utcnow().strftime('%Y-%m-%d')
-    if lock and lock.value == today_str and not (session.get('role') == 'admin' or session.get('admin')):
+    shop_config = get_shop_config()
+    today_str = local_today().isoformat()
+    if shop_config.sales_locked_on(today_str) and not (session.get('role') == 'admin' or session.get('admin')):
         flash('Sales are locked for today. An administrator must unlock before recording new sales.', 'warning')
         return redirect(url_for('sales.index'))
 
-    item_id = int(request.form['item_id'])
-    quantity = int(request.form['quantity'])
     customer_id_raw = request.form.get('customer_id')
     customer_id = int(customer_id_raw) if customer_id_raw else None
     customer_name = request.form.get('customer_name', '').strip()
     sale_type = (request.form.get('sale_type') or 'paid').lower()
     payment_method = (request.form.get('payment_method') or 'cash').lower()
-    if sale_type == 'udhar':
-        payment_method = 'udhar'
     discount = float(request.form.get('discount') or 0)
     voice_transcript = (request.form.get('voice_transcript') or '').strip()
 
-    item = Item.query.get(item_id)
-    if not item:
-        return 'Item not found', 404
-    if quantity > item.current_stock:
-        return 'Not enough stock', 400
-
-    customer = None
-    if customer_id:
-        customer = Customer.query.get(customer_id)
-    elif customer_name:
-        customer = Customer.query.filter_by(name=customer_name).first()
-        if not customer:
-            customer = Customer(name=customer_name)
-            db.session.add(customer)
-            db.session.flush()
+    item_ids = request.form.getlist('item_id')
+    quantities = request.form.getlist('quantity')
+    if len(item_ids) != len(quantities):
+        return 'Each cart line needs an item and a quantity', 400
 
-    profile = ShopProfile.query.get(1)
-
-    seller_state_form = (request.form.get('seller_state') or '').strip().upper()
-    seller_state = seller_state_form or 'DL'
-    seller_gstin = profile.gst if profile and profile.gst else None
-
-    buyer_state_form = (request.form.get('buyer_state') or request.form.get('customer_state') or '').strip().upper()
-    if customer and buyer_state_form and not customer.state:
-        customer.state = buyer_state_form
-    buyer_state = buyer_state_form or (customer.state.upper() if customer and customer.state else seller_state)
-    buyer_gstin = customer.gstin if customer and customer.gstin else (request.form.get('buyer_gstin') or None)
-
-    items_payload = [{
-        "description": item.name,
-        "hsn_sac": getattr(item, 'hsn', None),
-        "qty": quantity,
-        "rate": item.price or 0,
-        "gst_rate": item.gst_rate or 0,
-        "tax_rate": item.gst_rate or 0,
-    }]
-
-    gst_breakdown = calc_gst(items_payload, seller_state, buyer_state)
-    quant = Decimal("0.01")
-    subtotal_decimal = gst_breakdown["subtotal"].quantize(quant, rounding=ROUND_HALF_UP)
-    tax_total_decimal = gst_breakdown["tax_total"].quantize(quant, rounding=ROUND_HALF_UP)
-    cgst_decimal = gst_breakdown["cgst"].quantize(quant, rounding=ROUND_HALF_UP)
-    sgst_decimal = gst_breakdown["sgst"].quantize(quant, rounding=ROUND_HALF_UP)
-    igst_decimal = gst_breakdown["igst"].quantize(quant, rounding=ROUND_HALF_UP)
-    roundoff_decimal = gst_breakdown["roundoff"].quantize(quant, rounding=ROUND_HALF_UP)
-    total_decimal = gst_breakdown["total"].quantize(quant, rounding=ROUND_HALF_UP)
-
-    tax = float(tax_total_decimal)
-    net_total = float(total_decimal)
-
-    item.current_stock -= quantity
-
-    location_id = None
-    if profile:
-        default_location = profile.default_location
-        if not default_location and getattr(profile, "locations", None):
-            default_location = profile.locations[0]
-        if default_location:
-            location_id = default_location.id
-
-    sale = Sale(
-        item=item.name,
-        quantity=quantity,
-        total=net_total,
-        customer_id=customer.id if customer else customer_id,
-        payment_method=payment_method,
-        discount=discount,
-        tax=tax,
-        net_total=net_total,
-        invoice_number=next_invoice_number(),
-        location_id=location_id,
-        subtotal=subtotal_decimal,
-        tax_total=tax_total_decimal,
-        roundoff=roundoff_decimal,
-        cgst=cgst_decimal,
-        sgst=sgst_decimal,
-        igst=igst_decimal,
-        seller_gstin=seller_gstin,
-        buyer_gstin=buyer_gstin,
-        seller_state=seller_state,
-        buyer_state=buyer_state,
-        place_of_supply=buyer_state or seller_state,
-        notes=request.form.get('notes'),
-    )
-    db.session.add(sale)
-    db.session.flush()
-
-    breakdown = gst_breakdown["items"][0] if gst_breakdown["items"] else None
-    line_total_decimal = (
-        breakdown["gross"].quantize(quant, rounding=ROUND_HALF_UP) if breakdown else total_decimal
-    )
-    sale_item = SaleItem(
-        sale_id=sale.id,
-        description=item.name,
-        hsn_sac=getattr(item, 'hsn', None),
-        qty=Decimal(str(quantity)),
-        rate=Decimal(str(item.price or 0)),
-        gst_rate=Decimal(str(item.gst_rate or 0)),
-        tax_rate=Decimal(str(item.gst_rate or 0)),
-        line_total=line_total_decimal,
-    )
-    db.session.add(sale_item)
-
-    if sale_type == 'udhar':
-        credit_name = customer.name if customer else customer_name
-        if not credit_name:
-            return 'Customer required for udhar', 400
-        db.session.add(Credit(
-            customer_id=customer.id if customer else customer_id,
-            customer_name=credit_name,
-            item=item.name,
-            quantity=quantity,
-            total=net_total,
-            status='unpaid',
-            reminder_phone=(customer.phone if customer and customer.phone else None)
-        ))
-
-    audit_details = {
-        'item': item.name,
-        'quantity': quantity,
-        'invoice_number': sale.invoice_number,
-    }
-    if voice_transcript:
-        audit_details['voice_transcript'] = voice_transcript
-
-    log_event(
-        action='sell',
-        resource_type='sale',
-        resource_id=sale.id if sale.id else None,
-        before=None,
-        after=audit_details
-    )
+    try:
+        lines = build_cart(zip(item_ids, quantities))
+        customer = resolve_customer(customer_id, customer_name)
+
+        seller_state_form = (request.form.get('seller_state') or '').strip().upper()
+        seller_state = seller_state_form or 'DL'
+        seller_gstin = shop_config.gst or None
+
+        buyer_state_form = (request.form.get('buyer_state') or request.form.get('customer_state') or '').strip().upper()
+        if customer and buyer_state_form and not customer.state:
+            customer.state = buyer_state_form
+        buyer_state = buyer_state_form or (customer.state.upper() if customer and customer.state else seller_state)
+        buyer_gstin = customer.gstin if customer and customer.gstin else (request.form.get('buyer_gstin') or None)
+
+        sale = checkout(
+            lines,
+            customer=customer,
+            customer_name=customer_name,
+            payment_method=payment_method,
+            sale_type=sale_type,
+            discount=discount,
+            seller_state=seller_state,
+            buyer_state=buyer_state,
+            seller_gstin=seller_gstin,
+            buyer_gstin=buyer_gstin,
+            location_id=shop_config.default_location_id,
+            notes=request.form.get('notes'),
+            audit_extra={'voice_transcript': voice_transcript} if voice_transcript else None,
+        )
+    except CheckoutError as exc:
+        db.session.rollback()
+        return exc.message, exc.status
 
     db.session.commit()
 
-    invoice_path = create_invoice_pdf(sale.id)
-    if invoice_path:
-        session['invoice_ready'] = sale.id
+    queue_invoice_render(sale.id)
+    session['invoice_ready'] = sale.id
 
     redirect_url = url_for('sales.index')
     separator = '&' if '?' in redirect_url else '?'
@@ -668,14 +558,19 @@ def sell():
 @sales_bp.route('/invoice/<int:sale_id>')
 @login_required
 def invoice(sale_id: int):
-    path = create_invoice_pdf(sale_id)
-    if not path:
+    stored = ensure_invoice_pdf(sale_id)
+    if not stored:
         return 'Sale not found', 404
+    path, key = stored
+    # The store key is a content hash, so it doubles as a strong ETag.
     return send_file(
         path,
         as_attachment=True,
         download_name=f'invoice_{sale_id}.pdf',
-        mimetype='application/pdf'
+        mimetype='application/pdf',
+        conditional=True,
+        etag=key,
+        max_age=0,
     )
 
 
@@ -694,17 +589,36 @@ def invoice_pdf_v2():
     if not sale:
         return {"error": "sale not found"}, 404
 
-    items = sale.line_items or [sale]
-    customer = getattr(sale, "customer", None)
-    pdf_bytes, filename = render_sale_pdf(sale, items, customer)
+    path, key, filename = ensure_tax_invoice_pdf(sale)
     return send_file(
-        io.BytesIO(pdf_bytes),
+        path,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=filename
+        download_name=filename,
+        conditional=True,
+        etag=key,
+        max_age=0,
     )
 
 
+@sales_bp.route('/invoices.zip')
+@login_required
+def invoices_zip():
+    start_str = request.args.get('start') or request.args.get('from')
+    end_str = request.args.get('end') or request.args.get('to')
+    start_str, end_str, start_day, end_day = _parse_range(start_str, end_str)
+    if not start_day or not end_day:
+        return {"error": "start and end dates (YYYY-MM-DD) required"}, 400
+    end_day -= timedelta(days=1)
+    if end_day < start_day:
+        return {"error": "end must not be before start"}, 400
+
+    chunks, filename = stream_invoice_zip(start_day, end_day)
+    response = Response(stream_with_context(chunks), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
 @sales_bp.route('/send_invoice/<int:sale_id>')
 @login_required
 def send_invoice_route(sale_id: int):
@@ -716,7 +630,7 @@ def send_invoice_route(sale_id: int):
     if not customer or not customer.email:
         return 'Customer email not found.', 400
 
-    create_invoice_pdf(sale_id)
+    ensure_invoice_pdf(sale_id)
     invoice_no = sale.invoice_number or f"{sale_id:05d}"
 
     body = (
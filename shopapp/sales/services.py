@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import exists, func, insert, select
+
+from ..extensions import db
+from ..models import Credit, Customer, Item, Sale, SaleItem, Setting
+from ..utils.audit import log_event
+from ..utils.invoices import next_invoice_number
+from ..utils.customer_metrics import record_customer_sales
+from ..utils.rollups import record_sales
+from ..utils.schema import dialect_insert
+from ..utils.stock import InsufficientStockError, decrement_stock
+from ..utils_gst import calc_gst
+
+QUANT = Decimal("0.01")
+ITEM_LABEL_MAX = 255
+# Settings key claimed by the worker that copies line-less sales into sale_items.
+SALE_LINES_BACKFILL_KEY = "sale_lines_backfilled"
+
+
+class CheckoutError(RuntimeError):
+    """Raised when a cart cannot be turned into a sale."""
+
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@dataclass(frozen=True)
+class CartLine:
+    item_id: int
+    quantity: int
+
+
+def build_cart(pairs: Iterable[Tuple[Any, Any]]) -> List[CartLine]:
+    """Validate raw (item_id, quantity) pairs, merging repeated items."""
+
+    quantities: Dict[int, int] = {}
+    for raw_item_id, raw_quantity in pairs:
+        try:
+            item_id = int(raw_item_id)
+        except (TypeError, ValueError):
+            raise CheckoutError("item_id must be an integer.")
+        try:
+            quantity = int(raw_quantity)
+        except (TypeError, ValueError):
+            raise CheckoutError("quantity must be an integer.")
+        if quantity <= 0:
+            raise CheckoutError("quantity must be positive.")
+        quantities[item_id] = quantities.get(item_id, 0) + quantity
+
+    if not quantities:
+        raise CheckoutError("item_id and quantity are required.")
+    return [CartLine(item_id=item_id, quantity=quantity) for item_id, quantity in quantities.items()]
+
+
+def resolve_customer(customer_id: Optional[int], customer_name: str) -> Optional[Customer]:
+    if customer_id:
+        return Customer.query.get(customer_id)
+    if customer_name:
+        customer = Customer.query.filter_by(name=customer_name).first()
+        if not customer:
+            customer = Customer(name=customer_name)
+            db.session.add(customer)
+            db.session.flush()
+        return customer
+    return None
+
+
+def sale_label(names: Sequence[str]) -> str:
+    label = ", ".join(names)
+    if len(label) > ITEM_LABEL_MAX:
+        label = label[:ITEM_LABEL_MAX - 3] + "..."
+    return label
+
+
+def price_sale(entries: Sequence[Dict[str, Any]], seller_state: str, buyer_state: str,
+               taxable_discount: float = 0.0) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Price cart entries with GST and return ``(sale_values, line_values)``.
+
+    Each entry carries ``description``, ``hsn_sac``, ``qty``, ``rate`` and
+    ``gst_rate``. The returned dicts map straight onto ``Sale`` and
+    ``SaleItem`` columns so they can feed either ORM objects or bulk inserts.
+
+    ``taxable_discount`` is taken off the taxable value before GST, spread
+    over the lines by value, as the API has always priced discounts; the
+    sale's ``subtotal`` stays the undiscounted amount.
+    """
+
+    bases = [Decimal(str(entry["qty"])) * Decimal(str(entry["rate"] or 0)) for entry in entries]
+    gross_subtotal = sum(bases, Decimal(0))
+    taxed = [{**entry, "tax_rate": entry["gst_rate"]} for entry in entries]
+    if taxable_discount and gross_subtotal > 0:
+        off = min(Decimal(str(taxable_discount)), gross_subtotal)
+        taxed = [
+            {**entry, "qty": 1, "rate": base - off * base / gross_subtotal}
+            for entry, base in zip(taxed, bases)
+        ]
+    gst_breakdown = calc_gst(taxed, seller_state, buyer_state)
+    total_decimal = gst_breakdown["total"].quantize(QUANT, rounding=ROUND_HALF_UP)
+    tax_total_decimal = gst_breakdown["tax_total"].quantize(QUANT, rounding=ROUND_HALF_UP)
+    net_total = float(total_decimal)
+
+    sale_values: Dict[str, Any] = {
+        "item": sale_label([entry["description"] for entry in entries]),
+        "quantity": sum(int(entry["qty"]) for entry in entries),
+        "total": net_total,
+        "tax": float(tax_total_decimal),
+        "net_total": net_total,
+        "subtotal": gross_subtotal.quantize(QUANT, rounding=ROUND_HALF_UP),
+        "tax_total": tax_total_decimal,
+        "roundoff": gst_breakdown["roundoff"].quantize(QUANT, rounding=ROUND_HALF_UP),
+        "cgst": gst_breakdown["cgst"].quantize(QUANT, rounding=ROUND_HALF_UP),
+        "sgst": gst_breakdown["sgst"].quantize(QUANT, rounding=ROUND_HALF_UP),
+        "igst": gst_breakdown["igst"].quantize(QUANT, rounding=ROUND_HALF_UP),
+        "seller_state": seller_state,
+        "buyer_state": buyer_state,
+        "place_of_supply": buyer_state or seller_state,
+    }
+    line_values = [
+        {
+            "description": entry["description"],
+            "hsn_sac": entry["hsn_sac"],
+            "qty": Decimal(str(entry["qty"])),
+            "rate": Decimal(str(entry["rate"] or 0)),
+            "gst_rate": Decimal(str(entry["gst_rate"] or 0)),
+            "tax_rate": Decimal(str(entry["gst_rate"] or 0)),
+            "line_total": breakdown["gross"].quantize(QUANT, rounding=ROUND_HALF_UP),
+        }
+        for entry, breakdown in zip(entries, gst_breakdown["items"])
+    ]
+    return sale_values, line_values
+
+
+def item_entry(item: Item, quantity: int, rate: Any = None, gst_rate: Any = None) -> Dict[str, Any]:
+    return {
+        "description": item.name,
+        "hsn_sac": item.hsn,
+        "qty": quantity,
+        "rate": (item.price or 0) if rate is None else rate,
+        "gst_rate": (item.gst_rate or 0) if gst_rate is None else gst_rate,
+    }
+
+
+def credit_values(customer: Optional[Customer], customer_name: str, sale_values: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "customer_id": customer.id if customer else None,
+        "customer_name": customer.name if customer else customer_name,
+        "item": sale_values["item"],
+        "quantity": sale_values["quantity"],
+        "total": sale_values["net_total"],
+        "status": 'unpaid',
+        "reminder_phone": (customer.phone if customer and customer.phone else None),
+    }
+
+
+def checkout(
+    lines: Sequence[CartLine],
+    *,
+    customer: Optional[Customer] = None,
+    customer_name: str = "",
+    payment_method: str = "cash",
+    sale_type: str = "paid",
+    discount: float = 0.0,
+    discount_before_tax: bool = False,
+    seller_state: str = "DL",
+    buyer_state: Optional[str] = None,
+    seller_gstin: Optional[str] = None,
+    buyer_gstin: Optional[str] = None,
+    location_id: Optional[int] = None,
+    notes: Optional[str] = None,
+    audit_extra: Optional[Dict[str, Any]] = None,
+) -> Sale:
+    """Record one sale with a line per cart entry.
+
+    Stock, GST, the invoice number, the optional udhar credit and the audit
+    entry are all handled once for the whole cart. Stock is taken with
+    conditional UPDATEs, so a failed checkout must be rolled back by the
+    caller, which also owns the commit. With ``discount_before_tax`` the
+    discount is taken off the taxable value, as the API prices it; the web
+    POS only records it.
+    """
+
+    if sale_type == "udhar":
+        payment_method = "udhar"
+        if not (customer or customer_name):
+            raise CheckoutError("Customer required for udhar.")
+
+    item_ids = [line.item_id for line in lines]
+    items = {item.id: item for item in Item.query.filter(Item.id.in_(item_ids)).all()}
+    for line in lines:
+        if line.item_id not in items:
+            raise CheckoutError("Item not found.", status=404)
+
+    buyer_state = buyer_state or seller_state
+    sale_values, line_values = price_sale(
+        [item_entry(items[line.item_id], line.quantity) for line in lines],
+        seller_state,
+        buyer_state,
+        taxable_discount=discount if discount_before_tax else 0.0,
+    )
+
+    for line in lines:
+        try:
+            decrement_stock(line.item_id, line.quantity)
+        except InsufficientStockError:
+            raise CheckoutError(f"Insufficient stock for {items[line.item_id].name}.")
+        except LookupError:
+            raise CheckoutError("Item not found.", status=404)
+
+    sale = Sale(
+        **sale_values,
+        customer_id=customer.id if customer else None,
+        payment_method=payment_method,
+        discount=discount,
+        invoice_number=next_invoice_number(location_id),
+        location_id=location_id,
+        seller_gstin=seller_gstin,
+        buyer_gstin=buyer_gstin,
+        notes=notes,
+    )
+    for values in line_values:
+        sale.line_items.append(SaleItem(**values))
+    db.session.add(sale)
+    db.session.flush()
+    written = [{
+        **sale_values,
+        "date": sale.date,
+        "local_date": sale.local_date,
+        "customer_id": sale.customer_id,
+        "payment_method": sale.payment_method,
+        "discount": discount,
+        "location_id": location_id,
+    }]
+    record_sales(written)
+    record_customer_sales(written)
+
+    if sale_type == "udhar":
+        db.session.add(Credit(**credit_values(customer, customer_name, sale_values)))
+
+    audit_details: Dict[str, Any] = {
+        'item': sale.item,
+        'quantity': sale.quantity,
+        'lines': [{'item_id': line.item_id, 'quantity': line.quantity} for line in lines],
+        'invoice_number': sale.invoice_number,
+    }
+    if audit_extra:
+        audit_details.update(audit_extra)
+
+    log_event(
+        action='sell',
+        resource_type='sale',
+        resource_id=sale.id,
+        before=None,
+        after=audit_details,
+    )
+    return sale
+
+
+def backfill_sale_lines_if_needed() -> int:
+    """Give every sale recorded without lines one line built from the sale, once.
+
+    The API used to save bare ``Sale`` rows; per-item reports and forecasts
+    read ``SaleItem``, so those sales would otherwise drop out of them. The
+    settings marker is claimed in the same transaction as the copy, so only
+    one worker runs it. Returns the number of lines written.
+    """
+
+    claimed = db.session.execute(
+        dialect_insert(db.engine, Setting.__table__)
+        .values(key=SALE_LINES_BACKFILL_KEY, value=datetime.utcnow().isoformat())
+        .on_conflict_do_nothing(index_elements=["key"])
+    ).rowcount
+    if not claimed:
+        db.session.commit()
+        return 0
+
+    quantity = func.coalesce(Sale.quantity, 0)
+    amount = func.coalesce(Sale.net_total, Sale.total, 0)
+    rate = func.coalesce((amount - func.coalesce(Sale.tax, 0)) / func.nullif(quantity, 0), 0)
+    written = db.session.execute(
+        insert(SaleItem).from_select(
+            ["sale_id", "description", "qty", "rate", "line_total"],
+            select(Sale.id, Sale.item, quantity, rate, amount)
+            .where(~exists().where(SaleItem.sale_id == Sale.id)),
+        )
+    ).rowcount
+    db.session.commit()
+    return written
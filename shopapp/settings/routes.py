@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta
+import os
 import secrets
 import json
 from pathlib import Path
@@ -24,8 +25,10 @@ from ..models import (
     UserSession,
     WebhookEvent,
 )
+from ..reports.zreport import discard_zreport_snapshot
 from ..utils.audit import log_event
 from ..utils.decorators import admin_required, login_required
+from ..utils.pdfs import clear_branding_cache
 from ..utils.qr import qr_to_base64
 
 settings_bp = Blueprint("settings", __name__, url_prefix="/settings")
@@ -47,7 +50,8 @@ def _save_upload(file_storage, slug: str) -> str | None:
 
     dest = _branding_upload_dir() / f"{slug}_{filename}"
     file_storage.save(dest)
-    return dest.relative_to(Path(current_app.root_path)).as_posix()
+    # The instance folder sits beside the package, so the path may climb out of root_path.
+    return Path(os.path.relpath(dest, current_app.root_path)).as_posix()
 
 
 @settings_bp.route("/")
@@ -131,6 +135,8 @@ def branding():
             db.session.add(Setting(key="ui_theme", value=theme_choice))
 
         db.session.commit()
+        if saved_logo or saved_signature or saved_watermark:
+            clear_branding_cache()
         flash("Branding settings updated.", "success")
         return redirect(url_for("settings.branding"))
 
@@ -166,6 +172,11 @@ def unlock_day():
     unlocked_total = (
         Sale.query.update({"locked": False}, synchronize_session=False) or 0
     )
+    if previous_lock:
+        try:
+            discard_zreport_snapshot(datetime.strptime(previous_lock, "%Y-%m-%d").date())
+        except ValueError:
+            pass
     timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M")
     actor = session.get("user") or "system"
     message = f"Unlocked manually on {timestamp} by {actor}: {reason} ({int(unlocked_total)} sales reset)"
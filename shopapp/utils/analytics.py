@@ -1,14 +1,21 @@
 from __future__ import annotations
 
+import threading
+import time
 from collections import defaultdict
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Dict, Iterable, List, Tuple
 
-from sqlalchemy import func
+from flask import current_app
+from sqlalchemy import func, select
 
 from ..extensions import db
-from ..models import Customer, Expense, ExpenseCategory, Sale, Item
+from ..models import Customer, CustomerMetrics, Expense, ExpenseCategory, Item, ItemForecast, Sale, SaleItem, SalesDailyRollup
+from . import analytics_numpy
+from .forecasting import load_forecasts, reorder_plan
+from .localtime import local_today, to_local
+from .schema import weekday_and_hour
 
 
 @dataclass
@@ -21,45 +28,45 @@ class DailyRow:
     tax: float
 
 
-def _collect_sales(start: datetime) -> List[Sale]:
+def _collect_daily_sales(first_day: date) -> List[Tuple[date, float, float, float]]:
+    """Per-day revenue, discount and tax from the rollup, summed over locations and methods."""
     return (
-        Sale.query
-        .filter(Sale.date >= start)
-        .order_by(Sale.date.asc())
+        db.session.query(
+            SalesDailyRollup.day,
+            func.coalesce(func.sum(SalesDailyRollup.revenue), 0),
+            func.coalesce(func.sum(SalesDailyRollup.discount), 0),
+            func.coalesce(func.sum(SalesDailyRollup.tax), 0),
+        )
+        .filter(SalesDailyRollup.day >= first_day)
+        .group_by(SalesDailyRollup.day)
         .all()
     )
 
 
-def _collect_expenses(start: datetime) -> List[Expense]:
+def _collect_expenses(first_day: date) -> List[Expense]:
     return (
         Expense.query
-        .filter(Expense.date >= start.date())
+        .filter(Expense.date >= first_day)
         .order_by(Expense.date.asc())
         .all()
     )
 
 
-def _aggregate_daily(sales: Iterable[Sale], expenses: Iterable[Expense]) -> Dict[datetime, DailyRow]:
-    rows: Dict[datetime, DailyRow] = {}
-    expense_map: Dict[datetime, float] = defaultdict(float)
+def _aggregate_daily(daily_sales: Iterable[Tuple[date, float, float, float]], expenses: Iterable[Expense]) -> Dict[date, DailyRow]:
+    rows: Dict[date, DailyRow] = {}
+    expense_map: Dict[date, float] = defaultdict(float)
     for exp in expenses:
         expense_map[exp.date] += float(exp.amount or 0)
 
-    for sale in sales:
-        day = sale.date.date()
-        if day not in rows:
-            rows[day] = DailyRow(
-                date=datetime.combine(day, datetime.min.time()),
-                revenue=0.0,
-                expenses=0.0,
-                profit=0.0,
-                discount=0.0,
-                tax=0.0,
-            )
-        row = rows[day]
-        row.revenue += float(sale.net_total or 0)
-        row.discount += float(sale.discount or 0)
-        row.tax += float(sale.tax or 0)
+    for day, revenue, discount, tax in daily_sales:
+        rows[day] = DailyRow(
+            date=datetime.combine(day, datetime.min.time()),
+            revenue=float(revenue or 0),
+            expenses=0.0,
+            profit=0.0,
+            discount=float(discount or 0),
+            tax=float(tax or 0),
+        )
 
     for day, amount in expense_map.items():
         d = datetime.combine(day, datetime.min.time())
@@ -110,15 +117,22 @@ def _group_period(rows: Iterable[DailyRow], period: str) -> List[Dict[str, objec
     return ordered
 
 
-def _build_heatmap(sales: Iterable[Sale]) -> Dict[str, object]:
+def _build_heatmap(start: datetime) -> Dict[str, object]:
+    weekday, _ = weekday_and_hour(db.engine, Sale.local_date)
+    hour = Sale.local_hour
+    rows = (
+        db.session.query(weekday, hour, func.coalesce(func.sum(Sale.net_total), 0))
+        .filter(Sale.date >= start)
+        .group_by(weekday, hour)
+        .all()
+    )
+
     matrix = [[0.0 for _ in range(24)] for _ in range(7)]
     max_value = 0.0
-    for sale in sales:
-        dow = sale.date.weekday()  # Monday=0
-        hour = sale.date.hour
-        matrix[dow][hour] += float(sale.net_total or 0)
-        if matrix[dow][hour] > max_value:
-            max_value = matrix[dow][hour]
+    for dow, hour_of_day, total in rows:
+        matrix[dow][hour_of_day] += float(total or 0)
+        if matrix[dow][hour_of_day] > max_value:
+            max_value = matrix[dow][hour_of_day]
 
     return {
         "days": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
@@ -130,35 +144,27 @@ def _build_heatmap(sales: Iterable[Sale]) -> Dict[str, object]:
 
 def _ltv_leaderboard(limit: int = 10) -> List[Dict[str, object]]:
     rows = (
-        db.session.query(
-            Sale.customer_id,
-            func.coalesce(func.sum(Sale.net_total), 0),
-            func.count(Sale.id),
-            func.max(Sale.date),
-        )
-        .filter(Sale.customer_id.isnot(None))
-        .group_by(Sale.customer_id)
-        .order_by(func.sum(Sale.net_total).desc())
+        db.session.query(CustomerMetrics, Customer)
+        .outerjoin(Customer, Customer.id == CustomerMetrics.customer_id)
+        .order_by(CustomerMetrics.lifetime_value.desc())
         .limit(limit)
         .all()
     )
-    customer_ids = [row[0] for row in rows if row[0]]
-    customers = {c.id: c for c in Customer.query.filter(Customer.id.in_(customer_ids)).all()}
 
     leaderboard = []
-    for customer_id, total, orders, last_date in rows:
-        customer = customers.get(customer_id)
+    for metrics, customer in rows:
+        last_date = metrics.last_purchase_at
         leaderboard.append({
-            "customer": customer.name if customer else f"Customer #{customer_id}",
+            "customer": customer.name if customer else f"Customer #{metrics.customer_id}",
             "email": customer.email if customer else None,
-            "total": float(total or 0),
-            "orders": int(orders or 0),
+            "total": float(metrics.lifetime_value or 0),
+            "orders": int(metrics.order_count or 0),
             "last_purchase": last_date.strftime("%Y-%m-%d %H:%M") if last_date else None,
         })
     return leaderboard
 
 
-def _category_breakdown(start: datetime) -> List[Dict[str, object]]:
+def _category_breakdown(first_day: date) -> List[Dict[str, object]]:
     label_expr = func.coalesce(ExpenseCategory.name, Expense.category, 'Uncategorised')
 
     rows = (
@@ -168,7 +174,7 @@ def _category_breakdown(start: datetime) -> List[Dict[str, object]]:
             ExpenseCategory.color,
         )
         .outerjoin(ExpenseCategory, Expense.category_id == ExpenseCategory.id)
-        .filter(Expense.date >= start.date())
+        .filter(Expense.date >= first_day)
         .group_by(label_expr, ExpenseCategory.color)
         .order_by(func.sum(Expense.amount).desc())
         .all()
@@ -188,7 +194,7 @@ def _category_breakdown(start: datetime) -> List[Dict[str, object]]:
     return breakdown
 
 
-def _item_metrics(items: Iterable[Item], sales: Iterable[Sale]) -> Dict[str, Dict[str, object]]:
+def _item_metrics(items: Iterable[Item], start: datetime) -> Dict[str, Dict[str, object]]:
     metrics: Dict[str, Dict[str, object]] = {}
     for item in items:
         metrics[item.name.lower()] = {
@@ -199,52 +205,63 @@ def _item_metrics(items: Iterable[Item], sales: Iterable[Sale]) -> Dict[str, Dic
             "sale_count": 0,
         }
 
-    for sale in sales:
-        key = (sale.item or '').lower()
-        if key not in metrics:
+    label = func.lower(func.coalesce(SaleItem.description, ''))
+    rows = (
+        db.session.query(
+            label,
+            func.coalesce(func.sum(SaleItem.qty), 0),
+            func.coalesce(func.sum(SaleItem.line_total), 0),
+            func.count(SaleItem.id),
+            func.max(Sale.date),
+        )
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .filter(Sale.date >= start)
+        .group_by(label)
+        .all()
+    )
+    for name, units, revenue, count, last_sale in rows:
+        # SQL lower() only folds ASCII, so fold again to match item names.
+        entry = metrics.get((name or '').lower())
+        if entry is None:
             continue
-        entry = metrics[key]
-        entry["units_sold"] += int(sale.quantity or 0)
-        entry["revenue"] += float(sale.net_total or 0)
-        entry["sale_count"] += 1
-        if entry["last_sale"] is None or sale.date > entry["last_sale"]:
-            entry["last_sale"] = sale.date
+        entry["units_sold"] += int(units or 0)
+        entry["revenue"] += float(revenue or 0)
+        entry["sale_count"] += int(count or 0)
+        if last_sale is not None and (entry["last_sale"] is None or last_sale > entry["last_sale"]):
+            entry["last_sale"] = last_sale
 
     return metrics
 
 
-def _recommendations(items: Iterable[Item], item_metrics: Dict[str, Dict[str, object]]) -> List[Dict[str, str]]:
+def _recommendations(items: Iterable[Item], forecasts: Dict[int, ItemForecast]) -> List[Dict[str, str]]:
     recs: List[Dict[str, str]] = []
-    now = datetime.utcnow()
+    window = current_app.config.get("FORECAST_WINDOW_DAYS", 56)
 
     for item in items:
-        key = item.name.lower()
-        data = item_metrics.get(key, {"units_sold": 0, "revenue": 0.0, "last_sale": None, "sale_count": 0})
+        forecast = forecasts.get(item.id)
+        daily_demand = forecast.daily_demand if forecast else 0.0
         reorder_level = item.reorder_level if item.reorder_level is not None else 5
         stock = item.current_stock or 0
+        plan = reorder_plan(stock, reorder_level, daily_demand)
 
-        if stock <= reorder_level:
+        if plan["due"]:
+            cover = f", about {plan['days_of_cover']:.0f} days at current demand" if plan["days_of_cover"] is not None else ""
             recs.append({
                 "type": "reorder",
                 "title": f"Reorder {item.name}",
-                "message": f"{stock} left in stock (reorder at {reorder_level}). Place a purchase order soon.",
+                "message": f"{stock} left in stock (reorder at {reorder_level}{cover}). Suggested order: {plan['recommended']} units.",
             })
-
-        last_sale = data.get("last_sale")
-        days_since = (now - last_sale).days if last_sale else None
-        if stock > reorder_level and (data.get("units_sold", 0) == 0 or (days_since and days_since > 30)):
-            reason = "No sales recorded yet" if data.get("units_sold", 0) == 0 else f"Last sold {days_since} days ago"
+        elif not forecast or forecast.units_sold == 0:
             recs.append({
                 "type": "slow",
                 "title": f"Review pricing for {item.name}",
-                "message": f"{reason}. Consider promotions, bundling, or adjusting reorder level.",
+                "message": f"No sales in the last {window} days. Consider promotions, bundling, or adjusting reorder level.",
             })
-
-        if data.get("units_sold", 0) >= max(10, reorder_level * 2) and stock <= reorder_level * 2:
+        elif plan["days_of_cover"] is not None and plan["days_of_cover"] < current_app.config.get("FORECAST_COVER_DAYS", 21):
             recs.append({
                 "type": "fast",
                 "title": f"High demand for {item.name}",
-                "message": f"{data['units_sold']} units sold recently. Stock at {stock}; plan replenishment to avoid stock-outs.",
+                "message": f"Selling about {daily_demand:.1f} a day; {stock} in stock covers {plan['days_of_cover']:.0f} days. Plan replenishment to avoid stock-outs.",
             })
 
     if not recs:
@@ -257,13 +274,26 @@ def _recommendations(items: Iterable[Item], item_metrics: Dict[str, Dict[str, ob
     return recs
 
 
-def load_analytics(days: int = 90) -> Dict[str, object]:
+def _sales_aggregates(start: datetime, heat_start: datetime, items: List[Item], first_day: date):
+    """Daily sales from the rollup; heatmap and item metrics from the configured engine."""
+    daily_sales = _collect_daily_sales(first_day)
+    if current_app.config.get("ANALYTICS_ENGINE") == "numpy":
+        if analytics_numpy.available():
+            return (daily_sales, *analytics_numpy.sales_aggregates(start, heat_start, items))
+        current_app.logger.warning("ANALYTICS_ENGINE=numpy but NumPy is not installed; using SQL aggregates.")
+    return daily_sales, _build_heatmap(heat_start), _item_metrics(items, start)
+
+
+def compute_analytics(days: int = 90) -> Dict[str, object]:
+    """Build the analytics payload from the database, bypassing the cache."""
     start = datetime.utcnow() - timedelta(days=days)
-    sales = _collect_sales(start)
-    expenses = _collect_expenses(start)
+    heat_start = max(start, datetime.utcnow() - timedelta(days=30))
+    # Daily figures cover whole shop-local days.
+    first_day = to_local(start).date()
+    expenses = _collect_expenses(first_day)
     items = Item.query.order_by(Item.name.asc()).all()
-    item_metrics = _item_metrics(items, sales)
-    daily_rows_map = _aggregate_daily(sales, expenses)
+    daily_sales, heatmap, item_metrics = _sales_aggregates(start, heat_start, items, first_day)
+    daily_rows_map = _aggregate_daily(daily_sales, expenses)
     daily_rows = [daily_rows_map[day] for day in sorted(daily_rows_map.keys())]
 
     summary = {
@@ -273,9 +303,6 @@ def load_analytics(days: int = 90) -> Dict[str, object]:
         "average_daily_profit": round(sum(row.profit for row in daily_rows) / len(daily_rows), 2) if daily_rows else 0,
     }
 
-    recent_sales = [sale for sale in sales if sale.date >= datetime.utcnow() - timedelta(days=30)]
-    heatmap = _build_heatmap(recent_sales)
-
     daily_series = [{
         "label": row.date.strftime("%Y-%m-%d"),
         "revenue": round(row.revenue, 2),
@@ -313,13 +340,78 @@ def load_analytics(days: int = 90) -> Dict[str, object]:
         "monthly": monthly_series,
         "heatmap": heatmap,
         "ltv": _ltv_leaderboard(),
-        "categories": _category_breakdown(start),
-        "recommendations": _recommendations(items, item_metrics),
+        "categories": _category_breakdown(first_day),
+        "recommendations": _recommendations(items, load_forecasts()),
         "best_item": best_item,
         "low_stock": low_stock,
     }
 
 
+def _data_version() -> Tuple[object, ...]:
+    """A stamp that changes whenever sales, expenses, categories, items, customers or forecasts are written.
+
+    Every sale write upserts the daily rollup and every stock change touches
+    ``items.updated_at``, so a handful of indexed MAX/COUNT lookups cover all
+    the inputs of the payload without reading the sales table.
+    """
+
+    probes = (
+        func.max(SalesDailyRollup.updated_at),
+        func.max(Sale.id),
+        func.max(Item.updated_at),
+        func.count(Item.id),
+        func.max(Expense.id),
+        func.count(Expense.id),
+        func.max(Expense.updated_at),
+        func.count(ExpenseCategory.id),
+        func.max(ExpenseCategory.updated_at),
+        func.max(Customer.updated_at),
+        func.max(ItemForecast.computed_at),
+    )
+    return tuple(db.session.execute(select(*(select(probe).scalar_subquery() for probe in probes))).one())
+
+
+_cache_lock = threading.Lock()
+_cache: Dict[Tuple[int, str], Tuple[Tuple[object, ...], float, Dict[str, object]]] = {}
+_CACHE_MAX_ENTRIES = 32
+
+
+def load_analytics(days: int = 90) -> Dict[str, object]:
+    """Return the analytics payload for the last ``days`` days.
+
+    Payloads are cached per process, keyed by window, engine and the current
+    data version, so repeated views between writes only cost the version
+    lookup. ``ANALYTICS_CACHE_TTL`` bounds the age of a cached payload, since
+    the window itself moves with time. Treat the result as read-only.
+    """
+
+    ttl = current_app.config.get("ANALYTICS_CACHE_TTL", 300)
+    if ttl <= 0:
+        return compute_analytics(days)
+
+    key = (days, current_app.config.get("ANALYTICS_ENGINE", "sql"))
+    # Day rollover moves every window even without writes.
+    version = (local_today(), *_data_version())
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == version and now - cached[1] < ttl:
+        return cached[2]
+
+    payload = compute_analytics(days)
+    with _cache_lock:
+        _cache.pop(key, None)
+        if len(_cache) >= _CACHE_MAX_ENTRIES:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = (version, now, payload)
+    return payload
+
+
+def reset_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
 def build_daily_csv(data: List[Dict[str, object]]) -> List[List[str]]:
     rows = [["Date", "Revenue", "Expenses", "Profit"]]
     for entry in data:
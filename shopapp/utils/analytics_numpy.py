@@ -0,0 +1,153 @@
+"""Columnar analytics engine.
+
+Loads the heatmap window's sales and the item window's sale lines as NumPy
+arrays and derives the heatmap and per-item metrics with ``bincount``
+group-bys. The daily series is not rebuilt here: :mod:`.analytics` reads it
+from the daily rollup for either engine. Selected with
+``ANALYTICS_ENGINE = "numpy"``; :mod:`.analytics` falls back to its SQL
+aggregates when NumPy is not installed.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import BigInteger, Float, Integer, cast, extract, func, literal, select
+
+from ..extensions import db
+from ..models import Item, Sale, SaleItem
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+_EPOCH = date(1970, 1, 1)
+# 1970-01-01 was a Thursday (Monday=0).
+_EPOCH_WEEKDAY = 3
+_FETCH_SIZE = 50_000
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _epoch_column():
+    if db.engine.url.get_backend_name() == "sqlite":
+        return cast(func.strftime('%s', Sale.date), BigInteger)
+    return cast(extract('epoch', Sale.date), BigInteger)
+
+
+def _local_day_column():
+    """``Sale.local_date`` as days since 1970-01-01."""
+    if db.engine.url.get_backend_name() == "sqlite":
+        return cast(func.julianday(Sale.local_date) - 2440587.5, Integer)
+    return Sale.local_date - literal(_EPOCH)
+
+
+def _fetch(stmt, names: Tuple[str, ...], dtypes: Dict[str, Any], convert: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Stream ``stmt`` into one array per selected column."""
+    convert = convert or {}
+    chunks: Dict[str, List[Any]] = {name: [] for name in names}
+    # Core execution on the session's connection skips ORM row processing.
+    result = db.session.connection().execution_options(stream_results=True).execute(stmt)
+    for partition in result.partitions(_FETCH_SIZE):
+        for name, values in zip(names, zip(*partition)):
+            if name in convert:
+                values = convert[name](values)
+            chunks[name].append(np.array(values, dtype=dtypes[name]))
+    return {
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=dtypes[name])
+        for name, parts in chunks.items()
+    }
+
+
+def _load_columns(heat_start: datetime) -> Dict[str, Any]:
+    """Fetch the sales since ``heat_start`` as parallel arrays of local day, local hour and net total."""
+    stmt = (
+        select(
+            _local_day_column(),
+            func.coalesce(Sale.local_hour, 0),
+            cast(func.coalesce(Sale.net_total, 0), Float),
+        )
+        .where(Sale.date >= heat_start)
+    )
+    dtypes = {"day": np.int64, "hour": np.int64, "net": np.float64}
+    return _fetch(stmt, tuple(dtypes), dtypes)
+
+
+def _load_lines(start: datetime, items: Iterable[Item]) -> Dict[str, Any]:
+    """Fetch the sale lines since ``start`` as parallel arrays; item codes index into ``items``."""
+    codes_by_name = {item.name.lower(): index for index, item in enumerate(items)}
+    code_for_label: Dict[Any, int] = {}
+
+    def codes(labels):
+        result = []
+        for label in labels:
+            code = code_for_label.get(label)
+            if code is None:
+                code = code_for_label[label] = codes_by_name.get((label or '').lower(), -1)
+            result.append(code)
+        return result
+
+    stmt = (
+        select(
+            _epoch_column(),
+            cast(func.coalesce(SaleItem.qty, 0), Float),
+            cast(func.coalesce(SaleItem.line_total, 0), Float),
+            SaleItem.description,
+        )
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .where(Sale.date >= start)
+    )
+    dtypes = {"ts": np.int64, "qty": np.float64, "amount": np.float64, "code": np.int32}
+    return _fetch(stmt, tuple(dtypes), dtypes, {"code": codes})
+
+
+def _heatmap(columns: Dict[str, Any]) -> Dict[str, object]:
+    weekday = (columns["day"] + _EPOCH_WEEKDAY) % 7
+    cells = np.bincount(weekday * 24 + columns["hour"], weights=columns["net"], minlength=7 * 24).reshape(7, 24)
+    return {
+        "days": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+        "hours": list(range(24)),
+        "matrix": cells.tolist(),
+        "max": max(0.0, float(cells.max())),
+    }
+
+
+def _item_metrics(lines: Dict[str, Any], items: List[Item]) -> Dict[str, Dict[str, object]]:
+    mask = lines["code"] >= 0
+    codes = lines["code"][mask]
+    size = len(items)
+    units = np.bincount(codes, weights=lines["qty"][mask], minlength=size)
+    revenue = np.bincount(codes, weights=lines["amount"][mask], minlength=size)
+    counts = np.bincount(codes, minlength=size)
+    last = np.full(size, -1, dtype=np.int64)
+    np.maximum.at(last, codes, lines["ts"][mask])
+
+    metrics: Dict[str, Dict[str, object]] = {}
+    for item in items:
+        metrics[item.name.lower()] = {
+            "item": item,
+            "units_sold": 0,
+            "revenue": 0.0,
+            "last_sale": None,
+            "sale_count": 0,
+        }
+    for index in np.flatnonzero(counts):
+        entry = metrics[items[index].name.lower()]
+        entry["units_sold"] = int(round(units[index]))
+        entry["revenue"] = float(revenue[index])
+        entry["sale_count"] = int(counts[index])
+        entry["last_sale"] = datetime.utcfromtimestamp(int(last[index]))
+    return metrics
+
+
+def sales_aggregates(start: datetime, heat_start: datetime, items: List[Item]):
+    """Return ``(heatmap, item_metrics)`` like the SQL engine.
+
+    Days and hours come from the stamped local columns. ``last_sale`` is
+    truncated to the second.
+    """
+
+    return _heatmap(_load_columns(heat_start)), _item_metrics(_load_lines(start, items), items)
@@ -2,16 +2,17 @@ from __future__ import annotations
 
 import json
 from datetime import datetime
-from typing import Any
+from typing import Any, Dict, Iterable
 
 from flask import has_request_context, request, session
+from sqlalchemy import insert
 
 from ..extensions import db
 from ..models import AuditLog
 
 
-def log_event(action: str, resource_type: str | None = None, resource_id: int | None = None,
-              before: Any | None = None, after: Any | None = None) -> None:
+def audit_values(action: str, resource_type: str | None = None, resource_id: int | None = None,
+                 before: Any | None = None, after: Any | None = None) -> Dict[str, Any]:
     if has_request_context():
         actor = session.get("user")
         ip_address = request.remote_addr
@@ -21,16 +22,27 @@ def log_event(action: str, resource_type: str | None = None, resource_id: int |
         ip_address = None
         user_agent = None
 
-    entry = AuditLog(
-        ts=datetime.utcnow(),
-        user=actor,
-        action=action,
-        details=json.dumps({"resource": resource_type, "id": resource_id}),
-        resource_type=resource_type,
-        resource_id=resource_id,
-        before_state=json.dumps(before, default=str) if before is not None else None,
-        after_state=json.dumps(after, default=str) if after is not None else None,
-        ip_address=ip_address,
-        user_agent=user_agent,
-    )
-    db.session.add(entry)
+    return {
+        "ts": datetime.utcnow(),
+        "user": actor,
+        "action": action,
+        "details": json.dumps({"resource": resource_type, "id": resource_id}),
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "before_state": json.dumps(before, default=str) if before is not None else None,
+        "after_state": json.dumps(after, default=str) if after is not None else None,
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+    }
+
+
+def log_event(action: str, resource_type: str | None = None, resource_id: int | None = None,
+              before: Any | None = None, after: Any | None = None) -> None:
+    db.session.add(AuditLog(**audit_values(action, resource_type, resource_id, before, after)))
+
+
+def log_events(rows: Iterable[Dict[str, Any]]) -> None:
+    """Write many entries built by :func:`audit_values` in one executemany."""
+    rows = list(rows)
+    if rows:
+        db.session.execute(insert(AuditLog), rows)
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from ..extensions import db
+from ..models import Item
+
+_CHANGED_KEY = "barcode_items_changed"
+_COLUMNS = (Item.id, Item.barcode, Item.name, Item.price, Item.gst_rate, Item.current_stock)
+
+_lock = threading.Lock()
+_by_barcode: Optional[Dict[str, Dict[str, Any]]] = None
+_barcode_by_id: Dict[int, str] = {}
+_built_at = 0.0
+# Bumped on every invalidation so a lookup that raced a commit does not
+# cache what it read before the commit.
+_generation = 0
+
+
+def _entry(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "barcode": row.barcode,
+        "name": row.name,
+        "price": float(row.price or 0),
+        "gst_rate": float(row.gst_rate or 0),
+        "stock": int(row.current_stock or 0),
+    }
+
+
+def _normalize(code: Optional[str]) -> str:
+    return (code or "").strip()
+
+
+def _build_snapshot() -> None:
+    global _by_barcode, _barcode_by_id, _built_at
+    rows = db.session.execute(select(*_COLUMNS).where(Item.barcode.isnot(None), Item.barcode != "")).all()
+    by_barcode: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        by_barcode[_normalize(row.barcode)] = _entry(row)
+    _by_barcode = by_barcode
+    _barcode_by_id = {entry["id"]: code for code, entry in by_barcode.items()}
+    _built_at = time.monotonic()
+
+
+def lookup_barcode(code: str) -> Optional[Dict[str, Any]]:
+    """Resolve a scanned barcode to ``{id, barcode, name, price, gst_rate, stock}``.
+
+    Served from a per-process snapshot that this process invalidates on
+    commit; other processes' edits show up within ``BARCODE_SNAPSHOT_TTL``
+    seconds. Checkout still enforces stock, so a briefly stale count only
+    affects what the scanner displays. Misses fall back to the indexed column.
+    """
+
+    code = _normalize(code)
+    if not code:
+        return None
+
+    ttl = current_app.config.get("BARCODE_SNAPSHOT_TTL", 60)
+    with _lock:
+        if _by_barcode is None or time.monotonic() - _built_at > ttl:
+            _build_snapshot()
+        entry = _by_barcode.get(code)
+        generation = _generation
+    if entry is not None:
+        return dict(entry)
+
+    row = db.session.execute(select(*_COLUMNS).where(Item.barcode == code)).first()
+    if row is None:
+        return None
+    entry = _entry(row)
+    with _lock:
+        if generation == _generation and _by_barcode is not None:
+            _by_barcode[code] = entry
+            _barcode_by_id[entry["id"]] = code
+    return dict(entry)
+
+
+def mark_items_changed(item_ids: Iterable[int], session: Optional[Session] = None) -> None:
+    """Queue items to drop from the snapshot once the current transaction commits."""
+    session = session or db.session()
+    session.info.setdefault(_CHANGED_KEY, set()).update(item_ids)
+
+
+def invalidate(item_ids: Optional[Iterable[int]] = None) -> None:
+    global _by_barcode, _generation
+    with _lock:
+        _generation += 1
+        if item_ids is None or _by_barcode is None:
+            _by_barcode = None
+            _barcode_by_id.clear()
+            return
+        for item_id in item_ids:
+            code = _barcode_by_id.pop(item_id, None)
+            if code is not None:
+                _by_barcode.pop(code, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_item_changes(session: Session, flush_context) -> None:
+    changed = [obj.id for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, Item)]
+    if changed:
+        mark_items_changed(changed, session)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_item_changes(session: Session) -> None:
+    changed = session.info.pop(_CHANGED_KEY, None)
+    if changed:
+        # An edited barcode drops the entry under its old code; new codes
+        # are picked up by the miss path.
+        invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_item_changes(session: Session) -> None:
+    session.info.pop(_CHANGED_KEY, None)
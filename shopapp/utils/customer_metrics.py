@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, Mapping
+
+from sqlalchemy import case, delete, func, select
+
+from ..extensions import db
+from ..models import CustomerMetrics, Sale
+from .schema import dialect_insert
+
+
+def _upsert(rows: list, accumulate: bool) -> None:
+    table = CustomerMetrics.__table__
+    stmt = dialect_insert(db.engine, table)
+    new = stmt.excluded
+    if accumulate:
+        order_count = table.c.order_count + new.order_count
+        lifetime_value = table.c.lifetime_value + new.lifetime_value
+        updates = {
+            "order_count": order_count,
+            "lifetime_value": lifetime_value,
+            "average_basket": lifetime_value / order_count,
+            "first_purchase_at": case(
+                (table.c.first_purchase_at.is_(None), new.first_purchase_at),
+                (new.first_purchase_at < table.c.first_purchase_at, new.first_purchase_at),
+                else_=table.c.first_purchase_at,
+            ),
+            "last_purchase_at": case(
+                (table.c.last_purchase_at.is_(None), new.last_purchase_at),
+                (new.last_purchase_at > table.c.last_purchase_at, new.last_purchase_at),
+                else_=table.c.last_purchase_at,
+            ),
+        }
+    else:
+        updates = {
+            name: new[name]
+            for name in ("order_count", "lifetime_value", "average_basket", "first_purchase_at", "last_purchase_at")
+        }
+    updates["updated_at"] = new.updated_at
+    db.session.execute(stmt.on_conflict_do_update(index_elements=["customer_id"], set_=updates), rows)
+
+
+def record_customer_sales(sales: Iterable[Mapping[str, Any]]) -> None:
+    """Fold sales into ``customer_metrics`` inside the caller's transaction.
+
+    Each mapping carries ``customer_id``, ``net_total`` and ``date``; walk-in
+    sales without a customer are skipped.
+    """
+
+    totals: Dict[int, Dict[str, Any]] = {}
+    for sale in sales:
+        customer_id = sale.get("customer_id")
+        if not customer_id:
+            continue
+        when = sale.get("date") or datetime.utcnow()
+        entry = totals.setdefault(customer_id, {
+            "order_count": 0,
+            "lifetime_value": 0.0,
+            "first_purchase_at": when,
+            "last_purchase_at": when,
+        })
+        entry["order_count"] += 1
+        entry["lifetime_value"] += float(sale.get("net_total") or 0)
+        entry["first_purchase_at"] = min(entry["first_purchase_at"], when)
+        entry["last_purchase_at"] = max(entry["last_purchase_at"], when)
+    if not totals:
+        return
+
+    now = datetime.utcnow()
+    _upsert([
+        {
+            "customer_id": customer_id,
+            **entry,
+            "average_basket": entry["lifetime_value"] / entry["order_count"],
+            "updated_at": now,
+        }
+        for customer_id, entry in totals.items()
+    ], accumulate=True)
+
+
+def rebuild_customer_metrics() -> int:
+    """Recompute every customer's metrics from ``sales`` in the caller's transaction."""
+    rows = db.session.execute(
+        select(
+            Sale.customer_id,
+            func.count(Sale.id),
+            func.coalesce(func.sum(Sale.net_total), 0),
+            func.min(Sale.date),
+            func.max(Sale.date),
+        )
+        .where(Sale.customer_id.isnot(None))
+        .group_by(Sale.customer_id)
+    ).all()
+
+    now = datetime.utcnow()
+    values = [
+        {
+            "customer_id": customer_id,
+            "order_count": int(count),
+            "lifetime_value": float(total or 0),
+            "average_basket": float(total or 0) / int(count) if count else 0.0,
+            "first_purchase_at": first,
+            "last_purchase_at": last,
+            "updated_at": now,
+        }
+        for customer_id, count, total, first, last in rows
+    ]
+    db.session.execute(delete(CustomerMetrics))
+    if values:
+        _upsert(values, accumulate=False)
+    return len(values)
+
+
+def backfill_customer_metrics_if_empty() -> None:
+    """Build the table on first start after an upgrade, when customer sales already exist."""
+    if db.session.query(CustomerMetrics.customer_id).first() is not None:
+        return
+    if db.session.query(Sale.id).filter(Sale.customer_id.isnot(None)).first() is None:
+        return
+    rebuild_customer_metrics()
+    db.session.commit()
@@ -0,0 +1,326 @@
+"""Background exports served from an on-disk store.
+
+An export request becomes an ``ExportJob`` row; a scheduler worker writes
+the file under ``exports/`` and marks the job ready, and the download is
+served from disk with Range support so interrupted transfers resume. Jobs
+are fingerprinted by kind, parameters and a data-version stamp, so asking
+again for an export whose inputs have not changed returns the existing
+job instead of rebuilding it.
+
+While a job runs, its progress is kept in a small sidecar file next to the
+partial export rather than in the database: the export holds read cursors
+open, and on SQLite a concurrent progress commit would wait on them. The
+file doubles as a heartbeat: the scheduler keeps jobs in memory, so a job
+left queued or running by a restarted worker stops reporting, and after
+``STALE_AFTER`` it is marked failed instead of being reused.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..extensions import db, scheduler
+from ..models import (AuditLog, Credit, Customer, Expense, ExpenseCategory, ExportJob, Item, Sale,
+                      SalesDailyRollup)
+from .exports import AUDIT_LOG_HEADER, STREAM_BATCH_SIZE, _clamp_days, audit_log_rows, iter_csv, stream_ca_bundle
+from .localtime import local_today
+from .shop_config import get_shop_config
+
+EXPORT_KINDS = ("audit_log", "ca_bundle")
+ACTIVE_STATUSES = ("queued", "running", "ready")
+_MIMETYPES = {"audit_log": "text/csv", "ca_bundle": "application/zip"}
+_EXTENSIONS = {"audit_log": ".csv", "ca_bundle": ".zip"}
+STALE_AFTER = timedelta(minutes=10)
+
+
+def exports_dir() -> str:
+    path = os.path.join(os.getcwd(), 'exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def export_mimetype(job: ExportJob) -> str:
+    return _MIMETYPES.get(job.kind, "application/octet-stream")
+
+
+def normalize_params(kind: str, raw: Mapping[str, Any]) -> Dict[str, Any]:
+    """Validated parameters for ``kind``; raises ``ValueError`` for an unknown kind."""
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(EXPORT_KINDS)}.")
+    if kind == "ca_bundle":
+        try:
+            days = int(raw.get("days") or 30)
+        except (TypeError, ValueError):
+            days = 30
+        return {"days": _clamp_days(days)}
+    return {}
+
+
+def _data_version(kind: str) -> tuple:
+    """A stamp that changes whenever anything the export contains is written."""
+    probes = [select(func.max(AuditLog.id)), select(func.count(AuditLog.id))]
+    if kind == "ca_bundle":
+        outstanding = Credit.status.in_(["unpaid", "adjusted"])
+        probes += [
+            select(func.max(Sale.id)),
+            select(func.max(SalesDailyRollup.updated_at)),
+            select(func.max(Expense.id)),
+            select(func.count(Expense.id)),
+            select(func.max(Expense.updated_at)),
+            select(func.max(ExpenseCategory.updated_at)),
+            select(func.max(Credit.id)),
+            select(func.count(Credit.id)).where(outstanding),
+            select(func.sum(Credit.total)).where(outstanding),
+            select(func.max(Item.updated_at)),
+            select(func.count(Item.id)),
+            select(func.max(Customer.updated_at)),
+        ]
+    version = tuple(db.session.execute(select(*(probe.scalar_subquery() for probe in probes))).one())
+    if kind == "ca_bundle":
+        # The window and the Z-report follow the shop day; sale locks bump the config version.
+        version += (local_today(), get_shop_config().version)
+    return version
+
+
+def _fingerprint(kind: str, params: Mapping[str, Any]) -> str:
+    payload = json.dumps([kind, params, [str(value) for value in _data_version(kind)]], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def request_export(kind: str, params: Mapping[str, Any], requested_by: Optional[str] = None) -> ExportJob:
+    """Queue an export, or return the pending or finished job with the same fingerprint."""
+    params = normalize_params(kind, params)
+    fingerprint = _fingerprint(kind, params)
+    now = datetime.utcnow()
+    existing = (
+        ExportJob.query.filter(
+            ExportJob.fingerprint == fingerprint,
+            ExportJob.status.in_(ACTIVE_STATUSES),
+            ExportJob.expires_at > now,
+        )
+        .order_by(ExportJob.id.desc())
+        .first()
+    )
+    if existing is not None and _is_stale(existing, now):
+        _fail_stale(existing, now)
+        existing = None
+    if existing is not None and (existing.status != "ready" or os.path.exists(existing.path or "")):
+        return existing
+
+    retention = timedelta(hours=current_app.config.get("EXPORT_RETENTION_HOURS", 24))
+    job = ExportJob(
+        kind=kind,
+        params=json.dumps(params),
+        fingerprint=fingerprint,
+        status="queued",
+        requested_by=requested_by,
+        created_at=now,
+        expires_at=now + retention,
+    )
+    db.session.add(job)
+    db.session.commit()
+    queue_export(job.id)
+    return job
+
+
+def queue_export(job_id: int) -> None:
+    """Run the job on the scheduler, or inline when it is not running (CLI, tests)."""
+    if not scheduler.running:
+        run_export(job_id)
+        return
+    scheduler.add_job(
+        _run_export_job,
+        args=[current_app._get_current_object(), job_id],
+        id=f'export-{job_id}',
+        replace_existing=True,
+        misfire_grace_time=None,
+    )
+
+
+def _run_export_job(app, job_id: int) -> None:
+    with app.app_context():
+        try:
+            run_export(job_id)
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception('Could not record the outcome of export job %s', job_id)
+        finally:
+            db.session.remove()
+
+
+def _progress_path(job_id: int) -> str:
+    return os.path.join(exports_dir(), f'.export_{job_id}.progress')
+
+
+def _write_progress(job_id: int, done: int, total: int, rows: int) -> None:
+    path = _progress_path(job_id)
+    scratch = f'{path}.tmp'
+    percent = int(done * 100 / total) if total else 0
+    with open(scratch, 'w', encoding='utf-8') as handle:
+        json.dump({"progress": min(percent, 100), "rows": rows}, handle)
+    os.replace(scratch, path)
+
+
+def read_progress(job: ExportJob) -> Dict[str, int]:
+    if job.status == "ready":
+        return {"progress": 100, "rows": job.rows or 0}
+    try:
+        with open(_progress_path(job.id), encoding='utf-8') as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {"progress": 0, "rows": 0}
+
+
+def _export_path(job: ExportJob) -> str:
+    return os.path.join(exports_dir(), f'export_{job.id}_{job.fingerprint[:12]}{_EXTENSIONS.get(job.kind, "")}')
+
+
+def _last_heartbeat(job: ExportJob) -> Optional[datetime]:
+    try:
+        return datetime.utcfromtimestamp(os.path.getmtime(_progress_path(job.id)))
+    except OSError:
+        return job.started_at or job.created_at
+
+
+def _is_stale(job: ExportJob, now: datetime) -> bool:
+    if job.status not in ("queued", "running"):
+        return False
+    heartbeat = _last_heartbeat(job)
+    return heartbeat is None or heartbeat < now - STALE_AFTER
+
+
+def _fail_stale(job: ExportJob, now: datetime) -> None:
+    job.status = "failed"
+    job.error = "Interrupted: the export stopped reporting progress, probably after a restart."
+    job.finished_at = now
+    db.session.commit()
+    for leftover in (_progress_path(job.id), f'{_export_path(job)}.part'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+def fail_stale_exports() -> int:
+    """Mark jobs orphaned by a restart as failed; run at startup and with the hourly purge."""
+    now = datetime.utcnow()
+    stale = [job for job in ExportJob.query.filter(ExportJob.status.in_(("queued", "running"))) if _is_stale(job, now)]
+    for job in stale:
+        _fail_stale(job, now)
+    return len(stale)
+
+
+def _audit_log_chunks(job_id: int, written: Dict[str, int]) -> Iterator[bytes]:
+    total = db.session.query(func.count(AuditLog.id)).scalar() or 0
+
+    def counted() -> Iterator[list]:
+        for index, row in enumerate(audit_log_rows(), 1):
+            written["rows"] = index
+            if index % STREAM_BATCH_SIZE == 0:
+                _write_progress(job_id, index, total, index)
+            yield row
+
+    for chunk in iter_csv(AUDIT_LOG_HEADER, counted()):
+        yield chunk.encode("utf-8")
+
+
+def run_export(job_id: int) -> Optional[str]:
+    """Write the job's file to the export store and record the outcome; returns the path."""
+    job = db.session.get(ExportJob, job_id)
+    if job is None or job.status != "queued":
+        return None
+    job.status = "running"
+    job.started_at = datetime.utcnow()
+    job.error = None
+    db.session.commit()
+    _write_progress(job_id, 0, 0, 0)
+
+    params = json.loads(job.params or "{}")
+    written: Dict[str, int] = {"rows": 0}
+    scratch = None
+    try:
+        if job.kind == "ca_bundle":
+            def progress(done: int, total: int, rows: int) -> None:
+                written["rows"] = rows
+                _write_progress(job_id, done, total, rows)
+
+            chunks, filename = stream_ca_bundle(params.get("days", 30), progress)
+        else:
+            chunks = _audit_log_chunks(job_id, written)
+            filename = f"audit_log_{job.started_at:%Y%m%d_%H%M%S}.csv"
+
+        path = _export_path(job)
+        scratch = f'{path}.part'
+        with open(scratch, 'wb') as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+        os.replace(scratch, path)
+    except Exception as exc:
+        db.session.rollback()
+        current_app.logger.exception('Export job %s failed', job_id)
+        job = db.session.get(ExportJob, job_id)
+        job.status = "failed"
+        job.error = str(exc)[:500]
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return None
+    finally:
+        for leftover in (_progress_path(job_id), scratch):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+
+    job = db.session.get(ExportJob, job_id)
+    if job is None:
+        # Purged while it ran.
+        os.remove(path)
+        return None
+    job.status = "ready"
+    job.filename = filename
+    job.path = path
+    job.size = os.path.getsize(path)
+    job.rows = written["rows"]
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return path
+
+
+def export_job_payload(job: ExportJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "params": json.loads(job.params or "{}"),
+        "status": job.status,
+        **read_progress(job),
+        "filename": job.filename,
+        "size": job.size,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "expires_at": job.expires_at.isoformat() if job.expires_at else None,
+    }
+
+
+def purge_expired_exports() -> int:
+    """Delete expired jobs and their files from the export store.
+
+    Jobs still queued or running are left alone for another retention
+    period, in case a worker is writing them; orphaned ones are failed first.
+    """
+    fail_stale_exports()
+    now = datetime.utcnow()
+    retention = timedelta(hours=current_app.config.get("EXPORT_RETENTION_HOURS", 24))
+    expired = or_(
+        and_(ExportJob.expires_at <= now, ExportJob.status.notin_(("queued", "running"))),
+        ExportJob.expires_at <= now - retention,
+    )
+    for job in ExportJob.query.filter(expired).all():
+        if job.path and os.path.exists(job.path):
+            os.remove(job.path)
+    removed = db.session.execute(delete(ExportJob).where(expired)).rowcount
+    db.session.commit()
+    return removed
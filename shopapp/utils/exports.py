@@ -3,249 +3,403 @@ from __future__ import annotations
 import csv
 import io
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Iterable
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
 from zipfile import ZIP_DEFLATED, ZipFile
 
-from sqlalchemy.orm import joinedload
+from flask import Flask, Response, current_app, stream_with_context
+from sqlalchemy import Select, select
 
 from ..extensions import db
-from ..models import AuditLog, Credit, Expense, Item, Sale
-from ..reports.routes import build_summary
-from ..utils.pdfs import create_zreport_pdf
+from ..models import AuditLog, Credit, Customer, Expense, ExpenseCategory, Item, Sale
+from ..reports.zreport import zreport_pdf_bytes
+from .localtime import local_today
 
 
 ISO_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Rows fetched per round trip when streaming a query, and bytes buffered
+# before a chunk is sent.
+STREAM_BATCH_SIZE = 1000
+STREAM_CHUNK_BYTES = 64 * 1024
+# CA bundle sections are fetched concurrently, each on its own session; a
+# section may run this many chunks ahead of the ZIP writer before it waits.
+BUNDLE_WORKERS = 4
+BUNDLE_QUEUE_CHUNKS = 8
 
 
 def _clamp_days(raw: int) -> int:
     return max(7, min(raw, 365))
 
 
-def build_audit_log_csv(entries: Iterable[AuditLog]) -> str:
+def stream_rows(stmt: Select) -> Iterator[Any]:
+    """Iterate a Core select in server-side batches instead of loading every row."""
+    yield from db.session.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+
+def iter_csv(header: Sequence[object], rows: Iterable[Sequence[object]]) -> Iterator[str]:
+    """Encode ``rows`` as CSV text chunks; the header goes out on its own straight away."""
     buffer = io.StringIO()
     writer = csv.writer(buffer)
-    writer.writerow(
-        [
-            "timestamp_utc",
-            "user",
-            "action",
-            "resource_type",
-            "resource_id",
-            "ip_address",
-            "user_agent",
-            "details",
-            "before_state",
-            "after_state",
-        ]
-    )
-    for entry in entries:
-        writer.writerow(
-            [
-                entry.ts.strftime(ISO_FORMAT) if entry.ts else "",
-                entry.user or "system",
-                entry.action or "",
-                entry.resource_type or "",
-                entry.resource_id or "",
-                entry.ip_address or "",
-                entry.user_agent or "",
-                entry.details or "",
-                entry.before_state or "",
-                entry.after_state or "",
-            ]
+    writer.writerow(header)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def csv_response(header: Sequence[object], rows: Iterable[Sequence[object]], filename: str) -> Response:
+    """A streamed CSV download; ``rows`` is consumed lazily while the response is sent."""
+    response = Response(stream_with_context(iter_csv(header, rows)), mimetype="text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+AUDIT_LOG_HEADER = [
+    "timestamp_utc",
+    "user",
+    "action",
+    "resource_type",
+    "resource_id",
+    "ip_address",
+    "user_agent",
+    "details",
+    "before_state",
+    "after_state",
+]
+
+
+def _audit_log_row(entry: Any) -> list:
+    return [
+        entry.ts.strftime(ISO_FORMAT) if entry.ts else "",
+        entry.user or "system",
+        entry.action or "",
+        entry.resource_type or "",
+        entry.resource_id or "",
+        entry.ip_address or "",
+        entry.user_agent or "",
+        entry.details or "",
+        entry.before_state or "",
+        entry.after_state or "",
+    ]
+
+
+def build_audit_log_csv(entries: Iterable[AuditLog]) -> str:
+    return "".join(iter_csv(AUDIT_LOG_HEADER, (_audit_log_row(entry) for entry in entries)))
+
+
+def audit_log_rows(start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[list]:
+    """Audit log CSV rows from ``start`` up to ``end`` exclusive, oldest first, fetched in batches."""
+    stmt = (
+        select(
+            AuditLog.ts,
+            AuditLog.user,
+            AuditLog.action,
+            AuditLog.resource_type,
+            AuditLog.resource_id,
+            AuditLog.ip_address,
+            AuditLog.user_agent,
+            AuditLog.details,
+            AuditLog.before_state,
+            AuditLog.after_state,
         )
-    return buffer.getvalue()
+        .order_by(AuditLog.ts.asc())
+    )
+    if start is not None:
+        stmt = stmt.where(AuditLog.ts >= start)
+    if end is not None:
+        stmt = stmt.where(AuditLog.ts < end)
+    for entry in stream_rows(stmt):
+        yield _audit_log_row(entry)
+
 
+def _audit_rows(start: datetime, end: datetime) -> Iterator[list]:
+    return audit_log_rows(start, end)
 
-def _sales_csv(start: datetime, end: datetime) -> str:
-    query = (
-        Sale.query.options(joinedload(Sale.customer))
-        .filter(Sale.date >= start, Sale.date < end)
+
+def _sales_rows(start: datetime, end: datetime) -> Iterator[list]:
+    stmt = (
+        select(
+            Sale.id,
+            Sale.date,
+            Sale.invoice_number,
+            Sale.item,
+            Sale.quantity,
+            Sale.net_total,
+            Sale.tax,
+            Sale.discount,
+            Sale.payment_method,
+            Customer.name,
+            Customer.id,
+            Sale.locked,
+        )
+        .outerjoin(Customer, Customer.id == Sale.customer_id)
+        .where(Sale.date >= start, Sale.date < end)
         .order_by(Sale.date.asc(), Sale.id.asc())
     )
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(
-        [
-            "id",
-            "datetime_utc",
-            "invoice_number",
-            "item",
-            "quantity",
-            "amount_net",
-            "tax",
-            "discount",
-            "payment_method",
-            "customer_name",
-            "customer_id",
-            "locked",
+    for (sale_id, when, invoice_number, item, quantity, net_total, tax, discount,
+         payment_method, customer_name, customer_id, locked) in stream_rows(stmt):
+        yield [
+            sale_id,
+            when.strftime(ISO_FORMAT) if when else "",
+            invoice_number or "",
+            item,
+            quantity,
+            f"{net_total:.2f}",
+            f"{tax:.2f}",
+            f"{discount:.2f}",
+            payment_method or "cash",
+            customer_name or "",
+            customer_id or "",
+            "yes" if locked else "no",
         ]
-    )
-    for sale in query.all():
-        customer = getattr(sale, "customer", None)
-        writer.writerow(
-            [
-                sale.id,
-                sale.date.strftime(ISO_FORMAT) if sale.date else "",
-                sale.invoice_number or "",
-                sale.item,
-                sale.quantity,
-                f"{sale.net_total:.2f}",
-                f"{sale.tax:.2f}",
-                f"{sale.discount:.2f}",
-                sale.payment_method or "cash",
-                customer.name if customer else "",
-                customer.id if customer else "",
-                "yes" if sale.locked else "no",
-            ]
-        )
-    return buffer.getvalue()
 
 
-def _expenses_csv(start: datetime, end: datetime) -> str:
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(["id", "date", "category", "amount", "notes"])
-    rows = (
-        Expense.query.filter(Expense.date >= start.date(), Expense.date <= (end - timedelta(seconds=1)).date())
+def _expenses_rows(start: datetime, end: datetime) -> Iterator[list]:
+    stmt = (
+        select(Expense.id, Expense.date, Expense.category, ExpenseCategory.name, Expense.amount, Expense.notes)
+        .outerjoin(ExpenseCategory, ExpenseCategory.id == Expense.category_id)
+        .where(Expense.date >= start.date(), Expense.date <= (end - timedelta(seconds=1)).date())
         .order_by(Expense.date.asc(), Expense.id.asc())
-        .all()
     )
-    for expense in rows:
-        writer.writerow(
-            [
-                expense.id,
-                expense.date.isoformat() if expense.date else "",
-                expense.category or (expense.category_rel.name if expense.category_rel else ""),
-                f"{(expense.amount or 0):.2f}",
-                (expense.notes or "").replace("\n", " ").strip(),
-            ]
-        )
-    return buffer.getvalue()
+    for expense_id, day, category, category_name, amount, notes in stream_rows(stmt):
+        yield [
+            expense_id,
+            day.isoformat() if day else "",
+            category or category_name or "",
+            f"{(amount or 0):.2f}",
+            (notes or "").replace("\n", " ").strip(),
+        ]
 
 
-def _credits_csv() -> str:
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(["id", "customer_id", "customer_name", "item", "quantity", "total", "status", "date"])
-    rows = (
-        Credit.query.filter(Credit.status.in_(["unpaid", "adjusted"]))
+def _credits_rows(start: datetime, end: datetime) -> Iterator[list]:
+    stmt = (
+        select(
+            Credit.id,
+            Credit.customer_id,
+            Credit.customer_name,
+            Credit.item,
+            Credit.quantity,
+            Credit.total,
+            Credit.status,
+            Credit.date,
+        )
+        .where(Credit.status.in_(["unpaid", "adjusted"]))
         .order_by(Credit.date.desc(), Credit.id.desc())
-        .all()
     )
-    for credit in rows:
-        writer.writerow(
-            [
-                credit.id,
-                credit.customer_id or "",
-                credit.customer_name or "",
-                credit.item or "",
-                credit.quantity or "",
-                f"{(credit.total or 0):.2f}",
-                credit.status or "",
-                credit.date.strftime(ISO_FORMAT) if credit.date else "",
-            ]
-        )
-    return buffer.getvalue()
+    for credit_id, customer_id, customer_name, item, quantity, total, status, when in stream_rows(stmt):
+        yield [
+            credit_id,
+            customer_id or "",
+            customer_name or "",
+            item or "",
+            quantity or "",
+            f"{(total or 0):.2f}",
+            status or "",
+            when.strftime(ISO_FORMAT) if when else "",
+        ]
 
 
-def _inventory_csv() -> str:
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(["id", "name", "stock", "reorder_level", "price", "gst_rate", "barcode", "hsn"])
-    for item in Item.query.order_by(Item.name.asc()).all():
-        writer.writerow(
-            [
-                item.id,
-                item.name,
-                item.current_stock,
-                item.reorder_level,
-                f"{(item.price or 0):.2f}",
-                item.gst_rate or 0,
-                item.barcode or "",
-                item.hsn or "",
-            ]
-        )
-    return buffer.getvalue()
+def _inventory_rows(start: datetime, end: datetime) -> Iterator[list]:
+    stmt = select(
+        Item.id, Item.name, Item.current_stock, Item.reorder_level, Item.price, Item.gst_rate, Item.barcode, Item.hsn
+    ).order_by(Item.name.asc())
+    for item_id, name, stock, reorder_level, price, gst_rate, barcode, hsn in stream_rows(stmt):
+        yield [item_id, name, stock, reorder_level, f"{(price or 0):.2f}", gst_rate or 0, barcode or "", hsn or ""]
 
 
-def generate_ca_bundle(days: int = 30) -> tuple[bytes, str]:
-    window_days = _clamp_days(days)
-    end = datetime.utcnow().replace(microsecond=0)
-    start = end - timedelta(days=window_days)
+@dataclass(frozen=True)
+class _BundleSection:
+    key: str
+    path: str
+    header: Sequence[str]
+    rows: Callable[[datetime, datetime], Iterator[list]]
 
-    audit_rows = (
-        AuditLog.query.filter(AuditLog.ts >= start)
-        .order_by(AuditLog.ts.asc())
-        .all()
+
+def _bundle_sections(start: datetime, end: datetime) -> Tuple[_BundleSection, ...]:
+    return (
+        _BundleSection("audit_log", "logs/audit_log.csv", AUDIT_LOG_HEADER, _audit_rows),
+        _BundleSection(
+            "sales",
+            f"sales/sales_{start:%Y%m%d}_{end:%Y%m%d}.csv",
+            ["id", "datetime_utc", "invoice_number", "item", "quantity", "amount_net", "tax", "discount",
+             "payment_method", "customer_name", "customer_id", "locked"],
+            _sales_rows,
+        ),
+        _BundleSection(
+            "expenses",
+            f"expenses/expenses_{start:%Y%m%d}_{end:%Y%m%d}.csv",
+            ["id", "date", "category", "amount", "notes"],
+            _expenses_rows,
+        ),
+        _BundleSection(
+            "credits",
+            "credits/outstanding_credits.csv",
+            ["id", "customer_id", "customer_name", "item", "quantity", "total", "status", "date"],
+            _credits_rows,
+        ),
+        _BundleSection(
+            "inventory",
+            "inventory/items_snapshot.csv",
+            ["id", "name", "stock", "reorder_level", "price", "gst_rate", "barcode", "hsn"],
+            _inventory_rows,
+        ),
     )
 
-    audit_csv = build_audit_log_csv(audit_rows)
-    sales_csv = _sales_csv(start, end)
-    expenses_csv = _expenses_csv(start, end)
-    credits_csv = _credits_csv()
-    inventory_csv = _inventory_csv()
-
-    summary = build_summary(end.strftime("%Y-%m-%d"))
-    zreport_path = create_zreport_pdf(summary)
-    with open(zreport_path, "rb") as handle:
-        zreport_bytes = handle.read()
-    Path(zreport_path).unlink(missing_ok=True)
-
-    manifest = {
-        "generated_at": end.strftime(ISO_FORMAT),
-        "window_start": start.strftime(ISO_FORMAT),
-        "window_end": end.strftime(ISO_FORMAT),
-        "days_requested": days,
-        "days_included": window_days,
-        "entries": {
-            "audit_log": len(audit_rows),
-            "sales": SalesCountQuery.count(start, end),
-            "expenses": ExpensesCountQuery.count(start, end),
-            "credits": CreditsCountQuery.count(),
-            "inventory": Item.query.count(),
-        },
-    }
-
-    bundle = io.BytesIO()
-    with ZipFile(bundle, "w", ZIP_DEFLATED) as archive:
-        archive.writestr("logs/audit_log.csv", audit_csv.encode("utf-8"))
-        archive.writestr(f"sales/sales_{start:%Y%m%d}_{end:%Y%m%d}.csv", sales_csv.encode("utf-8"))
-        archive.writestr(f"expenses/expenses_{start:%Y%m%d}_{end:%Y%m%d}.csv", expenses_csv.encode("utf-8"))
-        archive.writestr("credits/outstanding_credits.csv", credits_csv.encode("utf-8"))
-        archive.writestr("inventory/items_snapshot.csv", inventory_csv.encode("utf-8"))
-        archive.writestr(f"reports/zreport_{summary['date']}.pdf", zreport_bytes)
-        archive.writestr("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
-
-    bundle.seek(0)
-    filename = f"evara_ca_bundle_{end:%Y%m%d_%H%M%S}.zip"
-    return bundle.getvalue(), filename
 
+class _BundleCancelled(Exception):
+    pass
 
-class SalesCountQuery:
-    @staticmethod
-    def count(start: datetime, end: datetime) -> int:
-        return (
-            db.session.query(Sale.id)
-            .filter(Sale.date >= start, Sale.date < end)
-            .count()
-        )
 
+_SECTION_DONE = object()
 
-class ExpensesCountQuery:
-    @staticmethod
-    def count(start: datetime, end: datetime) -> int:
-        return (
-            db.session.query(Expense.id)
-            .filter(Expense.date >= start.date(), Expense.date <= (end - timedelta(seconds=1)).date())
-            .count()
-        )
 
+def _hand_over(channel: queue.Queue, item: Any, cancel: threading.Event) -> None:
+    while not cancel.is_set():
+        try:
+            channel.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise _BundleCancelled()
 
-class CreditsCountQuery:
-    @staticmethod
-    def count() -> int:
-        return (
-            Credit.query.filter(Credit.status.in_(["unpaid", "adjusted"])).count()
-        )
+
+def _produce_section(app: Flask, section: _BundleSection, start: datetime, end: datetime,
+                     channel: queue.Queue, cancel: threading.Event) -> int:
+    """Stream one section's CSV into ``channel`` on a session of its own; returns its row count."""
+    with app.app_context():
+        count = 0
+
+        def counted() -> Iterator[list]:
+            nonlocal count
+            for row in section.rows(start, end):
+                count += 1
+                yield row
+
+        try:
+            for chunk in iter_csv(section.header, counted()):
+                _hand_over(channel, chunk.encode("utf-8"), cancel)
+            _hand_over(channel, _SECTION_DONE, cancel)
+        except _BundleCancelled:
+            pass
+        except Exception as exc:
+            try:
+                _hand_over(channel, exc, cancel)
+            except _BundleCancelled:
+                pass
+        finally:
+            db.session.remove()
+        return count
+
+
+def _render_zreport(app: Flask, day) -> Tuple[Dict[str, Any], bytes]:
+    with app.app_context():
+        try:
+            return zreport_pdf_bytes(day)
+        finally:
+            db.session.remove()
+
+
+class ZipSink:
+    """Write-only target for ``ZipFile`` that hands compressed bytes back to the caller."""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+# Called with (steps done, total steps, rows written so far).
+ProgressCallback = Callable[[int, int, int], None]
+
+
+def _iter_ca_bundle(app: Flask, days: int, window_days: int, start: datetime, end: datetime,
+                    progress: Optional[ProgressCallback] = None) -> Iterator[bytes]:
+    sections = _bundle_sections(start, end)
+    steps = len(sections) + 1
+    cancel = threading.Event()
+    sink = ZipSink()
+    counts: Dict[str, int] = {}
+    executor = ThreadPoolExecutor(max_workers=BUNDLE_WORKERS, thread_name_prefix="ca-bundle")
+    try:
+        channels = [queue.Queue(maxsize=BUNDLE_QUEUE_CHUNKS) for _ in sections]
+        producers = [
+            executor.submit(_produce_section, app, section, start, end, channel, cancel)
+            for section, channel in zip(sections, channels)
+        ]
+        zreport = executor.submit(_render_zreport, app, local_today())
+
+        with ZipFile(sink, "w", ZIP_DEFLATED) as archive:
+            # Entries are written one at a time, in order; later sections keep
+            # fetching into their queues meanwhile.
+            for section, channel, producer in zip(sections, channels, producers):
+                with archive.open(section.path, "w") as entry:
+                    while True:
+                        chunk = channel.get()
+                        if chunk is _SECTION_DONE:
+                            break
+                        if isinstance(chunk, Exception):
+                            raise chunk
+                        entry.write(chunk)
+                        if len(sink) >= STREAM_CHUNK_BYTES:
+                            yield sink.drain()
+                counts[section.key] = producer.result()
+                if progress is not None:
+                    progress(len(counts), steps, sum(counts.values()))
+
+            summary, zreport_bytes = zreport.result()
+            archive.writestr(f"reports/zreport_{summary['date']}.pdf", zreport_bytes)
+            manifest = {
+                "generated_at": end.strftime(ISO_FORMAT),
+                "window_start": start.strftime(ISO_FORMAT),
+                "window_end": end.strftime(ISO_FORMAT),
+                "days_requested": days,
+                "days_included": window_days,
+                "entries": counts,
+            }
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+        yield sink.drain()
+        if progress is not None:
+            progress(steps, steps, sum(counts.values()))
+    finally:
+        cancel.set()
+        executor.shutdown(wait=True)
+
+
+def stream_ca_bundle(days: int = 30, progress: Optional[ProgressCallback] = None) -> tuple[Iterator[bytes], str]:
+    """The CA bundle ZIP as a byte stream, and its download name.
+
+    Each CSV section is queried in batches on its own worker thread and
+    session while the ZIP is written, so rows go straight from the cursor
+    into the compressed entry; the manifest counts come from those passes.
+    """
+
+    window_days = _clamp_days(days)
+    end = datetime.utcnow().replace(microsecond=0)
+    start = end - timedelta(days=window_days)
+    filename = f"evara_ca_bundle_{end:%Y%m%d_%H%M%S}.zip"
+    app = current_app._get_current_object()
+    return _iter_ca_bundle(app, days, window_days, start, end, progress), filename
@@ -0,0 +1,173 @@
+"""Nightly per-item demand forecasts.
+
+For every item this derives, from the sale lines of the last
+``FORECAST_WINDOW_DAYS`` closed days, the average daily velocity, an
+exponentially smoothed daily demand and the days of cover left at that
+demand, and stores them in ``item_forecasts``. The reorder planner and the
+analytics recommendations read these rows instead of scanning sales.
+
+The smoothing is computed in closed form — each day's units weighted by
+``alpha * (1 - alpha) ** age``, seeded with the window average — so all
+items are forecast at once with one weighted ``bincount`` when NumPy is
+installed, and with plain loops otherwise.
+"""
+from __future__ import annotations
+
+import math
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Mapping, Optional
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+
+from ..extensions import db
+from ..models import Item, ItemForecast, Sale, SaleItem
+from .localtime import local_today
+from .schema import dialect_insert
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+def _settings() -> Dict[str, Any]:
+    config = current_app.config
+    return {
+        "window": max(int(config.get("FORECAST_WINDOW_DAYS", 56)), 1),
+        "alpha": min(max(float(config.get("FORECAST_SMOOTHING", 0.3)), 0.01), 1.0),
+        "lead_days": int(config.get("FORECAST_LEAD_DAYS", 7)),
+        "cover_days": int(config.get("FORECAST_COVER_DAYS", 21)),
+    }
+
+
+def _daily_units(start: date, end: date) -> List[tuple]:
+    """``(lowered item name, local day, units, last sale)`` per item and day in ``start``..``end`` exclusive."""
+    label = func.lower(func.coalesce(SaleItem.description, ''))
+    return db.session.execute(
+        select(label, Sale.local_date, func.coalesce(func.sum(SaleItem.qty), 0), func.max(Sale.date))
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .where(Sale.local_date >= start, Sale.local_date < end)
+        .group_by(label, Sale.local_date)
+    ).all()
+
+
+def _smooth(codes: List[int], ages: List[int], units: List[float], size: int, window: int, alpha: float):
+    """Return ``(units_sold, smoothed_demand)`` per item code."""
+    weights = [alpha * (1 - alpha) ** age for age in range(window)]
+    decay = (1 - alpha) ** window
+    if np is not None:
+        codes_arr = np.asarray(codes, dtype=np.int64)
+        units_arr = np.asarray(units, dtype=np.float64)
+        weights_arr = np.asarray(weights, dtype=np.float64)[np.asarray(ages, dtype=np.int64)]
+        totals = np.bincount(codes_arr, weights=units_arr, minlength=size)
+        weighted = np.bincount(codes_arr, weights=units_arr * weights_arr, minlength=size)
+        demand = weighted + decay * totals / window
+        return totals.tolist(), demand.tolist()
+
+    totals = [0.0] * size
+    weighted = [0.0] * size
+    for code, age, quantity in zip(codes, ages, units):
+        totals[code] += quantity
+        weighted[code] += quantity * weights[age]
+    return totals, [weighted[index] + decay * totals[index] / window for index in range(size)]
+
+
+def reorder_plan(stock: int, reorder_level: Optional[int], daily_demand: float,
+                 settings: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """Whether to reorder at ``stock`` and how much, given the forecast demand.
+
+    An item is due when it is at its reorder level or would run out within
+    the supplier lead time. The suggestion restores ``FORECAST_COVER_DAYS``
+    of demand and never falls below the old rule of twice the reorder level.
+    """
+
+    settings = settings or _settings()
+    reorder_level = reorder_level if reorder_level is not None else 5
+    stock = stock or 0
+    cover = stock / daily_demand if daily_demand > 0 else None
+    due = stock <= reorder_level or (cover is not None and cover < settings["lead_days"])
+    recommended = max(math.ceil(daily_demand * settings["cover_days"]) - stock, 0)
+    if stock <= reorder_level:
+        recommended = max(recommended, reorder_level * 2 - stock, reorder_level)
+    return {
+        "due": due,
+        "recommended": recommended if due else 0,
+        "days_of_cover": round(cover, 1) if cover is not None else None,
+    }
+
+
+def compute_item_forecasts(as_of: Optional[date] = None) -> int:
+    """Replace ``item_forecasts`` from sales before ``as_of`` (default: today), in the caller's transaction."""
+    settings = _settings()
+    window, alpha = settings["window"], settings["alpha"]
+    as_of = as_of or local_today()
+    start = as_of - timedelta(days=window)
+
+    items = Item.query.order_by(Item.id.asc()).all()
+    code_by_name = {item.name.lower(): index for index, item in enumerate(items)}
+    codes: List[int] = []
+    ages: List[int] = []
+    units: List[float] = []
+    last_sale: Dict[int, datetime] = {}
+    for name, day, quantity, latest in _daily_units(start, as_of):
+        # SQL lower() only folds ASCII, so fold again to match item names.
+        code = code_by_name.get((name or '').lower())
+        if code is None or day is None:
+            continue
+        codes.append(code)
+        ages.append((as_of - day).days - 1)
+        units.append(float(quantity or 0))
+        if latest is not None and (code not in last_sale or latest > last_sale[code]):
+            last_sale[code] = latest
+
+    totals, demand = _smooth(codes, ages, units, len(items), window, alpha)
+    now = datetime.utcnow()
+    rows = []
+    for index, item in enumerate(items):
+        plan = reorder_plan(item.current_stock, item.reorder_level, demand[index], settings)
+        rows.append({
+            "item_id": item.id,
+            "units_sold": int(round(totals[index])),
+            "velocity": totals[index] / window,
+            "daily_demand": demand[index],
+            "days_of_cover": plan["days_of_cover"],
+            "recommended_qty": plan["recommended"],
+            "last_sale_at": last_sale.get(index),
+            "computed_at": now,
+        })
+
+    # Every worker recomputes at start-up and at 00:30, so rows are upserted
+    # on item_id rather than cleared and re-inserted.
+    db.session.execute(delete(ItemForecast).where(ItemForecast.item_id.not_in(select(Item.id))))
+    if rows:
+        stmt = dialect_insert(db.engine, ItemForecast.__table__)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["item_id"],
+                set_={name: stmt.excluded[name] for name in rows[0] if name != "item_id"},
+            ),
+            rows,
+        )
+    return len(rows)
+
+
+def refresh_item_forecasts() -> None:
+    """Scheduled nightly; recomputes and commits every forecast."""
+    written = compute_item_forecasts()
+    db.session.commit()
+    current_app.logger.info("Refreshed demand forecasts for %s item(s).", written)
+
+
+def load_forecasts() -> Dict[int, ItemForecast]:
+    return {forecast.item_id: forecast for forecast in ItemForecast.query.all()}
+
+
+def backfill_forecasts_if_empty() -> None:
+    """Compute forecasts on first start after an upgrade, so the planner has data before the nightly run."""
+    if db.session.query(ItemForecast.item_id).first() is not None:
+        return
+    if db.session.query(Item.id).first() is None:
+        return
+    compute_item_forecasts()
+    db.session.commit()
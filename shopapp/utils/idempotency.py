@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Callable, Optional
+
+from flask import Response, current_app, g, jsonify, make_response, request, session
+from markupsafe import Markup
+from sqlalchemy import delete
+
+from ..extensions import db
+from ..models import IdempotencyKey
+from .schema import dialect_insert
+
+HEADER = "Idempotency-Key"
+# HTML forms cannot set headers, so they send the key as a hidden field.
+FORM_FIELD = "idempotency_key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+_STORED_HEADERS = ("Content-Type", "Location")
+
+
+def idempotency_field() -> Markup:
+    """A hidden input carrying a fresh key; render it inside forms that post to idempotent views."""
+    return Markup(f'<input type="hidden" name="{FORM_FIELD}" value="{uuid.uuid4().hex}">')
+
+
+def _request_key() -> str:
+    key = request.headers.get(HEADER)
+    if not key and request.mimetype in ("application/x-www-form-urlencoded", "multipart/form-data"):
+        key = request.form.get(FORM_FIELD)
+    return (key or "").strip()
+
+
+def _scope() -> str:
+    api_user = g.get("api_user")
+    actor = f"api:{api_user.id}" if api_user is not None else f"web:{session.get('user') or ''}"
+    return f"{request.endpoint}:{actor}"
+
+
+def _request_hash() -> str:
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.full_path.encode())
+    digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _claim(scope: str, key: str, request_hash: str) -> Optional[IdempotencyKey]:
+    """Reserve ``key`` for this request, or return the row that already holds it."""
+
+    now = datetime.utcnow()
+    ttl = timedelta(hours=current_app.config.get("IDEMPOTENCY_TTL_HOURS", 24))
+    table = IdempotencyKey.__table__
+    db.session.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.expires_at <= now)
+    )
+    claimed = db.session.execute(
+        dialect_insert(db.engine, table)
+        .values(scope=scope, key=key, request_hash=request_hash, status="in_progress",
+                created_at=now, expires_at=now + ttl)
+        .on_conflict_do_nothing(index_elements=["scope", "key"])
+    ).rowcount
+    # Commit straight away so a concurrent retry sees the claim.
+    db.session.commit()
+    if claimed:
+        return None
+    return IdempotencyKey.query.filter_by(scope=scope, key=key).first()
+
+
+def _release(scope: str, key: str) -> None:
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key))
+    db.session.commit()
+
+
+def _replay(row: IdempotencyKey) -> Response:
+    response = Response(row.response_body or b"", status=row.response_status or 200)
+    for name, value in json.loads(row.response_headers or "{}").items():
+        response.headers[name] = value
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+def idempotent(fn: Callable) -> Callable:
+    """Replay the stored response when a request repeats its ``Idempotency-Key``.
+
+    Requests without the header (or, from HTML forms, the ``idempotency_key``
+    field) run as before. The first request with a key
+    claims it and stores its response (anything below 500) for
+    ``IDEMPOTENCY_TTL_HOURS``; retries within that window receive the
+    original status, headers and body without the view running again.
+    Apply it beneath the auth decorator so keys are scoped per user.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = _request_key()
+        if not key:
+            return fn(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."}), 400
+
+        scope = _scope()
+        request_hash = _request_hash()
+        existing = _claim(scope, key, request_hash)
+        if existing is not None:
+            if existing.request_hash != request_hash:
+                return jsonify({"error": f"{HEADER} was already used for a different request."}), 422
+            if existing.status != "completed":
+                response = jsonify({"error": "A request with this Idempotency-Key is still in progress."})
+                response.status_code = 409
+                response.headers["Retry-After"] = "1"
+                return response
+            return _replay(existing)
+
+        try:
+            response = make_response(fn(*args, **kwargs))
+        except Exception:
+            _release(scope, key)
+            raise
+
+        if response.status_code >= 500 or response.is_streamed:
+            _release(scope, key)
+            return response
+
+        headers = {name: response.headers[name] for name in _STORED_HEADERS if name in response.headers}
+        IdempotencyKey.query.filter_by(scope=scope, key=key).update(
+            {
+                "status": "completed",
+                "response_status": response.status_code,
+                "response_headers": json.dumps(headers),
+                "response_body": response.get_data(),
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys() -> int:
+    """Delete stored responses whose TTL has passed."""
+    removed = db.session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return removed
@@ -0,0 +1,186 @@
+"""Bulk invoice downloads.
+
+Streams every invoice for a span of shop days as one ZIP. PDFs already in
+the invoice store are copied straight in; the rest are drawn on a process
+pool, and each is written to the archive and the store as soon as it
+finishes. Reportlab is pure Python, so threads would take turns on one core.
+
+The pool is started on the first bulk download and shared by later ones in
+the same web worker; by default each web worker gets an equal share of the
+cores (``WEB_CONCURRENCY``). Workers are spawned rather than forked, because
+the web process runs scheduler threads that a forked child could inherit
+mid-lock. Spawned workers re-import the entry script as ``__mp_main__``, so
+a script that builds the app must not do so under that name.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, Optional, Tuple
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+
+from flask import current_app
+from sqlalchemy.orm import joinedload, selectinload
+from werkzeug.utils import secure_filename
+
+from ..models import Sale
+from .exports import STREAM_CHUNK_BYTES, ZipSink
+from .pdfs import invoice_render_data, invoice_store_key, render_invoice_bytes, store_invoice, stored_invoice
+from .shop_config import get_shop_config
+
+logger = logging.getLogger(__name__)
+
+# Sales loaded per query while walking the range.
+INVOICE_ZIP_BATCH = 200
+
+_pool_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def render_workers() -> int:
+    """Render processes for this web worker.
+
+    Each web worker keeps its own pool, so the default splits the cores
+    between them rather than giving every worker one process per core.
+    """
+    configured = int(current_app.config.get('INVOICE_RENDER_WORKERS', 0) or 0)
+    if configured > 0:
+        return configured
+    web_workers = max(int(current_app.config.get('WEB_CONCURRENCY', 1) or 1), 1)
+    return max((os.cpu_count() or 1) // web_workers, 1)
+
+
+def _render_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """The shared render pool, or ``None`` where processes cannot be started."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            try:
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            except (OSError, NotImplementedError, ValueError):
+                logger.warning('Could not start the invoice render pool; rendering inline.', exc_info=True)
+                _pool = None
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _sale_batches(start: date, end: date) -> Iterator[list]:
+    """Sales on shop days ``start``..``end`` exclusive, by id, in batches."""
+    last_id = 0
+    while True:
+        batch = (
+            Sale.query.options(selectinload(Sale.line_items), joinedload(Sale.customer))
+            .filter(Sale.local_date >= start, Sale.local_date < end, Sale.id > last_id)
+            .order_by(Sale.id.asc())
+            .limit(INVOICE_ZIP_BATCH)
+            .all()
+        )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+
+def _entry(sale: Sale) -> ZipInfo:
+    number = sale.invoice_number or f"{sale.id:05d}"
+    info = ZipInfo(secure_filename(f"invoice_{number}.pdf") or f"invoice_{sale.id}.pdf", sale.date.timetuple()[:6])
+    # Reportlab already compresses the page streams.
+    info.compress_type = ZIP_STORED
+    return info
+
+
+def _iter_invoice_zip(start: date, end: date) -> Iterator[bytes]:
+    shop = get_shop_config()
+    workers = render_workers()
+    pool = _render_pool(workers)
+    sink = ZipSink()
+    pending: Dict[Future, Tuple[str, ZipInfo, Dict[str, Any]]] = {}
+    written = set()
+
+    def add(info: ZipInfo, data: bytes) -> None:
+        if info.filename in written:
+            stem, _, extension = info.filename.rpartition('.')
+            info.filename = f"{stem}_{len(written)}.{extension}"
+        written.add(info.filename)
+        archive.writestr(info, data)
+
+    def collect(block: bool) -> None:
+        nonlocal pool
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            key, info, data = pending.pop(future)
+            try:
+                pdf_bytes = future.result()
+            except BrokenProcessPool:
+                # A worker died; finish this download in the request thread.
+                logger.warning('Invoice render pool broke; rendering the rest inline.')
+                if pool is not None:
+                    _discard_pool(pool)
+                    pool = None
+                pdf_bytes = render_invoice_bytes(data)
+            store_invoice(key, pdf_bytes)
+            add(info, pdf_bytes)
+
+    try:
+        with ZipFile(sink, 'w') as archive:
+            for batch in _sale_batches(start, end):
+                for sale in batch:
+                    key = invoice_store_key(sale, sale.customer, shop=shop)
+                    path = stored_invoice(key)
+                    if path is not None:
+                        with open(path, 'rb') as handle:
+                            add(_entry(sale), handle.read())
+                    else:
+                        data = invoice_render_data(sale, sale.customer, shop)
+                        future = None
+                        if pool is not None:
+                            try:
+                                future = pool.submit(render_invoice_bytes, data)
+                            except (BrokenProcessPool, RuntimeError):
+                                _discard_pool(pool)
+                                pool = None
+                        if future is None:
+                            pdf_bytes = render_invoice_bytes(data)
+                            store_invoice(key, pdf_bytes)
+                            add(_entry(sale), pdf_bytes)
+                        else:
+                            pending[future] = (key, _entry(sale), data)
+
+                    # Keep a couple of renders queued per worker, and write
+                    # whatever has finished in the meantime.
+                    if pending:
+                        collect(block=len(pending) >= workers * 2)
+                    if len(sink) >= STREAM_CHUNK_BYTES:
+                        yield sink.drain()
+
+            while pending:
+                collect(block=True)
+                if len(sink) >= STREAM_CHUNK_BYTES:
+                    yield sink.drain()
+        yield sink.drain()
+    finally:
+        # A closed download leaves nothing queued on the shared pool.
+        for future in pending:
+            future.cancel()
+
+
+def stream_invoice_zip(start: date, end: date) -> tuple[Iterator[bytes], str]:
+    """Every invoice for shop days ``start``..``end`` inclusive as a ZIP byte stream, and its download name."""
+    filename = f"invoices_{start:%Y%m%d}_{end:%Y%m%d}.zip"
+    return _iter_invoice_zip(start, end + timedelta(days=1)), filename
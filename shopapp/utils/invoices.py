@@ -1,42 +1,176 @@
 from __future__ import annotations
 
-from datetime import datetime
+import threading
+from collections import defaultdict, deque
+from datetime import date, datetime
+from typing import Deque, Dict, List, Optional, Tuple
 
-from sqlalchemy import func
+from flask import current_app
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import Session
 
 from ..extensions import db
-from ..models import Sale, Setting, ShopProfile
+from ..models import InvoiceNumberGap, InvoiceSequence, Sale
+from .localtime import local_today
+from .schema import dialect_insert
+from .shop_config import get_shop_config
 
-COUNTER_KEY = "invoice_counter"
+# Committed blocks this process may hand out, keyed by series ("PREFIX-YYYYMMDD").
+_pool: Dict[str, Deque[List[int]]] = defaultdict(deque)
+_pool_lock = threading.Lock()
 
+_PENDING_KEY = "invoice_blocks_pending"
+_DRAWN_KEY = "invoice_numbers_drawn"
 
-def _get_prefix() -> str:
-    profile = ShopProfile.query.get(1)
-    return (profile.invoice_prefix or "INV") if profile else "INV"
 
+def _get_prefix() -> str:
+    return get_shop_config().invoice_prefix
 
-def next_invoice_number() -> str:
-    """Generate sequential invoice numbers (PREFIX-YYYYMMDD-#####)."""
 
+def _series_prefix(location_id: Optional[int]) -> str:
     prefix = _get_prefix()
-    today = datetime.utcnow().strftime("%Y%m%d")
+    if location_id:
+        location = get_shop_config().location(location_id)
+        if location and not location.is_default:
+            return f"{prefix}L{location.id}"
+    return prefix
+
+
+def _existing_high_water(series: str) -> int:
+    """Highest number already issued for a series, e.g. by the old global counter."""
+    latest = (
+        db.session.query(func.max(Sale.invoice_number))
+        .filter(Sale.invoice_number.like(f"{series}-%"))
+        .scalar()
+    )
+    if not latest:
+        return 0
+    try:
+        return int(latest.rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _reserve_block(series: str, size: int) -> List[int]:
+    """Move the series high-water mark forward by ``size`` inside the current transaction."""
+    stmt = (
+        update(InvoiceSequence)
+        .where(InvoiceSequence.series == series)
+        .values(high_water=InvoiceSequence.high_water + size, updated_at=datetime.utcnow())
+        .returning(InvoiceSequence.high_water)
+        .execution_options(synchronize_session=False)
+    )
+    high_water = db.session.execute(stmt).scalar()
+    if high_water is None:
+        seed = (
+            dialect_insert(db.engine, InvoiceSequence.__table__)
+            .values(series=series, high_water=_existing_high_water(series), updated_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["series"])
+        )
+        db.session.execute(seed)
+        high_water = db.session.execute(stmt).scalar()
+    return [high_water - size + 1, high_water]
+
+
+def _retire_stale_series(today: str) -> List[Tuple[str, int, int]]:
+    """Drop blocks for previous days from the pool and return their unused ranges."""
+    stale: List[Tuple[str, int, int]] = []
+    for series in [key for key in _pool if not key.endswith(today)]:
+        for start, end in _pool.pop(series):
+            if start <= end:
+                stale.append((series, start, end))
+    return stale
+
+
+def next_invoice_number(location_id: Optional[int] = None, day: Optional[date] = None) -> str:
+    """Generate invoice numbers (PREFIX-YYYYMMDD-#####) from per-day, per-location series.
+
+    Numbers come from a block reserved by this process, so the shared
+    ``invoice_sequences`` row is only touched once per block instead of once
+    per sale. A block becomes shareable with other threads only after the
+    transaction that reserved it commits.
+
+    ``day`` numbers a sale dated another shop-local day, such as an imported
+    one, from that day's series. Those numbers are reserved one at a time in
+    the caller's transaction and never pooled.
+    """
+
+    # The series is the shop-local day, like every other day boundary.
+    today = local_today()
+    day = day or today
+    series = f"{_series_prefix(location_id)}-{day:%Y%m%d}"
+    if day != today:
+        number = _reserve_block(series, 1)[0]
+        return f"{series}-{number:05d}"
+    session = db.session()
+
+    with _pool_lock:
+        stale = _retire_stale_series(series[-8:])
+        blocks = _pool.get(series)
+        while blocks and blocks[0][0] > blocks[0][1]:
+            blocks.popleft()
+        number = None
+        if blocks:
+            number = blocks[0][0]
+            blocks[0][0] += 1
+
+    for stale_series, start, end in stale:
+        db.session.add(InvoiceNumberGap(
+            series=stale_series,
+            start_number=start,
+            end_number=end,
+            reason="day_closed",
+        ))
+
+    if number is not None:
+        session.info.setdefault(_DRAWN_KEY, []).append((series, number))
+    else:
+        pending = session.info.setdefault(_PENDING_KEY, {})
+        block = pending.get(series)
+        if not block or block[0] > block[1]:
+            block = pending[series] = _reserve_block(series, current_app.config.get("INVOICE_BLOCK_SIZE", 20))
+        number = block[0]
+        block[0] += 1
+
+    return f"{series}-{number:05d}"
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_reserved_blocks(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_DRAWN_KEY, None)
+    if not pending:
+        return
+    with _pool_lock:
+        for series, block in pending.items():
+            if block[0] <= block[1]:
+                _pool[series].append(block)
 
-    counter_setting = Setting.query.filter_by(key=COUNTER_KEY).with_for_update().first()
-    if not counter_setting:
-        counter_setting = Setting(key=COUNTER_KEY, value="0")
-        db.session.add(counter_setting)
-        db.session.flush()
 
-    counter = int(counter_setting.value or "0") + 1
-    counter_setting.value = str(counter)
+@event.listens_for(Session, "after_transaction_end")
+def _discard_uncommitted_numbers(session: Session, transaction) -> None:
+    if transaction.parent is not None:
+        return
+    # Blocks reserved by a rolled-back transaction were never persisted, so
+    # they are simply forgotten. Numbers taken from committed blocks go back
+    # to the pool to be reused instead of leaving a gap.
+    session.info.pop(_PENDING_KEY, None)
+    drawn = session.info.pop(_DRAWN_KEY, None)
+    if not drawn:
+        return
+    with _pool_lock:
+        for series, number in drawn:
+            _pool[series].appendleft([number, number])
 
-    identifier = f"{prefix}-{today}-{counter:05d}"
 
-    # Ensure uniqueness in case counter resets or migrations altered values.
-    exists = db.session.query(func.count(Sale.id)).filter_by(invoice_number=identifier).scalar()
-    if exists:
-        counter += 1
-        counter_setting.value = str(counter)
-        identifier = f"{prefix}-{today}-{counter:05d}"
+def release_invoice_blocks(reason: str = "shutdown") -> int:
+    """Record every unused number this process still holds as an audit gap."""
+    with _pool_lock:
+        held = [(series, start, end) for series, blocks in _pool.items() for start, end in blocks if start <= end]
+        _pool.clear()
 
-    return identifier
+    for series, start, end in held:
+        db.session.add(InvoiceNumberGap(series=series, start_number=start, end_number=end, reason=reason))
+    if held:
+        db.session.commit()
+    return len(held)
@@ -0,0 +1,118 @@
+"""Shop-local calendar days.
+
+Timestamps are stored in UTC; ``Sale.local_date`` and ``Sale.local_hour``
+record the day and hour in the shop's timezone (``ShopProfile.timezone``)
+at write time, so reports group by an indexed column and a sale at 23:30
+IST lands on the IST day rather than the UTC one.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Any, Dict, MutableMapping, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from flask import current_app
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import attributes
+
+from ..extensions import db
+from ..models import Sale
+from .shop_config import get_shop_config
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+@lru_cache(maxsize=16)
+def _zone(key: str) -> tzinfo:
+    try:
+        return ZoneInfo(key)
+    except (ZoneInfoNotFoundError, ValueError):
+        current_app.logger.warning("Unknown shop timezone %r; using UTC for local days.", key)
+        return timezone.utc
+
+
+def shop_zone() -> tzinfo:
+    return _zone(get_shop_config().timezone or "Asia/Kolkata")
+
+
+def to_local(moment: datetime, zone: Optional[tzinfo] = None) -> datetime:
+    """A naive UTC timestamp as naive shop-local time."""
+    zone = zone or shop_zone()
+    return moment.replace(tzinfo=timezone.utc).astimezone(zone).replace(tzinfo=None)
+
+
+def local_stamp(moment: datetime, zone: Optional[tzinfo] = None) -> Tuple[date, int]:
+    local = to_local(moment, zone)
+    return local.date(), local.hour
+
+
+def local_today() -> date:
+    return to_local(datetime.utcnow()).date()
+
+
+def local_day_bounds(day: date, zone: Optional[tzinfo] = None) -> Tuple[datetime, datetime]:
+    """Naive UTC ``[start, end)`` of the shop-local calendar ``day``."""
+    zone = zone or shop_zone()
+
+    def _utc(value: date) -> datetime:
+        return datetime.combine(value, time.min, tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+
+    return _utc(day), _utc(day + timedelta(days=1))
+
+
+def stamp_local(values: MutableMapping[str, Any], zone: Optional[tzinfo] = None) -> MutableMapping[str, Any]:
+    """Fill ``local_date``/``local_hour`` in a dict of ``Sale`` column values from its ``date``."""
+    values["local_date"], values["local_hour"] = local_stamp(values.get("date") or datetime.utcnow(), zone)
+    return values
+
+
+@event.listens_for(Sale, "before_insert")
+def _stamp_new_sale(mapper, connection, target: Sale) -> None:
+    if target.date is None:
+        target.date = datetime.utcnow()
+    if target.local_date is None:
+        target.local_date, target.local_hour = local_stamp(target.date)
+
+
+@event.listens_for(Sale, "before_update")
+def _restamp_moved_sale(mapper, connection, target: Sale) -> None:
+    if target.date is not None and attributes.get_history(target, "date").has_changes():
+        target.local_date, target.local_hour = local_stamp(target.date)
+
+
+def backfill_local_dates(restamp: bool = False) -> int:
+    """Stamp local day and hour on sales missing them, or on every sale with ``restamp``.
+
+    Commits per batch so a large table does not hold one long write lock.
+    Returns the number of sales updated. Run with ``restamp`` after the shop
+    timezone changes, then rebuild the rollups.
+    """
+
+    zone = shop_zone()
+    stmt = update(Sale).execution_options(synchronize_session=False)
+    updated = 0
+    last_id = 0
+    while True:
+        query = select(Sale.id, Sale.date).where(Sale.id > last_id).order_by(Sale.id).limit(BACKFILL_BATCH_SIZE)
+        if not restamp:
+            query = query.where(Sale.local_date.is_(None))
+        rows = db.session.execute(query).all()
+        if not rows:
+            break
+        values: list[Dict[str, Any]] = []
+        for sale_id, moment in rows:
+            local_date, local_hour = local_stamp(moment, zone) if moment else (None, None)
+            values.append({"id": sale_id, "local_date": local_date, "local_hour": local_hour})
+        db.session.execute(stmt, values)
+        db.session.commit()
+        updated += len(values)
+        last_id = rows[-1][0]
+    return updated
+
+
+def backfill_local_dates_if_needed() -> int:
+    """Stamp sales written before the local-day columns existed, on first start after an upgrade."""
+    if db.session.query(Sale.id).filter(Sale.local_date.is_(None), Sale.date.isnot(None)).first() is None:
+        return 0
+    return backfill_local_dates()
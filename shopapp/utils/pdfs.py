@@ -1,18 +1,29 @@
 import os
 import io
+import hashlib
+import json
+import logging
+import threading
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
 
 from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
+from PIL import Image
 
-from ..extensions import db
+from ..extensions import db, scheduler
 from ..models import Customer, Sale, ShopProfile
+from ..pdf_service import render_sale_pdf
 from .qr import generate_qr_image
+from .shop_config import ShopConfig, get_shop_config
+
+logger = logging.getLogger(__name__)
 
 
 def invoices_dir() -> str:
@@ -27,20 +38,250 @@ def reports_dir() -> str:
     return path
 
 
-def create_invoice_pdf(sale_id: int) -> str | None:
-    sale = Sale.query.get(sale_id)
-    if not sale:
+# Decoded branding uploads, keyed by (path, mtime, size, box, opacity) so a
+# replaced file is picked up even by workers that did not handle the upload.
+_branding_lock = threading.Lock()
+_branding_images: Dict[Tuple[str, int, int, Tuple[float, float], float], Optional[ImageReader]] = {}
+_BRANDING_CACHE_MAX = 16
+# Branding is scaled down to this resolution for the box it is drawn in;
+# reportlab compresses the pixels into every document, so extra ones cost
+# time and bytes on each invoice.
+BRANDING_DPI = 150
+
+
+def clear_branding_cache() -> None:
+    with _branding_lock:
+        _branding_images.clear()
+
+
+def _load_branding_image(path: Path, box: Tuple[float, float], opacity: float) -> ImageReader:
+    image = Image.open(io.BytesIO(path.read_bytes()))
+    image.load()
+    image.thumbnail(tuple(max(round(side * BRANDING_DPI / 72), 1) for side in box))
+    if opacity < 1:
+        # drawImage has no opacity of its own, so a faded image has the
+        # opacity folded into its alpha channel instead.
+        image = image.convert('RGBA')
+        image.putalpha(image.getchannel('A').point(lambda alpha: round(alpha * opacity)))
+    return ImageReader(image)
+
+
+def branding_image(filename: Optional[str], box: Tuple[float, float], opacity: float = 1.0) -> Optional[ImageReader]:
+    """The cached reader for a branding upload drawn in a ``box`` of points, or ``None`` if it is missing or unreadable.
+
+    Takes the absolute path, so it also works in render worker processes
+    that have no application context.
+    """
+    if not filename:
+        return None
+    path = Path(filename)
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    key = (str(path), stat.st_mtime_ns, stat.st_size, box, opacity)
+    with _branding_lock:
+        if key in _branding_images:
+            return _branding_images[key]
+    try:
+        asset = _load_branding_image(path, box, opacity)
+    except Exception:
+        logger.warning('Could not load branding image %s', path)
+        asset = None
+    with _branding_lock:
+        if len(_branding_images) >= _BRANDING_CACHE_MAX:
+            _branding_images.clear()
+        _branding_images[key] = asset
+    return asset
+
+
+def _draw_invoice_branding(pdf: canvas.Canvas, data: Dict[str, Any], brand) -> None:
+    """Draw the header band, logo and watermark as one form XObject.
+
+    The form is defined once per document and placed with ``doForm``; the
+    images inside it are decoded once per process by the branding cache.
+    """
+    width, height = A4
+    if not pdf.hasForm('invoice-branding'):
+        pdf.beginForm('invoice-branding')
+        pdf.setFillColor(brand)
+        pdf.rect(0, height - 100, width, 100, fill=1, stroke=0)
+        pdf.setFillColor(colors.white)
+        pdf.setFont('Helvetica-Bold', 22)
+        pdf.drawString(40, height - 60, data['shop_name'])
+
+        logo = branding_image(data['logo_path'], (80, 50))
+        if logo is not None:
+            pdf.drawImage(logo, width - 120, height - 90, 80, 50, mask='auto')
+
+        watermark = branding_image(data['watermark_path'], (400, 300), opacity=0.08)
+        if watermark is not None:
+            pdf.saveState()
+            pdf.translate(width / 2, height / 2)
+            pdf.rotate(30)
+            pdf.drawImage(watermark, -200, -150, 400, 300, mask='auto')
+            pdf.restoreState()
+        pdf.endForm()
+    pdf.doForm('invoice-branding')
+
+
+# Bump when a layout changes so PDFs already in the store are rendered again.
+INVOICE_LAYOUT_VERSION = 1
+# Sale columns that never appear on an invoice; changing them keeps the stored PDF.
+_INVOICE_IGNORED_COLUMNS = frozenset({
+    'invoice_render_status', 'locked', 'gst_status', 'irn', 'ack_no', 'ack_date',
+    'signed_invoice_path', 'eway_bill_no', 'eway_valid_upto', 'local_date', 'local_hour',
+})
+
+
+def branding_version(shop: Optional[ShopConfig] = None) -> str:
+    """A hash of everything the shop contributes to an invoice, including the upload files' stamps."""
+    shop = shop or get_shop_config()
+    assets = []
+    for relative_path in (shop.logo_path, shop.watermark_path, shop.signature_path):
+        try:
+            stat = (Path(current_app.root_path) / relative_path).stat() if relative_path else None
+        except OSError:
+            stat = None
+        assets.append([relative_path, stat.st_mtime_ns, stat.st_size] if stat else [relative_path])
+    payload = [shop.name, shop.gst, shop.primary_color, shop.secondary_color, assets]
+    return hashlib.sha256(json.dumps(payload, default=str).encode('utf-8')).hexdigest()
+
+
+def invoice_store_key(sale: Sale, customer: Optional[Customer], layout: str = 'invoice',
+                      shop: Optional[ShopConfig] = None) -> str:
+    """Content address of a sale's rendered invoice: the sale, its lines, the customer and the branding."""
+    columns = sorted(column.key for column in Sale.__table__.columns if column.key not in _INVOICE_IGNORED_COLUMNS)
+    lines = sorted(
+        [line.id, line.description, line.hsn_sac, line.qty, line.rate, line.gst_rate, line.tax_rate, line.line_total]
+        for line in sale.line_items or ()
+    )
+    payload = [
+        layout,
+        INVOICE_LAYOUT_VERSION,
+        [getattr(sale, name) for name in columns],
+        lines,
+        [customer.name, customer.phone, customer.email] if customer else None,
+        branding_version(shop),
+    ]
+    return hashlib.sha256(json.dumps(payload, default=str).encode('utf-8')).hexdigest()
+
+
+def invoice_store_path(key: str) -> str:
+    return os.path.join(invoices_dir(), f'{key}.pdf')
+
+
+def stored_invoice(key: str) -> str | None:
+    """The stored PDF for ``key``, marked as recently used, or ``None``."""
+    path = invoice_store_path(key)
+    try:
+        os.utime(path)
+    except OSError:
         return None
+    return path
 
-    customer = Customer.query.get(sale.customer_id) if sale.customer_id else None
-    shop = ShopProfile.query.get(1)
-    shop_name = shop.name if shop and shop.name else 'Evara'
 
-    primary_color = colors.HexColor(shop.primary_color) if shop and shop.primary_color else colors.HexColor('#0A2540')
-    secondary_color = colors.HexColor(shop.secondary_color) if shop and shop.secondary_color else colors.HexColor('#62b5ff')
+def store_invoice(key: str, data: bytes) -> str:
+    path = invoice_store_path(key)
+    # Write to a scratch file first so a background render and an on-demand
+    # render of the same sale never expose a half-written PDF.
+    scratch_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(scratch_path, 'wb') as handle:
+        handle.write(data)
+    os.replace(scratch_path, path)
+    return path
+
+
+def _store_entries() -> Iterable[os.DirEntry]:
+    with os.scandir(invoices_dir()) as entries:
+        return [entry for entry in entries if entry.is_file() and entry.name.endswith('.pdf')]
+
+
+def evict_invoice_store(max_bytes: Optional[int] = None) -> int:
+    """Delete the least recently used PDFs until the store fits ``INVOICE_STORE_MAX_MB``.
+
+    Trims to 90% of the limit so the next few renders do not trigger
+    another pass. Returns the number of files removed.
+    """
+    if max_bytes is None:
+        max_bytes = current_app.config.get('INVOICE_STORE_MAX_MB', 512) * 1024 * 1024
+    files = []
+    for entry in _store_entries():
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    if total <= max_bytes:
+        return 0
+    target = max_bytes * 0.9
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def invoice_render_data(sale: Sale, customer: Optional[Customer], shop: Optional[ShopConfig] = None) -> Dict[str, Any]:
+    """Everything :func:`render_invoice_bytes` draws, as plain picklable values."""
+    shop = shop or get_shop_config()
+    root = Path(current_app.root_path)
+
+    def asset(relative_path: Optional[str]) -> Optional[str]:
+        return str(root / relative_path) if relative_path else None
+
+    if getattr(sale, "line_items", None):
+        lines = [
+            (line.description or sale.item, str(line.qty or 0), float(line.line_total or 0))
+            for line in sale.line_items
+        ]
+    else:
+        lines = [(sale.item, str(sale.quantity), sale.total)]
+
+    return {
+        'shop_name': shop.name if shop and shop.name else 'Evara',
+        'primary_color': shop.primary_color if shop and shop.primary_color else '#0A2540',
+        'secondary_color': shop.secondary_color if shop and shop.secondary_color else '#62b5ff',
+        'logo_path': asset(shop.logo_path if shop else None),
+        'watermark_path': asset(shop.watermark_path if shop else None),
+        'signature_path': asset(shop.signature_path if shop else None),
+        'invoice_number': sale.invoice_number or f"{sale.id:05d}",
+        'date': sale.date,
+        'seller_gstin': sale.seller_gstin or (shop.gst if shop and shop.gst else None),
+        'seller_state': sale.seller_state or None,
+        'buyer_gstin': sale.buyer_gstin,
+        'buyer_state': sale.buyer_state,
+        'customer': (
+            {'name': customer.name, 'phone': customer.phone, 'email': customer.email} if customer else None
+        ),
+        'lines': lines,
+        'subtotal': float(sale.subtotal or (sale.net_total - sale.tax + sale.discount)),
+        'discount': float(sale.discount or 0),
+        'cgst': float(sale.cgst or 0),
+        'sgst': float(sale.sgst or 0),
+        'igst': float(sale.igst or 0),
+        'tax_total': float(sale.tax_total or sale.tax or 0),
+        'roundoff': float(sale.roundoff or 0),
+        'total': float(sale.total or sale.net_total or 0),
+    }
+
+
+def render_invoice_bytes(data: Dict[str, Any]) -> bytes:
+    """Draw an invoice from :func:`invoice_render_data` output.
+
+    Touches neither the database nor the application, so bulk downloads can
+    run it in worker processes.
+    """
+    primary_color = colors.HexColor(data['primary_color'])
+    secondary_color = colors.HexColor(data['secondary_color'])
 
-    invoice_number = sale.invoice_number or f"{sale.id:05d}"
-    invoice_path = os.path.join(invoices_dir(), f'invoice_{invoice_number}.pdf')
     buf = io.BytesIO()
     pdf = canvas.Canvas(buf, pagesize=A4)
     width, height = A4
@@ -48,40 +289,15 @@ def create_invoice_pdf(sale_id: int) -> str | None:
     brand = primary_color
     text_color = colors.HexColor('#333333')
 
-    pdf.setFillColor(brand)
-    pdf.rect(0, height - 100, width, 100, fill=1, stroke=0)
-    pdf.setFillColor(colors.white)
-    pdf.setFont('Helvetica-Bold', 22)
-    pdf.drawString(40, height - 60, shop_name)
-
-    if shop and shop.logo_path:
-        logo_path = Path(current_app.root_path) / shop.logo_path
-        if logo_path.exists():
-            try:
-                pdf.drawImage(ImageReader(logo_path.open('rb')), width - 120, height - 90, width=80, height=50, mask='auto')
-            except Exception:
-                pass
-
-    if shop and shop.watermark_path:
-        watermark_path = Path(current_app.root_path) / shop.watermark_path
-        if watermark_path.exists():
-            try:
-                pdf.saveState()
-                pdf.translate(width / 2, height / 2)
-                pdf.rotate(30)
-                pdf.setFillAlpha(0.08)
-                pdf.drawImage(ImageReader(watermark_path.open('rb')), -200, -150, width=400, height=300, mask='auto')
-                pdf.restoreState()
-            except Exception:
-                pass
+    _draw_invoice_branding(pdf, data, brand)
 
     pdf.setFillColor(text_color)
     pdf.setFont('Helvetica', 11)
     pdf.drawString(40, height - 130, 'Invoice summary')
-    pdf.drawString(40, height - 148, f'Invoice: {invoice_number}')
-    pdf.drawString(40, height - 166, f'Date: {sale.date.strftime("%d %b %Y %H:%M")}')
-    seller_gstin_value = sale.seller_gstin or (shop.gst if shop and shop.gst else None)
-    seller_state_value = sale.seller_state or None
+    pdf.drawString(40, height - 148, f"Invoice: {data['invoice_number']}")
+    pdf.drawString(40, height - 166, f'Date: {data["date"].strftime("%d %b %Y %H:%M")}')
+    seller_gstin_value = data['seller_gstin']
+    seller_state_value = data['seller_state']
     if seller_gstin_value:
         pdf.drawString(40, height - 184, f'GSTIN: {seller_gstin_value}')
     if seller_state_value:
@@ -93,20 +309,21 @@ def create_invoice_pdf(sale_id: int) -> str | None:
     pdf.setFont('Helvetica-Bold', 11)
     pdf.drawString(40, height - text_offset, 'Billed to:')
     pdf.setFont('Helvetica', 10)
+    customer = data['customer']
     if customer:
-        pdf.drawString(40, height - (text_offset + 16), customer.name)
+        pdf.drawString(40, height - (text_offset + 16), customer['name'])
         cursor = text_offset + 32
-        if customer.phone:
-            pdf.drawString(40, height - cursor, f'Phone: {customer.phone}')
+        if customer['phone']:
+            pdf.drawString(40, height - cursor, f"Phone: {customer['phone']}")
             cursor += 16
-        if customer.email:
-            pdf.drawString(40, height - cursor, f'Email: {customer.email}')
+        if customer['email']:
+            pdf.drawString(40, height - cursor, f"Email: {customer['email']}")
             cursor += 16
-        if sale.buyer_gstin:
-            pdf.drawString(40, height - cursor, f'GSTIN: {sale.buyer_gstin}')
+        if data['buyer_gstin']:
+            pdf.drawString(40, height - cursor, f"GSTIN: {data['buyer_gstin']}")
             cursor += 16
-        if sale.buyer_state:
-            pdf.drawString(40, height - cursor, f'State: {sale.buyer_state}')
+        if data['buyer_state']:
+            pdf.drawString(40, height - cursor, f"State: {data['buyer_state']}")
     else:
         pdf.drawString(40, height - (text_offset + 16), 'Walk-in customer')
 
@@ -119,26 +336,20 @@ def create_invoice_pdf(sale_id: int) -> str | None:
     pdf.setFont('Helvetica', 10)
     row_gap = 16
     y_cursor = table_top - row_gap
-    if getattr(sale, "line_items", None):
-        for line in sale.line_items:
-            pdf.drawString(40, y_cursor, line.description or sale.item)
-            pdf.drawString(320, y_cursor, str(line.qty or 0))
-            pdf.drawRightString(width - 80, y_cursor, f'Rs {float(line.line_total or 0):,.2f}')
-            y_cursor -= row_gap
-    else:
-        pdf.drawString(40, y_cursor, sale.item)
-        pdf.drawString(320, y_cursor, str(sale.quantity))
-        pdf.drawRightString(width - 80, y_cursor, f'Rs {sale.total:,.2f}')
+    for description, quantity, amount in data['lines']:
+        pdf.drawString(40, y_cursor, description)
+        pdf.drawString(320, y_cursor, quantity)
+        pdf.drawRightString(width - 80, y_cursor, f'Rs {amount:,.2f}')
         y_cursor -= row_gap
 
-    subtotal_value = float(sale.subtotal or (sale.net_total - sale.tax + sale.discount))
-    discount_value = float(sale.discount or 0)
-    cgst_value = float(sale.cgst or 0)
-    sgst_value = float(sale.sgst or 0)
-    igst_value = float(sale.igst or 0)
-    tax_total_value = float(sale.tax_total or sale.tax or 0)
-    roundoff_value = float(sale.roundoff or 0)
-    total_value = float(sale.total or sale.net_total or 0)
+    subtotal_value = data['subtotal']
+    discount_value = data['discount']
+    cgst_value = data['cgst']
+    sgst_value = data['sgst']
+    igst_value = data['igst']
+    tax_total_value = data['tax_total']
+    roundoff_value = data['roundoff']
+    total_value = data['total']
 
     summary_y = y_cursor - 24
     pdf.setFont('Helvetica', 10)
@@ -177,25 +388,103 @@ def create_invoice_pdf(sale_id: int) -> str | None:
     pdf.drawRightString(width - 80, summary_y, f'Rs {total_value:,.2f}')
     pdf.setFillColor(text_color)
 
-    if shop and shop.signature_path:
-        signature_path = Path(current_app.root_path) / shop.signature_path
-        if signature_path.exists():
-            try:
-                pdf.drawImage(ImageReader(signature_path.open('rb')), 40, 100, width=50 * mm, height=20 * mm, mask='auto')
-                pdf.setFont('Helvetica', 9)
-                pdf.drawString(40, 90, 'Authorised Signature')
-            except Exception:
-                pass
+    signature = branding_image(data['signature_path'], (50 * mm, 20 * mm))
+    if signature is not None:
+        pdf.drawImage(signature, 40, 100, 50 * mm, 20 * mm, mask='auto')
+        pdf.setFont('Helvetica', 9)
+        pdf.drawString(40, 90, 'Authorised Signature')
 
     pdf.save()
-    buf.seek(0)
-    with open(invoice_path, 'wb') as handle:
-        handle.write(buf.getvalue())
-    return invoice_path
+    return buf.getvalue()
+
+
+def create_invoice_pdf(sale_id: int) -> str | None:
+    sale = Sale.query.get(sale_id)
+    if not sale:
+        return None
+
+    customer = Customer.query.get(sale.customer_id) if sale.customer_id else None
+    shop = get_shop_config()
+    store_key = invoice_store_key(sale, customer, shop=shop)
+    return store_invoice(store_key, render_invoice_bytes(invoice_render_data(sale, customer, shop)))
+
+
 
 
-def create_zreport_pdf(summary: dict) -> str:
-    path = os.path.join(reports_dir(), f"zreport_{summary['date']}.pdf")
+def _set_render_status(sale_id: int, status: str) -> None:
+    Sale.query.filter_by(id=sale_id).update({'invoice_render_status': status}, synchronize_session=False)
+    db.session.commit()
+
+
+def render_invoice(sale_id: int) -> str | None:
+    """Render the invoice PDF for a sale and record the outcome on the sale."""
+    try:
+        path = create_invoice_pdf(sale_id)
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Invoice render failed for sale %s', sale_id)
+        _set_render_status(sale_id, 'failed')
+        return None
+    if path:
+        _set_render_status(sale_id, 'ready')
+    return path
+
+
+def ensure_invoice_pdf(sale_id: int) -> Tuple[str, str] | None:
+    """Return ``(path, store key)`` for the sale's invoice, rendering only if the sale or branding changed."""
+    sale = Sale.query.get(sale_id)
+    if not sale:
+        return None
+    customer = Customer.query.get(sale.customer_id) if sale.customer_id else None
+    key = invoice_store_key(sale, customer)
+    path = stored_invoice(key) or render_invoice(sale_id)
+    return (path, key) if path else None
+
+
+def ensure_tax_invoice_pdf(sale: Sale) -> Tuple[str, str, str]:
+    """Return ``(path, store key, download name)`` for the GST tax invoice layout."""
+    customer = getattr(sale, "customer", None)
+    key = invoice_store_key(sale, customer, layout='tax-invoice')
+    invoice_number = sale.invoice_number or sale.id
+    filename = f"Invoice_{invoice_number}.pdf"
+    path = stored_invoice(key)
+    if path is None:
+        pdf_bytes, filename = render_sale_pdf(sale, sale.line_items or [sale], customer)
+        path = store_invoice(key, pdf_bytes)
+    return path, key, filename
+
+
+def _run_invoice_render(app, sale_id: int) -> None:
+    with app.app_context():
+        try:
+            render_invoice(sale_id)
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception('Could not record invoice render status for sale %s', sale_id)
+        finally:
+            db.session.remove()
+
+
+def queue_invoice_render(sale_id: int) -> None:
+    """Render a freshly committed sale's invoice in the background.
+
+    Falls back to rendering inline when the scheduler is not running, such as
+    under the CLI or in tests.
+    """
+    if not scheduler.running:
+        render_invoice(sale_id)
+        return
+    scheduler.add_job(
+        _run_invoice_render,
+        args=[current_app._get_current_object(), sale_id],
+        id=f'invoice-render-{sale_id}',
+        replace_existing=True,
+        misfire_grace_time=None,
+    )
+
+
+def render_zreport_pdf(summary: dict) -> bytes:
+    """Render a day-close summary to PDF bytes."""
     buf = io.BytesIO()
     pdf = canvas.Canvas(buf, pagesize=A4)
     width, height = A4
@@ -205,6 +494,8 @@ def create_zreport_pdf(summary: dict) -> str:
     pdf.setFont('Helvetica', 12)
     pdf.drawString(40, height - 80, f"Revenue: Rs {summary['totals']['revenue']:,.2f}")
     pdf.drawString(40, height - 100, f"Transactions: {summary['totals']['transactions']}")
+    peak = f"{summary['peak_hour']:02d}:00" if summary.get('peak_hour') is not None else '-'
+    pdf.drawString(40, height - 120, f"Customers: {summary['totals']['unique_customers']}   Peak hour: {peak}")
 
     y = height - 140
     pdf.setFont('Helvetica-Bold', 12)
@@ -239,10 +530,7 @@ def create_zreport_pdf(summary: dict) -> str:
     pdf.drawString(40, y, f"Outstanding udhar: Rs {summary['udhar']['outstanding_total']:,.2f} across {summary['udhar']['outstanding_accounts']} accounts")
 
     pdf.save()
-    buf.seek(0)
-    with open(path, 'wb') as handle:
-        handle.write(buf.getvalue())
-    return path
+    return buf.getvalue()
 
 
 def create_signage_pdf(payment_url: str | None, review_url: str | None, shop: ShopProfile | None = None) -> str:
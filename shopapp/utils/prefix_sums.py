@@ -0,0 +1,206 @@
+"""Cumulative per-day totals for constant-time date-range queries.
+
+``daily_totals_prefix`` holds, for every closed day, the running totals of
+revenue, discount, tax, expenses and transactions since the first trading
+day. The total for any range is then the difference of two rows, plus the
+few open days after the last closed one, read from the daily rollup.
+
+Rows are appended as days close (:func:`extend_prefix_sums`) and cut back
+from the earliest day a late write touches (:func:`truncate_prefix_sums`),
+so they never go stale; the next extension recomputes the cut days.
+"""
+from __future__ import annotations
+
+import calendar
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from ..extensions import db
+from ..models import DailyTotalsPrefix, Expense, SalesDailyRollup
+from .localtime import local_today
+from .schema import dialect_insert
+
+MEASURES = ("revenue", "discount", "tax", "expenses", "transactions")
+COMPARISONS = ("previous", "mom", "yoy")
+
+
+def _zero() -> Dict[str, float]:
+    return dict.fromkeys(MEASURES, 0)
+
+
+def _last_closed_day() -> date:
+    return local_today() - timedelta(days=1)
+
+
+def _daily_totals(start: Optional[date], end: date) -> Dict[date, Dict[str, float]]:
+    """Per-day totals from the rollup and expenses for ``start``..``end`` inclusive."""
+    sales = (
+        select(
+            SalesDailyRollup.day,
+            func.coalesce(func.sum(SalesDailyRollup.revenue), 0),
+            func.coalesce(func.sum(SalesDailyRollup.discount), 0),
+            func.coalesce(func.sum(SalesDailyRollup.tax), 0),
+            func.coalesce(func.sum(SalesDailyRollup.sale_count), 0),
+        )
+        .where(SalesDailyRollup.day <= end)
+        .group_by(SalesDailyRollup.day)
+    )
+    expenses = (
+        select(Expense.date, func.coalesce(func.sum(Expense.amount), 0))
+        .where(Expense.date <= end)
+        .group_by(Expense.date)
+    )
+    if start is not None:
+        sales = sales.where(SalesDailyRollup.day >= start)
+        expenses = expenses.where(Expense.date >= start)
+
+    days: Dict[date, Dict[str, float]] = {}
+    for day, revenue, discount, tax, count in db.session.execute(sales):
+        entry = days.setdefault(day, _zero())
+        entry["revenue"] += float(revenue or 0)
+        entry["discount"] += float(discount or 0)
+        entry["tax"] += float(tax or 0)
+        entry["transactions"] += int(count or 0)
+    for day, amount in db.session.execute(expenses):
+        if day is not None:
+            days.setdefault(day, _zero())["expenses"] += float(amount or 0)
+    return days
+
+
+def extend_prefix_sums(through: Optional[date] = None) -> int:
+    """Append prefix rows up to ``through`` (default: yesterday) in the caller's transaction.
+
+    Returns the number of rows written. Today is never included: it is
+    still open and range queries read it from the rollup. Every worker runs
+    this at start-up and at the nightly lock, so rows another worker has
+    already written are skipped rather than raising.
+    """
+
+    through = min(through or _last_closed_day(), _last_closed_day())
+    last = db.session.execute(
+        select(DailyTotalsPrefix).order_by(DailyTotalsPrefix.day.desc()).limit(1)
+    ).scalar_one_or_none()
+    start = last.day + timedelta(days=1) if last is not None else None
+    if start is not None and start > through:
+        return 0
+
+    days = _daily_totals(start, through)
+    if start is None:
+        if not days:
+            return 0
+        start = min(days)
+
+    running = {name: getattr(last, name) for name in MEASURES} if last is not None else _zero()
+    rows = []
+    day = start
+    while day <= through:
+        for name, value in days.get(day, {}).items():
+            running[name] += value
+        rows.append({"day": day, **running})
+        day += timedelta(days=1)
+    if rows:
+        db.session.execute(
+            dialect_insert(db.engine, DailyTotalsPrefix.__table__).on_conflict_do_nothing(index_elements=["day"]),
+            rows,
+        )
+    return len(rows)
+
+
+def truncate_prefix_sums(from_day: date, session: Optional[Session] = None) -> None:
+    """Drop prefix rows from ``from_day`` on after a write to that day or earlier."""
+    session = session or db.session()
+    session.connection().execute(delete(DailyTotalsPrefix).where(DailyTotalsPrefix.day >= from_day))
+
+
+def _subtract(upper: Optional[DailyTotalsPrefix], lower: Optional[DailyTotalsPrefix]) -> Dict[str, float]:
+    return {
+        name: (getattr(upper, name) if upper is not None else 0) - (getattr(lower, name) if lower is not None else 0)
+        for name in MEASURES
+    }
+
+
+def range_totals(start: date, end: date) -> Dict[str, object]:
+    """Totals for ``start``..``end`` inclusive.
+
+    Closed days cost two primary-key lookups; any open days after the last
+    prefix row (normally just today) are read from the rollup.
+    """
+
+    totals = _zero()
+    if start <= end:
+        last_day = db.session.query(func.max(DailyTotalsPrefix.day)).scalar()
+        tail_start = start
+        if last_day is not None and start <= last_day:
+            upper_day = min(end, last_day)
+            lower_day = start - timedelta(days=1)
+            bounds = {
+                row.day: row
+                for row in DailyTotalsPrefix.query.filter(DailyTotalsPrefix.day.in_([lower_day, upper_day]))
+            }
+            # Days before the first row carry no totals, so a missing lower bound is zero.
+            totals = _subtract(bounds.get(upper_day), bounds.get(lower_day))
+            tail_start = last_day + timedelta(days=1)
+        if tail_start <= end:
+            for entry in _daily_totals(tail_start, end).values():
+                for name, value in entry.items():
+                    totals[name] += value
+
+    result: Dict[str, object] = {name: round(value, 2) for name, value in totals.items()}
+    result["transactions"] = int(totals["transactions"])
+    result["profit"] = round(totals["revenue"] - totals["expenses"], 2)
+    result["start"] = start.isoformat()
+    result["end"] = end.isoformat()
+    return result
+
+
+def _shift_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def comparison_window(start: date, end: date, against: str) -> Tuple[date, date]:
+    """The period ``start``..``end`` is compared with: the one before it, a month back or a year back."""
+    if against == "mom":
+        return _shift_months(start, -1), _shift_months(end, -1)
+    if against == "yoy":
+        return _shift_months(start, -12), _shift_months(end, -12)
+    length = end - start + timedelta(days=1)
+    return start - length, end - length
+
+
+def compare_periods(start: date, end: date, against: str = "mom") -> Dict[str, object]:
+    if against not in COMPARISONS:
+        raise ValueError(f"against must be one of {', '.join(COMPARISONS)}.")
+    current = range_totals(start, end)
+    previous = range_totals(*comparison_window(start, end, against))
+    change = {}
+    for name in (*MEASURES, "profit"):
+        delta = current[name] - previous[name]
+        change[name] = {
+            "delta": round(delta, 2),
+            "percent": round(delta / abs(previous[name]) * 100, 1) if previous[name] else None,
+        }
+    return {"against": against, "current": current, "previous": previous, "change": change}
+
+
+@event.listens_for(Session, "after_flush")
+def _truncate_on_expense_write(session: Session, flush_context) -> None:
+    touched = []
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, Expense):
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not (
+            state.attrs.date.history.has_changes() or state.attrs.amount.history.has_changes()
+        ):
+            continue
+        touched.append(obj.date)
+        touched.extend(state.attrs.date.history.deleted or ())
+    touched = [day for day in touched if day is not None]
+    if touched and min(touched) <= _last_closed_day():
+        truncate_prefix_sums(min(touched), session)
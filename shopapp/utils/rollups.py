@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+
+from ..extensions import db
+from ..models import Sale, SalesDailyRollup, ZReportSnapshot
+from .localtime import local_stamp, local_today
+from .prefix_sums import truncate_prefix_sums
+from .schema import dialect_insert
+
+RollupKey = Tuple[date, int, str]
+_MEASURES = ("revenue", "discount", "tax", "sale_count", "quantity")
+
+
+def _key(day: Any, location_id: Optional[int], payment_method: Optional[str]) -> RollupKey:
+    if isinstance(day, datetime):
+        day = day.date()
+    elif isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    return day, int(location_id or 0), payment_method or "cash"
+
+
+def _upsert(rows: List[Dict[str, Any]], accumulate: bool) -> None:
+    table = SalesDailyRollup.__table__
+    stmt = dialect_insert(db.engine, table)
+    if accumulate:
+        updates = {name: table.c[name] + stmt.excluded[name] for name in _MEASURES}
+    else:
+        updates = {name: stmt.excluded[name] for name in _MEASURES}
+    updates["updated_at"] = stmt.excluded.updated_at
+    stmt = stmt.on_conflict_do_update(index_elements=["day", "location_id", "payment_method"], set_=updates)
+    db.session.execute(stmt, rows)
+
+
+def record_sales(sales: Iterable[Mapping[str, Any]]) -> None:
+    """Add sales to the daily rollup inside the caller's transaction.
+
+    Each mapping carries the ``Sale`` columns ``local_date`` (or ``date``),
+    ``location_id``, ``payment_method``, ``net_total``, ``discount``, ``tax``
+    and ``quantity``. Sales sharing a shop-local day, location and payment
+    method become one upsert row. Z-report snapshots of the touched days are
+    dropped, so a closed day that gains a sale is reported live again.
+    """
+
+    totals: Dict[RollupKey, Dict[str, float]] = {}
+    for sale in sales:
+        day = sale.get("local_date") or local_stamp(sale.get("date") or datetime.utcnow())[0]
+        key = _key(day, sale.get("location_id"), sale.get("payment_method"))
+        entry = totals.setdefault(key, dict.fromkeys(_MEASURES, 0))
+        entry["revenue"] += float(sale.get("net_total") or 0)
+        entry["discount"] += float(sale.get("discount") or 0)
+        entry["tax"] += float(sale.get("tax") or 0)
+        entry["sale_count"] += 1
+        entry["quantity"] += int(sale.get("quantity") or 0)
+    if not totals:
+        return
+
+    now = datetime.utcnow()
+    _upsert([
+        {"day": day, "location_id": location_id, "payment_method": method, "updated_at": now, **entry}
+        for (day, location_id, method), entry in totals.items()
+    ], accumulate=True)
+
+    days = {day for day, _, _ in totals}
+    db.session.execute(delete(ZReportSnapshot).where(ZReportSnapshot.day.in_(days)))
+
+    # A sale dated before today changes a closed day the prefix sums cover.
+    earliest = min(days)
+    if earliest < local_today():
+        truncate_prefix_sums(earliest)
+
+
+def rebuild_rollups(since: Optional[date] = None) -> int:
+    """Recompute rollup rows from ``sales``, for every day or from ``since`` on.
+
+    Runs in the caller's transaction and returns the number of rollup rows
+    written. Use it to backfill after an upgrade or to repair rows after sales
+    were edited outside checkout and bulk ingest.
+    """
+
+    day_expr = Sale.local_date
+    location_expr = func.coalesce(Sale.location_id, 0)
+    method_expr = func.coalesce(Sale.payment_method, "cash")
+    query = (
+        select(
+            day_expr,
+            location_expr,
+            method_expr,
+            func.coalesce(func.sum(Sale.net_total), 0),
+            func.coalesce(func.sum(Sale.discount), 0),
+            func.coalesce(func.sum(Sale.tax), 0),
+            func.count(Sale.id),
+            func.coalesce(func.sum(Sale.quantity), 0),
+        )
+        .group_by(day_expr, location_expr, method_expr)
+    )
+    clear = delete(SalesDailyRollup)
+    if since is not None:
+        query = query.where(Sale.local_date >= since)
+        clear = clear.where(SalesDailyRollup.day >= since)
+
+    now = datetime.utcnow()
+    rows = []
+    for day, location_id, method, revenue, discount, tax, count, quantity in db.session.execute(query):
+        if day is None:
+            continue
+        day, location_id, method = _key(day, location_id, method)
+        rows.append({
+            "day": day,
+            "location_id": location_id,
+            "payment_method": method,
+            "revenue": float(revenue or 0),
+            "discount": float(discount or 0),
+            "tax": float(tax or 0),
+            "sale_count": int(count or 0),
+            "quantity": int(quantity or 0),
+            "updated_at": now,
+        })
+
+    db.session.execute(clear)
+    truncate_prefix_sums(since or date.min)
+    if rows:
+        # Replace rather than add so a rebuild can never double-count, even
+        # if a checkout upserted the same key after the delete.
+        _upsert(rows, accumulate=False)
+    return len(rows)
+
+
+def backfill_rollups_if_empty() -> None:
+    """Build the rollup on first start after an upgrade, when sales already exist."""
+    if db.session.query(SalesDailyRollup.id).first() is not None:
+        return
+    if db.session.query(Sale.id).first() is None:
+        return
+    rebuild_rollups()
+    db.session.commit()
@@ -2,8 +2,9 @@ from __future__ import annotations
 
 from collections.abc import Iterable
 
-from sqlalchemy import inspect, text
+from sqlalchemy import Integer, cast, extract, func, inspect, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, SessionTransaction
 
 
 def ensure_columns(engine: Engine, table: str, columns: Iterable[str] | dict[str, str]) -> None:
@@ -64,3 +65,49 @@ def ensure_columns(engine: Engine, table: str, columns: Iterable[str] | dict[str
                   UPDATE {table} SET {colname}=datetime('now') WHERE rowid = NEW.rowid;
                 END;
                 """))
+
+
+def dialect_insert(engine: Engine, table):
+    """Return an INSERT construct that supports ``on_conflict_do_*`` upserts."""
+    backend = engine.url.get_backend_name()
+    if backend == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif backend == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {backend}")
+    return insert(table)
+
+
+def weekday_and_hour(engine: Engine, column):
+    """Monday=0 weekday and hour-of-day expressions for a DATETIME column."""
+    if engine.url.get_backend_name() == "sqlite":
+        weekday = (cast(func.strftime("%w", column), Integer) + 6) % 7
+        hour = cast(func.strftime("%H", column), Integer)
+    else:
+        weekday = cast(extract("isodow", column), Integer) - 1
+        hour = cast(extract("hour", column), Integer)
+    return weekday, hour
+
+
+def ensure_indexes(engine: Engine, table: str, indexes: dict[str, str]) -> None:
+    """Create missing secondary indexes, given as ``{name: "col1, col2"}``."""
+    insp = inspect(engine)
+    if table not in insp.get_table_names():
+        return
+    with engine.begin() as conn:
+        for name, columns in indexes.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def begin_savepoint(session: Session) -> SessionTransaction:
+    """``session.begin_nested()`` that also holds on SQLite.
+
+    pysqlite only opens a transaction before a write, so a SAVEPOINT issued
+    first becomes the outermost transaction and releasing it commits. Open
+    the transaction explicitly first so the savepoint nests inside it.
+    """
+    connection = session.connection()
+    if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
+    return session.begin_nested()
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import func
+
+from ..extensions import db
+from ..models import Customer, Item
+
+DocKey = Tuple[str, int]
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+SEARCH_KINDS = ("item", "customer")
+# Rows committed slightly out of timestamp order are still picked up.
+_WATERMARK_OVERLAP = timedelta(seconds=30)
+
+
+def _normalize(value: Optional[str]) -> str:
+    return " ".join(_TOKEN_RE.findall((value or "").lower()))
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@dataclass(frozen=True)
+class _Doc:
+    kind: str
+    label: str
+    text: str
+    tokens: Tuple[str, ...]
+    payload: Dict[str, Any]
+
+
+class CatalogueIndex:
+    """In-process typeahead index over item and customer names, barcodes and phones.
+
+    Queries of one or two characters use a short-prefix table; longer
+    queries intersect trigram postings and then confirm the substring, so
+    "rice" finds "Basmati Rice" and "4321" finds a phone ending in it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._docs: Dict[DocKey, _Doc] = {}
+        self._short: Dict[str, Set[DocKey]] = defaultdict(set)
+        self._grams: Dict[str, Set[DocKey]] = defaultdict(set)
+        self._watermarks: Dict[str, Optional[datetime]] = {kind: None for kind in SEARCH_KINDS}
+        self._counts: Dict[str, int] = {kind: 0 for kind in SEARCH_KINDS}
+        self._checked_at = 0.0
+
+    def _remove(self, key: DocKey) -> None:
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for token in doc.tokens:
+            for prefix in (token[:1], token[:2]):
+                self._short[prefix].discard(key)
+        for gram in _trigrams(doc.text):
+            self._grams[gram].discard(key)
+
+    def _add(self, key: DocKey, doc: _Doc) -> None:
+        self._remove(key)
+        self._docs[key] = doc
+        for token in doc.tokens:
+            for prefix in (token[:1], token[:2]):
+                self._short[prefix].add(key)
+        for gram in _trigrams(doc.text):
+            self._grams[gram].add(key)
+
+    @staticmethod
+    def _item_doc(item: Item) -> _Doc:
+        text = _normalize(f"{item.name} {item.barcode or ''}")
+        return _Doc(
+            kind="item",
+            label=item.name,
+            text=text,
+            tokens=tuple(text.split()),
+            payload={
+                "type": "item",
+                "id": item.id,
+                "name": item.name,
+                "barcode": item.barcode,
+                "price": float(item.price or 0),
+                "stock": int(item.current_stock or 0),
+            },
+        )
+
+    @staticmethod
+    def _customer_doc(customer: Customer) -> _Doc:
+        text = _normalize(f"{customer.name} {customer.phone or ''}")
+        return _Doc(
+            kind="customer",
+            label=customer.name,
+            text=text,
+            tokens=tuple(text.split()),
+            payload={
+                "type": "customer",
+                "id": customer.id,
+                "name": customer.name,
+                "phone": customer.phone,
+            },
+        )
+
+    def _sync(self, kind: str, model, build) -> None:
+        total = db.session.query(func.count(model.id)).scalar() or 0
+        watermark = self._watermarks[kind]
+        query = model.query
+        if watermark is not None and total >= self._counts[kind]:
+            query = query.filter(model.updated_at >= watermark - _WATERMARK_OVERLAP)
+        else:
+            # First load, or rows were deleted: rebuild this kind.
+            for key in [key for key in self._docs if key[0] == kind]:
+                self._remove(key)
+
+        for row in query.yield_per(1000):
+            self._add((kind, row.id), build(row))
+            if row.updated_at and (watermark is None or row.updated_at > watermark):
+                watermark = row.updated_at
+        self._watermarks[kind] = watermark
+        self._counts[kind] = total
+
+    def refresh(self, force: bool = False) -> None:
+        """Pull rows changed since the last refresh, at most once per interval."""
+        interval = current_app.config.get("POS_SEARCH_REFRESH_SECONDS", 5)
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked_at and now - self._checked_at < interval:
+                return
+            self._sync("item", Item, self._item_doc)
+            self._sync("customer", Customer, self._customer_doc)
+            self._checked_at = now
+
+    def _candidates(self, token: str) -> Set[DocKey]:
+        if len(token) < 3:
+            return set(self._short.get(token, ()))
+        grams = sorted((self._grams.get(gram, set()) for gram in _trigrams(token)), key=len)
+        if not grams or not grams[0]:
+            return set()
+        matched = set(grams[0]).intersection(*grams[1:])
+        return {key for key in matched if token in self._docs[key].text}
+
+    def search(self, query: str, kinds: Iterable[str] = SEARCH_KINDS, limit: int = 20) -> List[Dict[str, Any]]:
+        tokens = _normalize(query).split()
+        if not tokens:
+            return []
+        wanted = set(kinds)
+        with self._lock:
+            keys: Optional[Set[DocKey]] = None
+            for token in tokens:
+                found = self._candidates(token)
+                keys = found if keys is None else keys & found
+                if not keys:
+                    return []
+            docs = [self._docs[key] for key in keys if key[0] in wanted]
+
+        phrase = " ".join(tokens)
+
+        def rank(doc: _Doc) -> Tuple[int, str]:
+            if doc.text.startswith(phrase):
+                return 0, doc.label.lower()
+            if any(token.startswith(tokens[0]) for token in doc.tokens):
+                return 1, doc.label.lower()
+            return 2, doc.label.lower()
+
+        docs.sort(key=rank)
+        return [dict(doc.payload) for doc in docs[:limit]]
+
+
+_index = CatalogueIndex()
+
+
+def search_catalogue(query: str, kinds: Iterable[str] = SEARCH_KINDS, limit: int = 20) -> List[Dict[str, Any]]:
+    _index.refresh()
+    return _index.search(query, kinds=kinds, limit=limit)
+
+
+def reset_index() -> None:
+    global _index
+    _index = CatalogueIndex()
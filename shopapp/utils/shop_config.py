@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from flask import g, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, selectinload
+
+from ..extensions import db
+from ..models import Setting, ShopLocation, ShopProfile
+from .schema import dialect_insert
+
+VERSION_KEY = "shop_config_version"
+# Settings rows that are part of the snapshot; writing any of them bumps the version.
+SNAPSHOT_SETTING_KEYS = frozenset({"sales_lock_date"})
+_BUMP_KEY = "shop_config_bumped"
+
+
+@dataclass(frozen=True)
+class LocationConfig:
+    id: int
+    name: str
+    gstin: Optional[str]
+    state_code: Optional[str]
+    is_default: bool
+
+
+@dataclass(frozen=True)
+class ShopConfig:
+    """Read-only view of the shop profile, its locations and the sales lock."""
+
+    version: str
+    exists: bool = False
+    name: Optional[str] = None
+    shop_name: Optional[str] = None
+    address: Optional[str] = None
+    phone: Optional[str] = None
+    gst: Optional[str] = None
+    currency: str = "INR"
+    timezone: str = "Asia/Kolkata"
+    invoice_prefix: str = "INV"
+    primary_color: Optional[str] = None
+    secondary_color: Optional[str] = None
+    logo_path: Optional[str] = None
+    signature_path: Optional[str] = None
+    watermark_path: Optional[str] = None
+    locations: Tuple[LocationConfig, ...] = ()
+    sales_lock_date: Optional[str] = None
+
+    @property
+    def default_location(self) -> Optional[LocationConfig]:
+        """The location flagged as default, else the first one, as checkout uses."""
+        flagged = next((location for location in self.locations if location.is_default), None)
+        return flagged or (self.locations[0] if self.locations else None)
+
+    @property
+    def default_location_id(self) -> Optional[int]:
+        location = self.default_location
+        return location.id if location else None
+
+    def location(self, location_id: Optional[int]) -> Optional[LocationConfig]:
+        return next((location for location in self.locations if location.id == location_id), None)
+
+    def sales_locked_on(self, day: str) -> bool:
+        return self.sales_lock_date == day
+
+
+_lock = threading.Lock()
+_snapshot: Optional[ShopConfig] = None
+
+
+def _current_version() -> str:
+    value = db.session.execute(select(Setting.value).where(Setting.key == VERSION_KEY)).scalar()
+    return value or "0"
+
+
+def _build(version: str) -> ShopConfig:
+    profile = ShopProfile.query.options(selectinload(ShopProfile.locations)).filter_by(id=1).first()
+    lock_date = db.session.execute(select(Setting.value).where(Setting.key == "sales_lock_date")).scalar()
+    if profile is None:
+        return ShopConfig(version=version, sales_lock_date=lock_date)
+    return ShopConfig(
+        version=version,
+        exists=True,
+        name=profile.name,
+        shop_name=profile.shop_name,
+        address=profile.address,
+        phone=profile.phone,
+        gst=profile.gst,
+        currency=profile.currency or "INR",
+        timezone=profile.timezone or "Asia/Kolkata",
+        invoice_prefix=profile.invoice_prefix or "INV",
+        primary_color=profile.primary_color,
+        secondary_color=profile.secondary_color,
+        logo_path=profile.logo_path,
+        signature_path=profile.signature_path,
+        watermark_path=profile.watermark_path,
+        locations=tuple(
+            LocationConfig(
+                id=location.id,
+                name=location.name,
+                gstin=location.gstin,
+                state_code=location.state_code,
+                is_default=bool(location.is_default),
+            )
+            for location in sorted(profile.locations, key=lambda location: location.id)
+        ),
+        sales_lock_date=lock_date,
+    )
+
+
+def get_shop_config() -> ShopConfig:
+    """Return the shop configuration snapshot.
+
+    The snapshot is shared by every request in the process and rebuilt only
+    when the version stamp in ``settings`` changes; the stamp itself is read
+    once per request.
+    """
+
+    global _snapshot
+    cached = g.get("_shop_config") if has_app_context() else None
+    if cached is not None:
+        return cached
+
+    version = _current_version()
+    with _lock:
+        config = _snapshot
+        if config is None or config.version != version:
+            config = _snapshot = _build(version)
+    if has_app_context():
+        g._shop_config = config
+    return config
+
+
+def reset_cache() -> None:
+    global _snapshot
+    with _lock:
+        _snapshot = None
+    if has_app_context():
+        g.pop("_shop_config", None)
+
+
+def bump_shop_config_version(session: Optional[Session] = None) -> None:
+    """Stamp a new version inside the caller's transaction."""
+    session = session or db.session()
+    stmt = (
+        dialect_insert(db.engine, Setting.__table__)
+        .values(key=VERSION_KEY, value=uuid.uuid4().hex)
+    )
+    stmt = stmt.on_conflict_do_update(index_elements=["key"], set_={"value": stmt.excluded.value})
+    session.connection().execute(stmt)
+    session.info[_BUMP_KEY] = True
+
+
+def _touches_snapshot(obj) -> bool:
+    if isinstance(obj, (ShopProfile, ShopLocation)):
+        return True
+    return isinstance(obj, Setting) and obj.key in SNAPSHOT_SETTING_KEYS
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_config_write(session: Session, flush_context) -> None:
+    if any(_touches_snapshot(obj) for obj in (*session.new, *session.dirty, *session.deleted)):
+        bump_shop_config_version(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_local_snapshot(session: Session) -> None:
+    if session.info.pop(_BUMP_KEY, None):
+        reset_cache()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_bump(session: Session) -> None:
+    session.info.pop(_BUMP_KEY, None)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from typing import Optional
+
+from flask import current_app
+from sqlalchemy import func, inspect, or_, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from ..extensions import db
+from ..models import Item
+from .barcodes import mark_items_changed
+from .schema import begin_savepoint
+
+
+class InsufficientStockError(RuntimeError):
+    """Raised when a conditional decrement finds fewer units than requested."""
+
+    def __init__(self, item_id: int, requested: int, available: Optional[int]) -> None:
+        super().__init__(f"Insufficient stock for item {item_id}: requested {requested}, available {available}.")
+        self.item_id = item_id
+        self.requested = requested
+        self.available = available
+
+
+# Postgres deadlock and lock-not-available. A serialization failure (40001)
+# is not here: it needs a new snapshot, so only a fresh transaction helps.
+_RETRYABLE_SQLSTATES = {"40P01", "55P03"}
+
+
+def _is_lock_error(exc: OperationalError) -> bool:
+    """Whether ``exc`` is lock contention that a retry in this transaction can get past.
+
+    SQLite is never retried here: the driver already waits out a busy
+    database for its ``timeout``, and a transaction still "locked" after
+    that keeps its read lock, so retrying inside it cannot succeed.
+    """
+
+    orig = exc.orig
+    sqlstate = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+    return sqlstate in _RETRYABLE_SQLSTATES
+
+
+def _execute_with_retry(stmt):
+    """Run a single stock UPDATE, retrying briefly if it loses a lock.
+
+    Each attempt runs in a savepoint: Postgres aborts the transaction on a
+    deadlock, so the failed attempt is rolled back to the savepoint before
+    the next one. Any other ``OperationalError`` is raised straight away.
+    """
+
+    retries = max(int(current_app.config.get("STOCK_UPDATE_RETRIES", 3)), 0)
+    delay = 0.05
+    for attempt in range(retries + 1):
+        try:
+            with begin_savepoint(db.session):
+                return db.session.execute(stmt).scalar()
+        except OperationalError as exc:
+            if attempt == retries or not _is_lock_error(exc):
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+
+def _sync_loaded_item(item_id: int, current_stock: Optional[int]) -> None:
+    # The UPDATE bypasses the unit of work, so refresh any copy already
+    # loaded in this session without marking it dirty, and tell the barcode
+    # snapshot about the new count.
+    mark_items_changed([item_id])
+    key = inspect(Item).identity_key_from_primary_key((item_id,))
+    item = db.session.identity_map.get(key)
+    if item is not None:
+        set_committed_value(item, "current_stock", current_stock)
+
+
+def decrement_stock(item_id: int, quantity: int) -> Optional[int]:
+    """Take ``quantity`` units off an item in one conditional UPDATE.
+
+    Returns the remaining stock (``None`` for items without stock tracking).
+    Raises :class:`InsufficientStockError` if fewer units are on hand and
+    ``LookupError`` if the item does not exist. Nothing is read first, so two
+    cashiers selling the last unit cannot both succeed.
+    """
+
+    stmt = (
+        update(Item)
+        .where(Item.id == item_id)
+        .where(or_(Item.current_stock.is_(None), Item.current_stock >= quantity))
+        .values(current_stock=Item.current_stock - quantity, updated_at=datetime.utcnow())
+        .returning(Item.current_stock)
+        .execution_options(synchronize_session=False)
+    )
+    remaining = _execute_with_retry(stmt)
+    if remaining is None:
+        row = db.session.execute(select(Item.id, Item.current_stock).where(Item.id == item_id)).first()
+        if row is None:
+            raise LookupError(f"Item {item_id} not found.")
+        if row.current_stock is not None:
+            raise InsufficientStockError(item_id, quantity, row.current_stock)
+    _sync_loaded_item(item_id, remaining)
+    return remaining
+
+
+def increment_stock(item_id: int, quantity: int) -> Optional[int]:
+    """Add ``quantity`` units to an item and return the new stock level.
+
+    Returns ``None`` when the item does not exist.
+    """
+
+    stmt = (
+        update(Item)
+        .where(Item.id == item_id)
+        .values(current_stock=func.coalesce(Item.current_stock, 0) + quantity, updated_at=datetime.utcnow())
+        .returning(Item.current_stock)
+        .execution_options(synchronize_session=False)
+    )
+    updated = _execute_with_retry(stmt)
+    if updated is not None:
+        _sync_loaded_item(item_id, updated)
+    return updated